@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Benchmark"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - generate synthetic datasets with the schema of the start data (metadata, hydrochemistry with BDL markers
+      and isotopes), of any number of samples, by resampling the values of the article dataset
+    - time and memory-profile every stage of the scripts on these datasets: merge, BDL cleaning,
+      log transformation/standardisation, factor analysis, clustering, ion balance, table 1 and figure rendering
+    - save the results as baseline and compare later runs with it, to catch performance regressions
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import gc
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import DataPreparation
+import DataAnalysis
+import DataVisualisation
+
+#%% settings of the benchmark
+
+# numbers of samples of the synthetic datasets
+sizes = [100, 10000, 1000000]
+
+# stages that are skipped above a number of samples: exact Ward needs memory for all pairs of samples (above the limit
+# the clustering uses ScalableClustering.py), and the cross-section figure is skipped above render_limit samples (it
+# draws every sample; above 1000 samples it is rendered in the large-data mode of DataVisualisation.py)
+exact_clustering_limit = 20000
+render_limit = 100000
+
+# a stage is a regression when it is this factor slower than the baseline (and at least min_seconds slower)
+regression_factor = 1.25
+min_seconds = 0.05
+
+# seed of the synthetic datasets
+seed = 2024
+
+#%% synthetic datasets
+
+def synthetic_datasets(repo_dir, n_samples, outdir, seed=seed):
+    """
+    Writes synthetic start datasets with the schema of the article start data: the samples of the article dataset
+    are resampled (so the BDL markers, Type categories and the correlations between the variables are kept), the
+    numeric values get multiplicative noise and the transect distances additive noise.
+    The sample IDs of the article are kept for the first samples, because the data preparation corrects some of them.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - n_samples (int): Number of samples (at least the number of samples of the article).
+    - outdir (str): Directory to write the synthetic datasets.
+    - seed (int): Seed of the random generator. Default is seed.
+
+    Returns:
+    - paths (list): Paths of the synthetic metadata, hydrochemistry and isotope datasets.
+    """
+    rng = np.random.default_rng(seed)
+    paths_in = DataPreparation.input_paths(repo_dir)
+    encodings = [None, "ISO-8859-1", "ISO-8859-1"]
+
+    # sample IDs: the article samples and numbered synthetic samples
+    df_meta = pd.read_csv(paths_in[0], delimiter=';', index_col='Sample ID')
+    if n_samples < len(df_meta):
+        raise ValueError(f'At least {len(df_meta)} samples are needed (the samples of the article)')
+    index = pd.Index(list(df_meta.index) + [f'S {i}' for i in range(n_samples - len(df_meta))], name='Sample ID')
+    rows = np.concatenate([np.arange(len(df_meta)), rng.integers(0, len(df_meta), n_samples - len(df_meta))])
+
+    paths = []
+    for path_in, encoding in zip(paths_in, encodings):
+        # the same resampled samples in the three datasets
+        df_real = pd.read_csv(path_in, delimiter=';', index_col='Sample ID', encoding=encoding).reindex(df_meta.index)
+        df = pd.DataFrame(index=index)
+        for column in df_real.columns:
+            values = df_real[column].to_numpy()[rows]
+            if column == 'distance startpoint Yamuna [m]':
+                values = values + rng.normal(0, 500, n_samples)
+            elif pd.api.types.is_float_dtype(df_real[column]):
+                values = values * rng.lognormal(0, 0.1, n_samples)
+            df[column] = values
+        path = os.path.join(outdir, os.path.basename(path_in))
+        df.to_csv(path, sep=';', encoding=encoding)
+        paths.append(path)
+    return paths
+
+#%% run and measure the stages
+
+def measure(stage, function, *args, memory=True, **kwargs):
+    """
+    Runs a stage and measures the wall time, the CPU time and the peak of the memory allocated by Python and numpy.
+    The times are measured in a run without tracemalloc, because tracing every allocation makes Python-heavy stages
+    many times slower; the peak memory is measured in a second, traced run of the stage (the stages do not change
+    their input).
+
+    Parameters:
+    - stage (str): Name of the stage.
+    - function: Function of the stage.
+    - args, kwargs: Arguments of the function.
+    - memory (bool): If True, the stage is run a second time to measure the peak memory with tracemalloc. Default is True.
+
+    Returns:
+    - result: The result of the function (of the timed run).
+    - record (dict): Stage, wall time [s], CPU time [s] and peak memory [MB].
+    """
+    gc.collect()
+    start, start_cpu = time.perf_counter(), time.process_time()
+    result = function(*args, **kwargs)
+    seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - start_cpu
+
+    peak = np.nan
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1] / 1e6
+        finally:
+            tracemalloc.stop()
+    return result, {'stage': stage, 'seconds': seconds, 'cpu seconds': cpu_seconds, 'peak memory [MB]': peak}
+
+
+def render_crosssection(df, profile, POI, outpath):
+    """
+    Renders one cross-section figure (as a figure S6) and closes it.
+    """
+    return DataVisualisation.render_S6_figure(df, 'Cl [mg/L]', outpath, profile, POI)
+
+
+def table_1(df):
+    """
+    Table 1 (means per cluster and heatmap), with the figure closed afterwards.
+    """
+    result = DataVisualisation.table_1(df)
+    plt.close('all')
+    return result
+
+
+def benchmark_size(repo_dir, n_samples, workdir, memory=True):
+    """
+    Runs all stages on a synthetic dataset of n_samples samples.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - n_samples (int): Number of samples.
+    - workdir (str): Directory for the synthetic datasets and the figure.
+    - memory (bool): If True, the peak memory of each stage is measured. Default is True.
+
+    Returns:
+    - records (list): One record (dict) per stage.
+    """
+    paths = synthetic_datasets(repo_dir, n_samples, workdir)
+    records = []
+
+    def run(stage, function, *args, **kwargs):
+        result, record = measure(stage, function, *args, memory=memory, **kwargs)
+        records.append(record)
+        return result
+
+    # DataPreparation.py
+    df, hydrochem_columns = run('merge', DataPreparation.read_datasets, *paths)
+    df = run('BDL cleaning', DataPreparation.alter_dataset, df, hydrochem_columns)
+
+    # DataAnalysis.py
+    df_transformed = run('log transform and standardise', DataAnalysis.transform_dataset, df)
+    loadings, factor_variance, df_reduced = run('factor analysis', DataAnalysis.factor_analysis, df_transformed)
+    if n_samples <= exact_clustering_limit:
+        df_CA = run('clustering', DataAnalysis.cluster_analysis, df_reduced)
+    else:
+        df_CA = run('clustering (scalable)', DataAnalysis.cluster_analysis, df_reduced, scalable=True)
+    df = DataAnalysis.add_clusters(df, df_CA)
+    df = run('ion balance', DataAnalysis.electro_neutrality, df)
+
+    # DataVisualisation.py
+    run('table 1', table_1, df)
+    if n_samples <= render_limit:
+        profile, POI = DataVisualisation.load_crosssection_data(repo_dir)
+        run('figure rendering', render_crosssection, df, profile, POI, os.path.join(workdir, 'Figure_S6_benchmark.jpg'))
+
+    for record in records:
+        record['samples'] = n_samples
+    return records
+
+
+def run_benchmark(repo_dir, sizes=sizes, memory=True):
+    """
+    Runs the benchmark for all sizes.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - sizes (list): Numbers of samples. Default is sizes.
+    - memory (bool): If True, the peak memory of each stage is measured. Default is True.
+
+    Returns:
+    - results: DataFrame with per number of samples and stage the wall time, CPU time and peak memory.
+    """
+    records = []
+    for n_samples in sizes:
+        with tempfile.TemporaryDirectory() as workdir:
+            records += benchmark_size(repo_dir, n_samples, workdir, memory)
+    return pd.DataFrame(records).set_index(['samples', 'stage'])
+
+#%% baseline
+
+def environment():
+    """
+    Returns the versions of Python and the main packages and the machine, stored with the baseline.
+    """
+    import sklearn
+    import factor_analyzer
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'scikit-learn': sklearn.__version__,
+        'factor-analyzer': getattr(factor_analyzer, '__version__', 'unknown'),
+        'matplotlib': matplotlib.__version__,
+        'machine': platform.platform(),
+        'cpus': os.cpu_count(),
+        }
+
+
+def save_baseline(results, path):
+    """
+    Saves the benchmark results as baseline (JSON), with the environment.
+
+    Parameters:
+    - results: DataFrame from run_benchmark.
+    - path (str): Path of the JSON file.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    baseline = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'environment': environment(),
+        'results': results.reset_index().to_dict(orient='records'),
+        }
+    with open(path, 'w') as file:
+        json.dump(baseline, file, indent=1)
+
+
+def load_baseline(path):
+    """
+    Loads a baseline saved with save_baseline.
+
+    Returns:
+    - results: DataFrame with the results of the baseline.
+    - environment (dict): Environment of the baseline.
+    """
+    with open(path) as file:
+        baseline = json.load(file)
+    return pd.DataFrame(baseline['results']).set_index(['samples', 'stage']), baseline['environment']
+
+
+def compare_with_baseline(results, baseline, factor=regression_factor, min_seconds=min_seconds):
+    """
+    Compares benchmark results with a baseline.
+
+    Parameters:
+    - results: DataFrame from run_benchmark.
+    - baseline: DataFrame with the results of the baseline.
+    - factor (float): A stage is a regression when it is this factor slower than the baseline. Default is 1.25.
+    - min_seconds (float): ... and at least this number of seconds slower, to ignore noise of fast stages. Default is 0.05.
+
+    Returns:
+    - comparison: DataFrame with per number of samples and stage the seconds and peak memory of the baseline and
+      this run, the ratios and the column 'regression'.
+    """
+    columns = ['seconds', 'peak memory [MB]']
+    comparison = results[columns].join(baseline[columns], how='outer', lsuffix=' now', rsuffix=' baseline', sort=False)
+    comparison['time ratio'] = comparison['seconds now'] / comparison['seconds baseline']
+    comparison['memory ratio'] = comparison['peak memory [MB] now'] / comparison['peak memory [MB] baseline']
+    comparison['regression'] = ((comparison['time ratio'] > factor) & (comparison['seconds now'] - comparison['seconds baseline'] > min_seconds)) \
+                               | (comparison['memory ratio'] > factor)
+    return comparison
+
+#%% run benchmark
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # baseline of this machine; set update_baseline to True to replace it by the results of this run
+    path_baseline = os.path.join(repo_dir, 'Output', 'Benchmark', 'benchmark_baseline.json')
+    update_baseline = False
+
+    results = run_benchmark(repo_dir, sizes)
+    print(results)
+
+    if os.path.exists(path_baseline) and not update_baseline:
+        baseline, baseline_environment = load_baseline(path_baseline)
+        if baseline_environment != environment():
+            print('The environment differs from the environment of the baseline:', baseline_environment)
+        comparison = compare_with_baseline(results, baseline)
+        print(comparison)
+        print(f"{comparison['regression'].sum()} regressions")
+    else:
+        save_baseline(results, path_baseline)
+        print(f'Baseline saved: {path_baseline}')
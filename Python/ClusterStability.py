@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "ClusterStability"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - stability of the Factor Analysis and Cluster Analysis of DataAnalysis.py, by refitting both on
+      bootstrap, subsample or jackknife resamples of the groundwater samples
+    - the resamples are fitted in batches (FactorModel.py: one batched eigendecomposition per batch) and the
+      batches are spread over a pool of processes
+    - reports per pair of samples how often they are in the same cluster (co-assignment frequency),
+      confidence intervals of the factor loadings and a consensus clustering
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+import scipy.cluster.hierarchy as shc
+from scipy.optimize import linear_sum_assignment
+import DataAnalysis
+import DataCache
+import FactorModel
+
+#%% settings of the stability analysis
+
+# number of resamples (ignored for the jackknife, which has one resample per sample)
+n_resamples = 1000
+
+# resampling method: 'bootstrap' (with replacement), 'subsample' (without replacement) or 'jackknife' (leave one out)
+resampling = 'bootstrap'
+
+# fraction of the samples in each subsample
+subsample_fraction = 0.8
+
+# number of resamples fitted at once in one batch
+batch_size = 100
+
+# confidence level of the loading intervals
+confidence = 0.95
+
+# seed of the random resamples, so the results can be reproduced
+seed = 2024
+
+#%% resampling
+
+def resample_indices(n_samples, n_resamples=n_resamples, resampling=resampling, fraction=subsample_fraction, seed=seed):
+    """
+    Draws the row numbers of the resamples. All resamples are drawn up front, so the result does not depend on
+    the number of processes.
+
+    Parameters:
+    - n_samples (int): Number of samples in the dataset.
+    - n_resamples (int): Number of resamples. Default is n_resamples.
+    - resampling (str): 'bootstrap', 'subsample' or 'jackknife'. Default is resampling.
+    - fraction (float): Fraction of the samples in a subsample. Default is subsample_fraction.
+    - seed (int): Seed of the random generator. Default is seed.
+
+    Returns:
+    - indices: Array (resamples x samples per resample) with row numbers.
+    """
+    rng = np.random.default_rng(seed)
+    if resampling == 'bootstrap':
+        return rng.integers(0, n_samples, size=(n_resamples, n_samples))
+    if resampling == 'subsample':
+        n_subsample = int(round(fraction * n_samples))
+        return np.argsort(rng.random((n_resamples, n_samples)), axis=1)[:, :n_subsample]
+    if resampling == 'jackknife':
+        return np.array([np.delete(np.arange(n_samples), i) for i in range(n_samples)])
+    raise ValueError(f"Unknown resampling {resampling!r}, use 'bootstrap', 'subsample' or 'jackknife'")
+
+#%% fit a batch of resamples
+
+def ward_labels(scores, n_clusters):
+    """
+    Ward clustering of factor values (as AgglomerativeClustering in DataAnalysis.py) cut into n_clusters.
+
+    Parameters:
+    - scores: Array (samples x factors).
+    - n_clusters (int): Number of clusters.
+
+    Returns:
+    - labels: Array with the cluster number of each sample.
+    """
+    Z = shc.linkage(scores, method='ward', metric='euclidean')
+    return shc.fcluster(Z, n_clusters, criterion='maxclust')
+
+
+def fit_resamples(X, indices, reference, n_factors, n_clusters):
+    """
+    Fits the factor analysis and the clustering on a batch of resamples.
+
+    Parameters:
+    - X: Array (samples x variables) with the log transformed and standardised dataset.
+    - indices: Array (resamples x samples per resample) with row numbers.
+    - reference: Array (variables x factors) with the loadings of the full dataset.
+    - n_factors (int): Number of factors.
+    - n_clusters (int): Number of clusters.
+
+    Returns:
+    - result (dict): aligned loadings (resamples x variables x factors), congruence with the reference
+      (resamples x factors), co_assigned and co_sampled counts (samples x samples).
+    """
+    n_samples = X.shape[0]
+    loadings, scores, eigenvalues = FactorModel.fit_batch(X[indices], n_factors)
+    order, signs, congruence = FactorModel.align_factors(loadings, reference)
+
+    # count per pair of samples how often they are in the same resample and in the same cluster
+    # samples drawn more than once in a bootstrap resample are clustered once
+    co_assigned = np.zeros((n_samples, n_samples))
+    co_sampled = np.zeros((n_samples, n_samples))
+    for resample, rows in enumerate(indices):
+        samples, first = np.unique(rows, return_index=True)
+        labels = ward_labels(scores[resample, first], n_clusters)
+        co_assigned[np.ix_(samples, samples)] += labels[:, None] == labels[None, :]
+        co_sampled[np.ix_(samples, samples)] += 1
+
+    return {
+        'loadings': FactorModel.apply_alignment(loadings, order, signs),
+        'congruence': congruence,
+        'co_assigned': co_assigned,
+        'co_sampled': co_sampled,
+        }
+
+
+# data shared with the worker processes, set once per worker by init_stability_worker
+worker_data = {}
+
+
+def init_stability_worker(X, reference, n_factors, n_clusters):
+    """
+    Initialises a worker process with the dataset and the settings shared by all batches.
+    """
+    worker_data.update(X=X, reference=reference, n_factors=n_factors, n_clusters=n_clusters)
+
+
+def fit_resamples_task(indices):
+    """
+    Fits one batch of resamples in a worker process, with the data set by init_stability_worker.
+    """
+    return fit_resamples(worker_data['X'], indices, worker_data['reference'], worker_data['n_factors'], worker_data['n_clusters'])
+
+#%% consensus clustering
+
+def consensus_clustering(co_assignment, clusters, n_clusters):
+    """
+    Clusters the samples on the co-assignment frequencies (average linkage on 1 - frequency) and numbers the
+    consensus clusters after the best matching clusters of the full dataset.
+
+    Parameters:
+    - co_assignment: DataFrame (samples x samples) with the co-assignment frequencies.
+    - clusters: Series with the cluster of each sample in the full dataset (DataAnalysis.py).
+    - n_clusters (int): Number of clusters.
+
+    Returns:
+    - consensus: DataFrame with per sample the cluster, the consensus cluster and the stability
+      (mean co-assignment frequency with the other samples of its consensus cluster).
+    """
+    distance = 1 - co_assignment.to_numpy()
+    # pairs that were never in the same resample
+    distance = np.nan_to_num(distance, nan=1.0)
+    np.fill_diagonal(distance, 0)
+    Z = shc.linkage(shc.distance.squareform(distance, checks=False), method='average')
+    labels = shc.fcluster(Z, n_clusters, criterion='maxclust')
+
+    # number the consensus clusters after the clusters of the full dataset with the largest overlap
+    table = pd.crosstab(labels, clusters.to_numpy())
+    rows, columns = linear_sum_assignment(-table.to_numpy())
+    names = {table.index[r]: table.columns[c] for r, c in zip(rows, columns)}
+    consensus_labels = np.array([names.get(label, label + n_clusters) for label in labels])
+
+    # stability: mean co-assignment with the other samples of the same consensus cluster
+    same = consensus_labels[:, None] == consensus_labels[None, :]
+    np.fill_diagonal(same, False)
+    frequency = np.nan_to_num(co_assignment.to_numpy(), nan=0.0)
+    stability = (frequency * same).sum(axis=1) / np.maximum(same.sum(axis=1), 1)
+
+    return pd.DataFrame({
+        'cluster': clusters.to_numpy(),
+        'consensus cluster': consensus_labels,
+        'stability': stability,
+        }, index=co_assignment.index)
+
+#%% stability analysis
+
+def stability_analysis(df_transformed, clusters, n_factors=DataAnalysis.n_factors, n_clusters=DataAnalysis.n_clusters,
+                       n_resamples=n_resamples, resampling=resampling, fraction=subsample_fraction,
+                       batch_size=batch_size, confidence=confidence, seed=seed, n_jobs=None):
+    """
+    Refits the factor analysis and the clustering on resamples of the groundwater samples.
+
+    Parameters:
+    - df_transformed: DataFrame with the log transformed and standardised columns (DataAnalysis.transform_dataset).
+    - clusters: Series with the cluster of each sample in the full dataset (DataAnalysis.cluster_analysis).
+    - n_factors (int): Number of factors. Default is 3.
+    - n_clusters (int): Number of clusters. Default is 4.
+    - n_resamples (int): Number of resamples. Default is n_resamples.
+    - resampling (str): 'bootstrap', 'subsample' or 'jackknife'. Default is resampling.
+    - fraction (float): Fraction of the samples in a subsample. Default is subsample_fraction.
+    - batch_size (int): Number of resamples fitted at once. Default is batch_size.
+    - confidence (float): Confidence level of the loading intervals (percentiles of the resamples; jackknife
+      variance with t bounds for the jackknife). Default is 0.95.
+    - seed (int): Seed of the random resamples. Default is seed.
+    - n_jobs (int, optional): Number of processes. Default is None (number of CPUs). With 1 all batches are
+      fitted in this process.
+
+    Returns:
+    - results (dict): DataFrames 'co_assignment' (samples x samples), 'loadings' (estimate and confidence
+      interval per factor), 'congruence' (Tucker congruence of the factors with the full dataset) and
+      'consensus' (consensus clustering).
+    """
+    X = df_transformed.to_numpy(dtype=float)
+    samples = df_transformed.index
+    factors = ['F{}'.format(i+1) for i in range(n_factors)]
+
+    # loadings of the full dataset, the reference for the order and sign of the factors
+    reference = FactorModel.fit_batch(X[None], n_factors)[0][0]
+
+    # resamples in batches
+    indices = resample_indices(len(X), n_resamples, resampling, fraction, seed)
+    batches = [indices[start:start + batch_size] for start in range(0, len(indices), batch_size)]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(batches))
+    if n_jobs <= 1:
+        results = [fit_resamples(X, batch, reference, n_factors, n_clusters) for batch in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_stability_worker, initargs=(X, reference, n_factors, n_clusters)) as pool:
+            results = list(pool.map(fit_resamples_task, batches))
+
+    # co-assignment frequency: times in the same cluster / times in the same resample
+    co_assigned = sum(result['co_assigned'] for result in results)
+    co_sampled = sum(result['co_sampled'] for result in results)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        co_assignment = pd.DataFrame(co_assigned / co_sampled, index=samples, columns=samples)
+
+    # confidence intervals of the loadings: percentiles of the bootstrap or subsample loadings; the leave-one-out
+    # loadings differ only by about 1/n, so the jackknife uses its variance (n-1)/n * sum((theta_i - mean)^2) and
+    # t bounds around the estimate of the full dataset
+    loadings = np.concatenate([result['loadings'] for result in results])
+    alpha = (1 - confidence) / 2
+    if resampling == 'jackknife':
+        from scipy import stats
+        n = len(loadings)
+        se = np.sqrt((n - 1) / n * ((loadings - loadings.mean(axis=0)) ** 2).sum(axis=0))
+        t = stats.t.ppf(1 - alpha, n - 1)
+        lower, upper = reference - t * se, reference + t * se
+    else:
+        lower, upper = np.quantile(loadings, [alpha, 1 - alpha], axis=0)
+    df_loadings = pd.concat({
+        'estimate': pd.DataFrame(reference, index=df_transformed.columns, columns=factors),
+        'lower': pd.DataFrame(lower, index=df_transformed.columns, columns=factors),
+        'upper': pd.DataFrame(upper, index=df_transformed.columns, columns=factors),
+        }, axis=1).swaplevel(axis=1)[factors]
+
+    # congruence of the factors of the resamples with the factors of the full dataset
+    congruence = np.concatenate([result['congruence'] for result in results])
+    df_congruence = pd.DataFrame({
+        'mean congruence': congruence.mean(axis=0),
+        'min congruence': congruence.min(axis=0),
+        'fraction > 0.85': (congruence > 0.85).mean(axis=0),
+        }, index=factors)
+
+    consensus = consensus_clustering(co_assignment, clusters.loc[samples], n_clusters)
+    return {'co_assignment': co_assignment, 'loadings': df_loadings, 'congruence': df_congruence, 'consensus': consensus}
+
+#%% run stability analysis
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # read dataset (output DataPreparations.py) and repeat the analysis of DataAnalysis.py on the full dataset
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv'))
+    df_transformed = DataAnalysis.transform_dataset(df, DataAnalysis.columns_to_analyse)
+    loadings, factor_variance, df_reduced = DataAnalysis.factor_analysis(df_transformed)
+    df_CA = DataAnalysis.cluster_analysis(df_reduced)
+
+    # refit on the resamples
+    results = stability_analysis(df_transformed, df_CA['cluster'])
+    print(results['congruence'])
+    print(results['consensus'].sort_values('stability'))
+
+    # export the results as CSV files
+    outdir = os.path.join(repo_dir, 'Output', 'Stability')
+    os.makedirs(outdir, exist_ok=True)
+    for name, result in results.items():
+        result.to_csv(os.path.join(outdir, f'stability_{resampling}_{name}.csv'))
@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "ClusterSummary"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - summarise chosen columns per cluster in one grouped pass (samples sorted once by cluster, sums per cluster with
+      np.add.reduceat): count, mean, standard deviation, median and geometric mean
+    - the standardised cluster means relative to all groundwater samples (z-scores) of table 1 (DataVisualisation.py)
+    - keep the summary as state that is updated with new samples (mergeable moments, and a fixed-bin histogram per
+      group and column for the median), so table 1 can be refreshed without aggregating the whole archive again;
+      the size of the state does not grow with the number of samples and it can be saved and loaded as .npz file
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+
+#%% settings
+
+# name of the reference group (all groundwater samples) in the state
+reference_group = 'all groundwater'
+
+# histogram of the median: bins of equal width in log10 of the absolute value, from 10^min to 10^max, for the
+# positive and the negative values, with a bin for the values closer to zero and two overflow bins. With 100 bins per
+# decade a bin is 2.3% wide; the median is interpolated within its bin.
+sketch_decades = (-4, 6)
+sketch_bins_per_decade = 100
+sketch_side = (sketch_decades[1] - sketch_decades[0]) * sketch_bins_per_decade
+sketch_bins = 2 * sketch_side + 3
+
+#%% state of the summary
+
+def summary_state(df, columns, by='cluster', reference=None):
+    """
+    Summary state of the columns per group, in one grouped pass: the samples are sorted once by group and the sums of
+    each group follow from np.add.reduceat. The state holds per group and column the number of values, the mean, the
+    sum of squared deviations (M2), the sum of the logarithms and the number of values <= 0 (geometric mean), and a
+    histogram of the values (median, see sketch_bin).
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - columns (list): Columns to summarise.
+    - by (str): Column with the groups. Default is 'cluster'.
+    - reference: Boolean Series or array, True for the samples of the reference group (e.g. all groundwater samples),
+      which is added as group reference_group. Default is None (no reference group).
+
+    Returns:
+    - state (dict): The summary state, see merge_states and cluster_summary.
+    """
+    columns = list(columns)
+    if isinstance(df[by].dtype, pd.CategoricalDtype):
+        # categorical column (Schema.py): the codes are the groups
+        codes, groups = df[by].cat.codes.to_numpy(), [str(group) for group in df[by].cat.categories]
+    else:
+        codes, groups = pd.factorize(df[by].astype(str).where(df[by].notna()), sort=True)
+        groups = list(groups)
+
+    # samples of each group (samples without group are left out), and the samples of the reference group once more
+    rows = np.flatnonzero(codes >= 0)
+    if reference is not None:
+        reference_rows = np.flatnonzero(np.asarray(reference))
+        rows = np.concatenate([rows, reference_rows])
+        codes = np.concatenate([codes[codes >= 0], np.full(len(reference_rows), len(groups))])
+        groups.append(reference_group)
+    else:
+        codes = codes[codes >= 0]
+
+    # sort the samples by group once; starts and sizes of the groups for reduceat
+    order = np.argsort(codes, kind='stable')
+    present, starts = np.unique(codes[order], return_index=True)
+    sizes = np.diff(np.append(starts, len(codes)))
+    groups = [groups[code] for code in present]
+
+    # variables x samples: the values of a variable are contiguous (as in the DataFrame), so the sums are fast
+    X = np.take(df[columns].to_numpy(dtype=float).T, rows[order], axis=1)
+
+    valid = ~np.isnan(X)
+    positive = valid & (X > 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = np.add.reduceat(valid.astype(float), starts, axis=1).T
+        mean = np.add.reduceat(np.where(valid, X, 0), starts, axis=1).T / count
+        deviation = np.where(valid, X - np.repeat(mean.T, sizes, axis=1), 0)
+        log_sum = np.add.reduceat(np.log(np.where(positive, X, 1)), starts, axis=1).T
+    M2 = np.add.reduceat(deviation**2, starts, axis=1).T
+    nonpositive = np.add.reduceat((valid & ~positive).astype(float), starts, axis=1).T
+
+    # histogram of every group and column in one bincount: (group, column, bin) as one flat index
+    group_of_value = np.broadcast_to(np.repeat(np.arange(len(groups)), sizes), X.shape)
+    column_of_value = np.broadcast_to(np.arange(len(columns))[:, None], X.shape)
+    flat = (group_of_value[valid] * len(columns) + column_of_value[valid]) * sketch_bins + sketch_bin(X[valid])
+    sketch = np.bincount(flat, minlength=len(groups) * len(columns) * sketch_bins).reshape(len(groups), len(columns), sketch_bins)
+
+    frame = lambda values: pd.DataFrame(values, index=pd.Index(groups, name=by), columns=columns)
+    return {
+        'by': by,
+        'count': frame(count),
+        'mean': frame(mean),
+        'M2': frame(M2),
+        'log sum': frame(log_sum),
+        'nonpositive': frame(nonpositive),
+        'sketch': dict(zip(groups, sketch)),
+        }
+
+
+def merge_states(state_a, state_b):
+    """
+    Merges two summary states of the same columns (e.g. the archive and new samples), with the pairwise update of
+    the mean and M2 (Chan et al.): the result equals the state of all samples together.
+
+    Parameters:
+    - state_a, state_b (dict): Summary states from summary_state.
+
+    Returns:
+    - state (dict): The merged summary state.
+    """
+    groups = state_a['count'].index.union(state_b['count'].index, sort=False)
+    a = {name: state_a[name].reindex(groups).fillna(0) for name in ['count', 'mean', 'M2', 'log sum', 'nonpositive']}
+    b = {name: state_b[name].reindex(groups).fillna(0) for name in ['count', 'mean', 'M2', 'log sum', 'nonpositive']}
+
+    count = a['count'] + b['count']
+    delta = b['mean'] - a['mean']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = a['mean'] + delta * b['count'] / count
+        M2 = a['M2'] + b['M2'] + delta**2 * a['count'] * b['count'] / count
+
+    sketch = dict(state_a['sketch'])
+    for group, counts in state_b['sketch'].items():
+        sketch[group] = sketch[group] + counts if group in sketch else counts
+    return {
+        'by': state_a['by'],
+        'count': count,
+        'mean': mean.where(count > 0),
+        'M2': M2.where(count > 0),
+        'log sum': a['log sum'] + b['log sum'],
+        'nonpositive': a['nonpositive'] + b['nonpositive'],
+        'sketch': sketch,
+        }
+
+
+def update_state(state, df_new, reference=None):
+    """
+    Adds new samples to a summary state, without the samples of the state.
+
+    Parameters:
+    - state (dict): Summary state from summary_state.
+    - df_new: DataFrame with the new samples.
+    - reference: Boolean Series or array, True for the new samples of the reference group. Default is None.
+
+    Returns:
+    - state (dict): The updated summary state.
+    """
+    return merge_states(state, summary_state(df_new, state['count'].columns, state['by'], reference))
+
+#%% histogram of the median
+
+def sketch_bin(values):
+    """
+    Bin of the median histogram of every value: the bins are in the order of the values (negative overflow, the
+    negative bins, the bin around zero, the positive bins and the positive overflow).
+
+    Parameters:
+    - values: Array with the values (no NaN).
+
+    Returns:
+    - bins: Array with the bin numbers (0 to sketch_bins - 1).
+    """
+    with np.errstate(divide='ignore'):
+        k = np.floor((np.log10(np.abs(values)) - sketch_decades[0]) * sketch_bins_per_decade)
+    k = np.clip(k, -1, sketch_side).astype(np.intp)
+    return np.where(values < 0, sketch_side - k, sketch_side + 2 + k)
+
+
+def sketch_quantile(counts, q):
+    """
+    Quantile from median histograms, interpolated within the bins (linear in the rank and in log10 of the value) and
+    between the two nearest ranks (as np.nanquantile).
+
+    Parameters:
+    - counts: Array (... x sketch_bins) with the histograms.
+    - q (float): Quantile, e.g. 0.5 for the median.
+
+    Returns:
+    - values: Array (...) with the quantiles (NaN for empty histograms).
+    """
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum(axis=-1)
+    cumulative = np.cumsum(counts, axis=-1)
+    rank = q * np.maximum(total - 1, 0)
+
+    def value_at(rank):
+        # bin of the rank and the position of the rank within the bin (0 to 1)
+        b = (cumulative <= rank[..., None]).sum(axis=-1).clip(max=sketch_bins - 1)
+        before = np.take_along_axis(cumulative - counts, b[..., None], axis=-1)[..., 0]
+        in_bin = np.take_along_axis(counts, b[..., None], axis=-1)[..., 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            fraction = (rank - before + 0.5) / in_bin
+        positive = b - sketch_side - 2
+        negative = sketch_side - b
+        magnitude = np.where(b > sketch_side + 1, positive + fraction, negative + 1 - fraction)
+        magnitude = 10 ** (sketch_decades[0] + np.clip(magnitude, 0, sketch_side) / sketch_bins_per_decade)
+        return np.where(b == sketch_side + 1, 0, np.where(b > sketch_side + 1, magnitude, -magnitude))
+
+    low, high = np.floor(rank), np.ceil(rank)
+    values = value_at(low) + (rank - low) * (value_at(high) - value_at(low))
+    return np.where(total > 0, values, np.nan)
+
+#%% summary
+
+def cluster_summary(state, reference=reference_group):
+    """
+    Statistics per group from a summary state.
+
+    Parameters:
+    - state (dict): Summary state from summary_state.
+    - reference (str, optional): Reference group of the z-scores: (mean of the group - mean of the reference group) /
+      standard deviation of the reference group. Default is reference_group.
+
+    Returns:
+    - summary (dict): Per statistic ('count', 'mean', 'std', 'median' (from the histograms, within about 1% of the
+      value) 'geometric mean' and 'z-score') a DataFrame
+      with the variables as rows and the groups as columns (sorted, the reference group last). The reference group is
+      left out of the z-scores.
+    """
+    groups = sorted(group for group in state['count'].index if group != reference)
+    if reference in state['count'].index:
+        groups.append(reference)
+    count, mean = state['count'].loc[groups], state['mean'].loc[groups]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(state['M2'].loc[groups] / (count - 1)).where(count > 1)
+        geometric_mean = np.exp(state['log sum'].loc[groups] / count).where((count > 0) & (state['nonpositive'].loc[groups] == 0))
+    # median from the histograms (groups without values of a variable give NaN)
+    median = pd.DataFrame(sketch_quantile(np.stack([state['sketch'][group] for group in groups]), 0.5), index=count.index, columns=count.columns)
+
+    summary = {'count': count, 'mean': mean, 'std': std, 'median': median, 'geometric mean': geometric_mean}
+    summary = {name: frame.transpose() for name, frame in summary.items()}
+    if reference in groups:
+        z_score = summary['mean'][groups[:-1]].sub(summary['mean'][reference], axis=0).div(summary['std'][reference], axis=0)
+        summary['z-score'] = z_score
+    return summary
+
+#%% save and load the state
+
+def save_state(state, path):
+    """
+    Saves a summary state as .npz file.
+
+    Parameters:
+    - state (dict): Summary state from summary_state.
+    - path (str): Path of the .npz file.
+    """
+    groups = list(state['count'].index)
+    sketch = np.stack([state['sketch'][group] for group in groups])
+    np.savez_compressed(path, by=state['by'], groups=np.array(groups, dtype=str), columns=np.array(state['count'].columns, dtype=str),
+                        sketch=sketch, **{name: state[name].to_numpy() for name in ['count', 'mean', 'M2', 'log sum', 'nonpositive']})
+
+
+def load_state(path):
+    """
+    Loads a summary state saved with save_state.
+
+    Parameters:
+    - path (str): Path of the .npz file.
+
+    Returns:
+    - state (dict): The summary state.
+    """
+    with np.load(path) as file:
+        by = str(file['by'])
+        index, columns = pd.Index(file['groups'].tolist(), name=by), file['columns'].tolist()
+        state = {'by': by}
+        for name in ['count', 'mean', 'M2', 'log sum', 'nonpositive']:
+            state[name] = pd.DataFrame(file[name], index=index, columns=columns)
+        state['sketch'] = dict(zip(index, file['sketch']))
+    return state
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Correlation"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - pairwise-complete Pearson and Spearman correlation matrices (each pair of variables over the samples where both
+      are measured, as DataFrame.corr), computed with matrix products over blocks of columns instead of pair by pair
+    - the number of samples of each pair (pair counts), for variables with patchy coverage
+    - cache the correlation matrix and the ordering (linkage) of the clustermap of figure S1 (DataVisualisation.py)
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import hashlib
+import DataCache
+
+#%% settings
+
+# number of columns per block of the matrix products
+block_size = 256
+
+# maximum memory of the ranks of one block of columns (Spearman with missing values) [bytes]
+block_memory = 256e6
+
+# minimum number of samples of a pair, pairs with fewer samples get NaN (as DataFrame.corr)
+min_periods = 1
+
+# correlation matrices and linkages calculated in this session, by key of the data (see cached_correlation)
+correlation_cache = {}
+
+#%% ranks
+
+def rank_columns(X):
+    """
+    Average ranks (ties get the mean of their ranks) of each column, ignoring NaN, for all columns at once.
+
+    Parameters:
+    - X: Array (samples x variables), NaN for missing values.
+
+    Returns:
+    - ranks: Array (samples x variables) with the ranks 1..n of each column, NaN where X is NaN.
+    """
+    n, p = X.shape
+    ranks = np.full((n, p), np.nan)
+    if n == 0 or p == 0:
+        return ranks
+
+    # sort each column (NaN last) and number the groups of equal values, with one numbering for all columns
+    order = np.argsort(X, axis=0, kind='mergesort')
+    sorted_values = np.take_along_axis(X, order, axis=0)
+    new_group = np.ones((n, p), dtype=bool)
+    new_group[1:] = sorted_values[1:] != sorted_values[:-1]
+    group = np.cumsum(new_group, axis=0) - 1
+    group += np.concatenate([[0], np.cumsum(group[-1] + 1)[:-1]])
+
+    # mean position of each group
+    position = np.broadcast_to(np.arange(1, n + 1, dtype=float)[:, None], (n, p))
+    mean_position = np.bincount(group.ravel(), weights=position.ravel()) / np.bincount(group.ravel())
+    np.put_along_axis(ranks, order, mean_position[group], axis=0)
+    ranks[np.isnan(X)] = np.nan
+    return ranks
+
+
+def ranks_within(x, mask):
+    """
+    Average ranks of one variable within the samples where each other variable is measured, for all variables at once:
+    the ranks follow from the cumulative number of measured samples in the sorted order of the variable.
+
+    Parameters:
+    - x: Array with the values of the variable (no NaN).
+    - mask: Boolean array (samples x variables), True where the other variables are measured.
+
+    Returns:
+    - ranks: Array (samples x variables) with the ranks of x within the samples of each variable (valid where mask is True).
+    """
+    order = np.argsort(x, kind='mergesort')
+    sorted_x = x[order]
+    new_group = np.ones(len(x), dtype=bool)
+    new_group[1:] = sorted_x[1:] != sorted_x[:-1]
+    starts = np.flatnonzero(new_group)
+    ends = np.append(starts[1:], len(x))
+    group = np.cumsum(new_group) - 1
+
+    # number of measured samples before each group of equal values and within it
+    cumulative = np.zeros((len(x) + 1, mask.shape[1]))
+    np.cumsum(mask[order], axis=0, dtype=float, out=cumulative[1:])
+    before = cumulative[starts]
+    within = cumulative[ends] - before
+
+    ranks = np.empty((len(x), mask.shape[1]))
+    ranks[order] = (before + (within + 1) / 2)[group]
+    return ranks
+
+#%% correlation matrices
+
+def rank_correlation(A, B, mask):
+    """
+    Pearson correlation of the ranks in each column of A with the same column of B, over the samples where mask is
+    True. Both are ranks within these samples, so the mean of both is (count + 1) / 2.
+
+    Parameters:
+    - A, B: Arrays (samples x variables) with the ranks.
+    - mask: Boolean array (samples x variables).
+
+    Returns:
+    - r: Array with the correlation per column.
+    """
+    center = (mask.sum(axis=0) + 1) / 2
+    dA = np.where(mask, A - center, 0)
+    dB = np.where(mask, B - center, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.einsum('ij,ij->j', dA, dB) / np.sqrt(np.einsum('ij,ij->j', dA, dA) * np.einsum('ij,ij->j', dB, dB))
+
+
+def pair_counts(X, block_size=block_size):
+    """
+    Number of samples where both variables of each pair are measured.
+
+    Parameters:
+    - X: Array (samples x variables), NaN for missing values.
+    - block_size (int): Number of columns per block. Default is block_size.
+
+    Returns:
+    - counts: Integer array (variables x variables).
+    """
+    M = (~np.isnan(X)).astype(float)
+    p = X.shape[1]
+    counts = np.empty((p, p), dtype=np.int64)
+    for a in range(0, p, block_size):
+        for b in range(a, p, block_size):
+            block = np.rint(M[:, a:a+block_size].T @ M[:, b:b+block_size]).astype(np.int64)
+            counts[a:a+block_size, b:b+block_size] = block
+            counts[b:b+block_size, a:a+block_size] = block.T
+    return counts
+
+
+def pairwise_pearson(X, min_periods=min_periods, block_size=block_size):
+    """
+    Pairwise-complete Pearson correlation matrix. For each block of column pairs, the sums over the samples where
+    both variables are measured follow from matrix products of the values (missing values as 0) and the masks.
+
+    Parameters:
+    - X: Array (samples x variables), NaN for missing values.
+    - min_periods (int): Minimum number of samples of a pair. Default is min_periods.
+    - block_size (int): Number of columns per block. Default is block_size.
+
+    Returns:
+    - corr: Array (variables x variables).
+    """
+    M = ~np.isnan(X)
+    Mf = M.astype(float)
+    p = X.shape[1]
+
+    # center each column on its mean, so that the sums of squares do not lose precision
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X0 = np.where(M, X - np.where(M, X, 0).sum(axis=0) / M.sum(axis=0), 0)
+    X2 = X0**2
+
+    corr = np.empty((p, p))
+    for a in range(0, p, block_size):
+        A, A2, MA = X0[:, a:a+block_size], X2[:, a:a+block_size], Mf[:, a:a+block_size]
+        for b in range(a, p, block_size):
+            B, B2, MB = X0[:, b:b+block_size], X2[:, b:b+block_size], Mf[:, b:b+block_size]
+            n = MA.T @ MB
+            sum_a, sum_b = A.T @ MB, MA.T @ B
+            with np.errstate(invalid='ignore', divide='ignore'):
+                covariance = A.T @ B - sum_a * sum_b / n
+                variance_a = A2.T @ MB - sum_a**2 / n
+                variance_b = MA.T @ B2 - sum_b**2 / n
+                r = covariance / np.sqrt(variance_a * variance_b)
+            r[n < max(min_periods, 1)] = np.nan
+            corr[a:a+block_size, b:b+block_size] = r
+            corr[b:b+block_size, a:a+block_size] = r.T
+
+    # the diagonal is exactly 1 (NaN for constant variables)
+    diagonal = np.diag(corr)
+    np.fill_diagonal(corr, np.where(np.isnan(diagonal), np.nan, 1.0))
+    return np.clip(corr, -1, 1)
+
+
+def pairwise_spearman(X, min_periods=min_periods, block_size=block_size, block_memory=block_memory):
+    """
+    Pairwise-complete Spearman correlation matrix: for each pair, the ranks are taken within the samples where both
+    variables are measured (as DataFrame.corr(method='spearman')).
+    Without missing values this is the Pearson correlation of the ranks. Otherwise the ranks of a variable within the
+    samples of every other variable follow from one cumulative sum (ranks_within), for a block of variables at once,
+    instead of ranking each pair again.
+
+    Parameters:
+    - X: Array (samples x variables), NaN for missing values.
+    - min_periods (int): Minimum number of samples of a pair. Default is min_periods.
+    - block_size (int): Maximum number of columns per block. Default is block_size.
+    - block_memory (float): Maximum memory of the ranks of one block [bytes]. Default is block_memory.
+
+    Returns:
+    - corr: Array (variables x variables).
+    """
+    M = ~np.isnan(X)
+    if M.all():
+        return pairwise_pearson(rank_columns(X), min_periods, block_size)
+
+    n, p = X.shape
+    corr = np.full((p, p), np.nan)
+    size = int(max(1, min(block_size, block_memory // (8 * max(n * p, 1)))))
+    for a in range(0, p, size):
+        block = slice(a, a + size)
+        M_block = M[:, block]
+
+        # ranks of each variable of the block within the samples of every variable (block x variables x samples)
+        ranks_block = np.full((M_block.shape[1], p, n), np.nan)
+        for k, i in enumerate(range(a, a + M_block.shape[1])):
+            rows = M[:, i]
+            ranks_block[k][:, rows] = ranks_within(X[rows, i], M[rows]).T
+
+        # ranks of each other variable within the samples of the variables of the block, and the correlation
+        for j in range(a, p):
+            rows = M[:, j]
+            ranks_j = ranks_within(X[rows, j], M_block[rows])
+            corr[block, j] = rank_correlation(ranks_block[:, j, rows].T, ranks_j, M_block[rows])
+
+    # the same value for (i, j) and (j, i)
+    corr = np.triu(corr) + np.triu(corr, 1).T
+    corr[pair_counts(X, block_size) < max(min_periods, 1)] = np.nan
+    return np.clip(corr, -1, 1)
+
+
+def correlation_matrix(df, method='pearson', min_periods=min_periods, block_size=block_size):
+    """
+    Pairwise-complete correlation matrix and pair counts of the columns of a dataframe.
+
+    Parameters:
+    - df: DataFrame with numeric columns, NaN for missing values.
+    - method (str): 'pearson' or 'spearman'. Default is 'pearson'.
+    - min_periods (int): Minimum number of samples of a pair. Default is min_periods.
+    - block_size (int): Number of columns per block. Default is block_size.
+
+    Returns:
+    - corr: DataFrame with the correlation matrix.
+    - counts: DataFrame with the number of samples of each pair.
+    """
+    X = df.to_numpy(dtype=float)
+    if method == 'pearson':
+        corr = pairwise_pearson(X, min_periods, block_size)
+    elif method == 'spearman':
+        corr = pairwise_spearman(X, min_periods, block_size)
+    else:
+        raise ValueError(f"Unknown correlation method '{method}', use 'pearson' or 'spearman'")
+    columns = df.columns
+    return pd.DataFrame(corr, index=columns, columns=columns), pd.DataFrame(pair_counts(X, block_size), index=columns, columns=columns)
+
+#%% clustermap ordering and cache
+
+def correlation_linkage(corr, method='complete'):
+    """
+    Linkage of the rows of a correlation matrix (Euclidean distance), as computed by seaborn's clustermap.
+    Pairs without correlation (NaN) count as 0.
+
+    Parameters:
+    - corr: DataFrame with the correlation matrix.
+    - method (str): Linkage method. Default is 'complete'.
+
+    Returns:
+    - linkage: Array with the linkage matrix (scipy format).
+    """
+    from scipy.cluster import hierarchy
+    return hierarchy.linkage(np.nan_to_num(corr.to_numpy()), method=method, metric='euclidean')
+
+
+def data_key(df, *settings):
+    """
+    Key of the content of a dataframe (values, index and columns) and settings.
+    """
+    sha = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    sha.update(repr((list(df.columns), settings)).encode('utf-8'))
+    return sha.hexdigest()[:16]
+
+
+def cached_correlation(df, method='pearson', linkage_method='complete', cachedir=None):
+    """
+    Correlation matrix, pair counts and linkage of the clustermap, calculated once per dataset: they are kept for
+    this session and, with cachedir, stored as Parquet files (see DataCache.py).
+
+    Parameters:
+    - df: DataFrame with numeric columns, NaN for missing values.
+    - method (str): 'pearson' or 'spearman'. Default is 'pearson'.
+    - linkage_method (str): Linkage method of the clustermap. Default is 'complete'.
+    - cachedir (str, optional): Directory of the cache files. Default is None (only kept for this session).
+
+    Returns:
+    - corr: DataFrame with the correlation matrix.
+    - counts: DataFrame with the number of samples of each pair.
+    - linkage: Array with the linkage matrix.
+    """
+    key = data_key(df, method, linkage_method, min_periods)
+    if key in correlation_cache:
+        return correlation_cache[key]
+
+    names = [f'correlation_{method}', f'correlation_{method}_counts', f'correlation_{method}_linkage']
+    cached = [DataCache.read_cache(cachedir, name, key) for name in names] if cachedir else [None]
+    if all(frame is not None for frame in cached):
+        corr, counts, linkage = cached[0], cached[1], cached[2].to_numpy()
+    else:
+        corr, counts = correlation_matrix(df, method)
+        linkage = correlation_linkage(corr, linkage_method)
+        if cachedir:
+            linkage_frame = pd.DataFrame(linkage, columns=['cluster 1', 'cluster 2', 'distance', 'size'])
+            for frame, name in zip([corr, counts, linkage_frame], names):
+                DataCache.write_cache(frame, cachedir, name, key)
+    correlation_cache[key] = corr, counts, linkage
+    return correlation_cache[key]
@@ -5,65 +5,90 @@ Author: "Frank van Broekhoven"
 ORCiD: https://orcid.org/0009-0008-1593-9842
 Date: '2024-06-24'
 General info:
-    
+
     This script is part of the article
     - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
-    
+
     This script is used for:
     - log transform and standardize the variables
     - Factor analysis with varimax rotation
     - Agglomerative Hierarchical Clustering analysis
     - Check electro-neutrality
     - plots supplementary figures S3 and S4
+    - save the fitted transformation, factor analysis and cluster centroids as model to score new samples (ScoringModel.py)
 
 """
 #%% import modules
 import pandas as pd
 import numpy as np
+import heapq
 import os
-from factor_analyzer.factor_analyzer import FactorAnalyzer
-from sklearn.cluster import AgglomerativeClustering
-import scipy.cluster.hierarchy as shc
-import matplotlib.pyplot as plt
-import seaborn as sns
+import DataCache
+import IonChemistry
+import Instrumentation
+import ScoringModel
 
-#%% read combined and altered dataset
+#%% settings of the Factor Analysis and Cluster Analysis
 
-# set path
-repo_dir = r'C:\GitHub\Temp_CleaningTheGanga_Paper1' # change this to the location where you stored the reposiotry
-path = os.path.join(repo_dir, r'Data\WorkingData\prepared_dataset_v1.csv')
-# read dataset (output DataPreparations.py)
-df = pd.read_csv(path, index_col=('Sample ID'))
+# groundwater sample types
+groundwater_types = ['deep tubewell', 'shallow tubewell']
 
+#take field EC values, and lab pH values, drop TDS
+columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]',
+                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]',
+                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]',
+                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
+                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]',
+                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]']
+
+# number of factors, rotation and method of the factor analysis
+n_factors = 3
+rotation = 'varimax'
+method = 'principal' # default method='minres'
+
+# number of clusters
+n_clusters = 4
 
 #%% Factor Analysis and Cluster Analysis
 
 ### step 1: select only groundwater samples and columns to analyse
 
-# select groundwater samples
-df_GW = df.loc[df['Type'].isin(['deep tubewell', 'shallow tubewell'])]
+def select_groundwater(df, columns=columns_to_analyse):
+    """
+    Selects the groundwater samples and the columns to analyse.
 
-#take field EC values, and lab pH values, drop TDS
-columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]', 
-                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]', 
-                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]', 
-                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
-                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]', 
-                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]']
-df_selection = df_GW[columns_to_analyse]
+    Parameters:
+    - df: DataFrame with all samples.
+    - columns (list): Columns to analyse. Default is columns_to_analyse.
+
+    Returns:
+    - df_selection: DataFrame with the groundwater samples and the selected columns.
+    """
+    df_GW = df.loc[df['Type'].isin(groundwater_types)]
+    return df_GW[columns]
 
 
 ### step 2: logarithmically transformed and standardised
 
-# Log transformation expect for pH, as pH is already logarithmic
-df_log = pd.DataFrame()
-for variable in columns_to_analyse:
-    if variable in ('pH.1'):
-        print(variable, ' pH is not log transformed, because it is already a log')
-        df_log[variable] = df_selection[variable]
-    else:
-        print('log transform ', variable)
-        df_log[f'{variable} log'] = np.log(df_selection[variable])
+def log_transform(df_selection):
+    """
+    Log transformation expect for pH, as pH is already logarithmic
+
+    Parameters:
+    - df_selection: DataFrame with the columns to analyse.
+
+    Returns:
+    - df_log: DataFrame with the log transformed columns, named '<column> log'.
+    """
+    df_log = pd.DataFrame()
+    for variable in df_selection.columns:
+        if variable in ('pH.1'):
+            print(variable, ' pH is not log transformed, because it is already a log')
+            df_log[variable] = df_selection[variable]
+        else:
+            print('log transform ', variable)
+            df_log[f'{variable} log'] = np.log(df_selection[variable])
+    return df_log
 
 # Standardisation (Z-score): resulting in data with a mean of zero and a standard deviation of one
 def standardize(X):
@@ -77,104 +102,324 @@ def standardize(X):
     # Standardization
     Z = (X - X_mean) / X_std
     return Z
-df_transformed = standardize(df_log)
 
 
-### step 3: Factor analysis with varimax rotation
+@Instrumentation.instrumented('transform')
+def transform_dataset(df, columns=columns_to_analyse):
+    """
+    Selects the groundwater samples and columns to analyse, log transforms and standardises them (steps 1 and 2).
 
-# set number of factors
-n_factors = 3
-# perform factor analysis with varimax rotation
-fa = FactorAnalyzer(n_factors=n_factors, rotation='varimax', method='principal') # default method='minres'
-fa.fit(df_transformed)
+    Parameters:
+    - df: DataFrame with all samples.
+    - columns (list): Columns to analyse. Default is columns_to_analyse.
 
-# loadings and factor variance (table S2)
-loadings = pd.DataFrame(fa.loadings_,  columns=['F{}'.format(i+1) for i in range(n_factors)], index=df_transformed.columns)
-print('Factor Loadings \n%s' %loadings)
-factor_variance = pd.DataFrame(fa.get_factor_variance(), columns=['F{}'.format(i+1) for i in range(n_factors)], index=['sum squared loadings', 'proportional variance', 'cumulative variance'])
-print(factor_variance)
+    Returns:
+    - df_transformed: DataFrame with the log transformed and standardised columns of the groundwater samples.
+    """
+    df_selection = select_groundwater(df, columns)
+    df_log = log_transform(df_selection)
+    return standardize(df_log)
 
-# dataset with factors
-df_reduced = pd.DataFrame(fa.transform(df_transformed), columns=['F{}'.format(i+1) for i in range(n_factors)], index=df_transformed.index)
 
+### step 3: Factor analysis with varimax rotation
 
-### step 4: Agglomerative Hierarchical Clustering
+@Instrumentation.instrumented('factor analysis')
+def factor_analysis(df_transformed, n_factors=n_factors, rotation=rotation, method=method):
+    """
+    Performs the factor analysis.
+
+    Parameters:
+    - df_transformed: DataFrame with the log transformed and standardised columns.
+    - n_factors (int): Number of factors. Default is 3.
+    - rotation (str): Rotation of the factors. Default is 'varimax'.
+    - method (str): Fitting method of the factor analysis. Default is 'principal'.
+
+    Returns:
+    - loadings: DataFrame with the factor loadings (table S2).
+    - factor_variance: DataFrame with the factor variance (table S2).
+    - df_reduced: DataFrame with the factor values of each sample.
+    """
+    # perform factor analysis with varimax rotation (factor_analyzer imports scikit-learn, only imported when needed)
+    from factor_analyzer.factor_analyzer import FactorAnalyzer
+    fa = FactorAnalyzer(n_factors=n_factors, rotation=rotation, method=method)
+    fa.fit(df_transformed)
+
+    # loadings and factor variance (table S2)
+    loadings = pd.DataFrame(fa.loadings_,  columns=['F{}'.format(i+1) for i in range(n_factors)], index=df_transformed.columns)
+    print('Factor Loadings \n%s' %loadings)
+    factor_variance = pd.DataFrame(fa.get_factor_variance(), columns=['F{}'.format(i+1) for i in range(n_factors)], index=['sum squared loadings', 'proportional variance', 'cumulative variance'])
+    print(factor_variance)
+
+    # dataset with factors
+    df_reduced = pd.DataFrame(fa.transform(df_transformed), columns=['F{}'.format(i+1) for i in range(n_factors)], index=df_transformed.index)
+    return loadings, factor_variance, df_reduced
 
-#applied CA with FA to reduce variables
-df_CA = df_reduced.copy()
 
-# visualize clusters with dendrogram (figure S3)
-dendrogram = True
-if dendrogram:
-    plt.figure(figsize=(10, 7))
+### step 4: Agglomerative Hierarchical Clustering
+# the Ward linkage is computed once; the dendrogram and the clusters for any number of clusters are derived from it
+
+@Instrumentation.instrumented('ward linkage')
+def ward_linkage(df_reduced):
+    """
+    Computes the Ward linkage (hierarchy) of the factor values.
+
+    Parameters:
+    - df_reduced: DataFrame with the factor values of each sample.
+
+    Returns:
+    - Z: Linkage matrix (scipy format: the two merged clusters, the distance and the number of samples per merge).
+    """
+    import scipy.cluster.hierarchy as shc
+    return shc.linkage(df_reduced, method='ward', metric="euclidean")
+
+
+def cut_linkage(Z, n_clusters=n_clusters):
+    """
+    Cuts the hierarchy into n_clusters clusters. The clusters are numbered as AgglomerativeClustering
+    (scikit-learn) numbers them, so the cluster numbers of the article are kept.
+
+    Parameters:
+    - Z: Linkage matrix (see ward_linkage).
+    - n_clusters (int): Number of clusters. Default is 4.
+
+    Returns:
+    - labels: Array with the cluster number (starting at 1) of each sample.
+    """
+    n_leaves = len(Z) + 1
+    children = Z[:, :2].astype(int)
+
+    # split the top merges, largest node number first (as scikit-learn)
+    nodes = [-(2 * n_leaves - 2)]
+    for _ in range(n_clusters - 1):
+        these_children = children[-nodes[0] - n_leaves]
+        heapq.heappush(nodes, -these_children[0])
+        heapq.heappushpop(nodes, -these_children[1])
+
+    # all samples below each node of the cut get the number of the node
+    labels = np.zeros(n_leaves, dtype=int)
+    for i, node in enumerate(nodes):
+        stack = [-node]
+        while stack:
+            current = stack.pop()
+            if current < n_leaves:
+                labels[current] = i
+            else:
+                stack.extend(children[current - n_leaves])
+    return labels + 1  # plus 1 because python starts with 0
+
+
+def cluster_sweep(Z, index, cluster_range=range(2, 11)):
+    """
+    Cluster numbers of the samples for a range of numbers of clusters, all cut from the same hierarchy.
+
+    Parameters:
+    - Z: Linkage matrix (see ward_linkage).
+    - index: Index of the samples (e.g. df_reduced.index).
+    - cluster_range (iterable): Numbers of clusters. Default is 2 to 10.
+
+    Returns:
+    - df_sweep: DataFrame with a column per number of clusters.
+    """
+    return pd.DataFrame({k: cut_linkage(Z, k) for k in cluster_range}, index=index)
+
+
+@Instrumentation.instrumented('figure S3')
+def plot_dendrogram(df_CA, outpath_S3=None, show=True, Z=None):
+    """
+    Visualize clusters with dendrogram (figure S3).
+
+    Parameters:
+    - df_CA: DataFrame with the factor values of each sample.
+    - outpath_S3 (str, optional): Path to export the figure as jpg file. Default is None.
+    - show (bool): If True, shows the figure. Default is True.
+    - Z (optional): Linkage matrix (see ward_linkage). Default is None (computed from df_CA).
+
+    Returns:
+    - fig: The created figure.
+    """
+    import matplotlib.pyplot as plt
+    import scipy.cluster.hierarchy as shc
+    fig = plt.figure(figsize=(10, 7))
     plt.title("Dendrogram")
-    clusters = shc.linkage(df_CA, method='ward', metric="euclidean")
+    clusters = ward_linkage(df_CA) if Z is None else Z
     shc.dendrogram(Z=clusters, labels=df_CA.index)
-    plt.show()
-    
+    if show:
+        plt.show()
+
     # Export figure S3 as a jpg file
-    outpath_S3 = os.path.join(repo_dir, 'Output/Supplementary Material/Figure_S3.jpg')
-    plt.savefig(outpath_S3, bbox_inches="tight")
+    if outpath_S3:
+        fig.savefig(outpath_S3, bbox_inches="tight")
+    return fig
+
+
+@Instrumentation.instrumented('clustering')
+def cluster_analysis(df_reduced, n_clusters=n_clusters, scalable=False, Z=None):
+    """
+    Performs the agglomerative hierarchical clustering (Ward) on the factor values.
+
+    Parameters:
+    - df_reduced: DataFrame with the factor values of each sample.
+    - n_clusters (int): Number of clusters. Default is 4.
+    - scalable (bool): If True, Ward is run on micro-clusters of the samples (ScalableClustering.py), for datasets
+      that are too large for exact Ward. Default is False.
+    - Z (optional): Linkage matrix (see ward_linkage). Default is None (computed from df_reduced).
+
+    Returns:
+    - df_CA: Copy of df_reduced with the column 'cluster' (cluster numbers starting at 1).
+    """
+    # large datasets: Ward on micro-clusters, memory and time do not grow with the square of the samples
+    if scalable:
+        import ScalableClustering
+        df_CA, Z = ScalableClustering.scalable_cluster_analysis(df_reduced, n_clusters)
+        return df_CA
+
+    #applied CA with FA to reduce variables
+    df_CA = df_reduced.copy()
+
+    # cut the hierarchy
+    if Z is None:
+        Z = ward_linkage(df_reduced)
+    df_CA['cluster'] = cut_linkage(Z, n_clusters)
+    return df_CA
+
+
+def linkage_frame(Z):
+    """
+    Linkage matrix as DataFrame, to store it as CSV or Parquet file.
+    """
+    return pd.DataFrame(Z, columns=['child 1', 'child 2', 'distance', 'size'], index=pd.RangeIndex(len(Z), name='merge'))
+
+
+def add_clusters(df, df_CA):
+    """
+    Adds the cluster labels to the total dataframe. Village ponds and irrigation canals get their type as cluster.
+
+    Parameters:
+    - df: DataFrame with all samples.
+    - df_CA: DataFrame with the column 'cluster' for the groundwater samples.
+
+    Returns:
+    - df: Copy of df with the column 'cluster' (strings).
+    """
+    df = df.copy()
+    df['cluster'] = df_CA['cluster']
+    df['cluster'] = np.where(df['Type'].isin(['village pond', 'irrigation canal']), df['Type'], df['cluster'])
+    df['cluster'] = df['cluster'].apply(lambda x: str(int(x)) if isinstance(x, (int, float)) else x) # change cluster numbers to strings, '1' instead of '1.0'
+    return df
 
-# set number of clusters
-n_clusters = 4
-# perform clustering
-clustering_model = AgglomerativeClustering(n_clusters, affinity='euclidean', linkage='ward')
-clustering_model.fit(df_CA)
-data_labels = clustering_model.labels_ + 1  # plus 1 because python starts with 0
+#%% visualise factor values per cluster
 
-# add cluster labels to the total dataframe
-df_CA['cluster'] = data_labels
-df['cluster'] = df_CA['cluster']
-df['cluster'] = np.where(df['Type'].isin(['village pond', 'irrigation canal']), df['Type'], df['cluster'])
-df['cluster'] = df['cluster'].apply(lambda x: str(int(x)) if isinstance(x, (int, float)) else x) # change cluster numbers to strings, '1' instead of '1.0'
+@Instrumentation.instrumented('figure S4')
+def plot_factor_pairs(df_CA, outpath_S4=None):
+    """
+    Pairplot factors with clusters (figure S4).
 
-#%% visualise factor values per cluster
+    Parameters:
+    - df_CA: DataFrame with the factor values and the column 'cluster'.
+    - outpath_S4 (str, optional): Path to export the figure as jpg file. Default is None.
 
-# pairplot factors with clusters (figure S4)
-sns.pairplot(df_CA, hue='cluster', palette='deep')
+    Returns:
+    - g: The seaborn PairGrid.
+    """
+    import seaborn as sns
+    g = sns.pairplot(df_CA, hue='cluster', palette='deep')
 
-# Export figure S4 as a jpg file
-outpath_S4 = os.path.join(repo_dir, 'Output/Supplementary Material/Figure_S4.jpg')
-plt.savefig(outpath_S4, bbox_inches="tight")
+    # Export figure S4 as a jpg file
+    if outpath_S4:
+        g.savefig(outpath_S4, bbox_inches="tight")
+    return g
 
 #%% Check electro-neutrality
 
-# dictionaries for cations and anions with parameter name and conversion factor from mg/L -> mEq/L  (valance/molar mass)
-anions = {
-    'Alk [mg/L]': 0.02,
-    'SO4 [mg/L]': 0.02082,
-    'Cl [mg/L]': 0.02821,
-    'F [mg/L]': 0.05264,
-    'NO2 [mg/L]': 0.02174,
-    'NO3 [mg/L]': 0.01613,
-    }
-
-cations = {
-    'Ca [mg/L]': 0.04990,
-    'Mg [mg/L]': 0.08229,
-    'Na [mg/L]': 0.04350,
-    'K [mg/L]': 0.02558,
-    'NH4 [mg/L]': 0.05544,
-    }
-
-# calculate sum of anions [mEq/L]
-df['sum anions [mEq/L]'] = 0
-for key in anions:
-    df['sum anions [mEq/L]'] = df['sum anions [mEq/L]'] + (df[key] * anions[key])
-
-# calculate sum of cations [mEq/L]
-df['sum cations [mEq/L]'] = 0
-for key in cations:
-    df['sum cations [mEq/L]'] = df['sum cations [mEq/L]'] + (df[key] * cations[key])
-
-# calculate Anion-Cation Balance Differece
-df['an/cat_diff%'] = (df['sum cations [mEq/L]'] - df['sum anions [mEq/L]']) / (df['sum cations [mEq/L]'] + df['sum anions [mEq/L]']) *100
-
-
-#%% Export total dataset
-
-#set path
-outpath = os.path.join(repo_dir, r'Data\WorkingData\analysed_dataset_v1.csv')
-# write dataset (input DataVisualisation.py)
-df.to_csv(outpath)
\ No newline at end of file
+@Instrumentation.instrumented('ion balance')
+def electro_neutrality(df):
+    """
+    Calculates the sum of anions and cations [mEq/L] and the Anion-Cation Balance Difference [%]
+    (conversion factors and matrix product in IonChemistry.py).
+
+    Parameters:
+    - df: DataFrame with the anion and cation concentrations [mg/L].
+
+    Returns:
+    - df: Copy of df with the columns 'sum anions [mEq/L]', 'sum cations [mEq/L]' and 'an/cat_diff%'.
+    """
+    df = df.copy()
+    balance = IonChemistry.ion_balance(df)
+    for column in balance.columns:
+        df[column] = balance[column]
+    return df
+
+#%% run data analysis
+
+def run_analysis(repo_dir, inpath=None, outpath=None, n_clusters=n_clusters, figures=True, show=True, model_path=None):
+    """
+    Runs the data analysis: transformation, factor analysis, cluster analysis and electro-neutrality check, and
+    writes the analysed dataset, the Ward linkage, the model to score new samples and the figures S3 and S4.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - inpath (str, optional): Path of the prepared dataset. Default is None (Data/WorkingData/prepared_dataset_v1.csv).
+    - outpath (str, optional): Path of the analysed dataset. Default is None (Data/WorkingData/analysed_dataset_v1.csv).
+    - n_clusters (int): Number of clusters. Default is 4.
+    - figures (bool): If True, exports the figures S3 and S4. Default is True.
+    - show (bool): If True, shows the dendrogram. Default is True.
+    - model_path (str, optional): Path of the model (.json, with a .npz file). Default is None (Data/WorkingData/model_v1.json).
+
+    Returns:
+    - df: DataFrame with the clusters and the electro-neutrality check.
+    """
+    # read dataset (output DataPreparations.py), from the Parquet file next to the CSV file when available
+    if inpath is None:
+        inpath = os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv')
+    with Instrumentation.stage('read'):
+        df = DataCache.read_dataset(inpath)
+
+    # steps 1 and 2: select, log transform and standardise
+    df_transformed = transform_dataset(df, columns_to_analyse)
+
+    # step 3: factor analysis
+    loadings, factor_variance, df_reduced = factor_analysis(df_transformed, n_factors, rotation, method)
+
+    # step 4: cluster analysis: Ward linkage once, written as CSV and Parquet, with dendrogram (figure S3)
+    Z = ward_linkage(df_reduced)
+    DataCache.write_dataset(linkage_frame(Z), os.path.join(repo_dir, 'Data', 'WorkingData', 'ward_linkage_v1.csv'))
+    if figures:
+        plot_dendrogram(df_reduced, os.path.join(repo_dir, 'Output', 'Supplementary Material', 'Figure_S3.jpg'), show=show, Z=Z)
+    df_CA = cluster_analysis(df_reduced, n_clusters, Z=Z)
+
+    # fitted transformation, factor analysis and cluster centroids, to score new samples without fitting again
+    with Instrumentation.stage('model'):
+        model = ScoringModel.build_model(df, df_transformed, loadings, df_CA, columns_to_analyse, rotation, method)
+        ScoringModel.save_model(model, model_path or ScoringModel.model_path(repo_dir))
+    print(f"model: {model['training agreement']:.1%} of the samples get their cluster from the Ward merge cost")
+
+    # clusters for 2 to 10 clusters, cut from the same linkage
+    print(cluster_sweep(Z, df_reduced.index).apply(pd.Series.value_counts))
+
+    # add cluster labels to the total dataframe
+    df = add_clusters(df, df_CA)
+
+    # pairplot factors with clusters (figure S4)
+    if figures:
+        plot_factor_pairs(df_CA, os.path.join(repo_dir, 'Output', 'Supplementary Material', 'Figure_S4.jpg'))
+
+    # check electro-neutrality
+    df = electro_neutrality(df)
+
+    # write dataset as CSV and Parquet (input DataVisualisation.py)
+    if outpath is None:
+        outpath = os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv')
+    with Instrumentation.stage('write'):
+        DataCache.write_dataset(df, outpath)
+    return df
+
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # run the data analysis, with the figures S3 and S4
+    df = run_analysis(repo_dir)
+
+    # stage timings and memory (when switched on, see Instrumentation.py)
+    Instrumentation.write_records('DataAnalysis')
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "DataCache"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - calculate a content hash of the input files of a script
+    - store and load dataframes as typed columnar (Parquet) files, keyed by that hash
+    - read the working datasets from the Parquet file instead of the CSV file when available
+    - read and write the working datasets with the data types of the schema (Schema.py)
+
+"""
+#%% import modules
+import pandas as pd
+import hashlib
+import glob
+import os
+import Schema
+
+#%% content hash of input files
+
+def hash_files(paths, chunk_size=1024*1024):
+    """
+    Calculates a content hash (SHA-256) over a list of files.
+
+    Parameters:
+    - paths (list): Paths of the files to hash. The order of the files is part of the hash.
+    - chunk_size (int): Number of bytes read at once. Default is 1 MB.
+
+    Returns:
+    - key (str): The first 16 characters of the hexadecimal hash.
+    """
+    sha = hashlib.sha256()
+    for path in paths:
+        # add the file name, so that swapping two inputs gives a different key
+        sha.update(os.path.basename(path).encode('utf-8'))
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(chunk_size), b''):
+                sha.update(chunk)
+    return sha.hexdigest()[:16]
+
+#%% read and write cache
+
+def cache_path(cachedir, name, key):
+    """
+    Returns the path of a cached dataframe.
+
+    Parameters:
+    - cachedir (str): Directory where the cache files are stored.
+    - name (str): Name of the cached dataset, e.g. 'prepared_dataset'.
+    - key (str): Content hash of the inputs (see hash_files).
+
+    Returns:
+    - path (str): Path of the Parquet file.
+    """
+    return os.path.join(cachedir, f'{name}_{key}.parquet')
+
+
+def read_cache(cachedir, name, key):
+    """
+    Reads a cached dataframe if it exists for this key.
+
+    Parameters:
+    - cachedir (str): Directory where the cache files are stored.
+    - name (str): Name of the cached dataset.
+    - key (str): Content hash of the inputs.
+
+    Returns:
+    - df: The cached DataFrame, or None if there is no cache for this key.
+    """
+    path = cache_path(cachedir, name, key)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def write_cache(df, cachedir, name, key, clean=True):
+    """
+    Writes a dataframe to the cache and removes older cache files of the same dataset.
+
+    Parameters:
+    - df: DataFrame to store.
+    - cachedir (str): Directory where the cache files are stored.
+    - name (str): Name of the cached dataset.
+    - key (str): Content hash of the inputs.
+    - clean (bool): If True, removes the cache files of this dataset with another key. Default is True.
+
+    Returns:
+    - path (str): Path of the written Parquet file.
+    """
+    os.makedirs(cachedir, exist_ok=True)
+    path = cache_path(cachedir, name, key)
+    write_parquet(df, path)
+
+    # remove cache files of the same dataset with another key (outdated inputs)
+    if clean:
+        for old_path in glob.glob(cache_path(cachedir, name, '*')):
+            if old_path != path:
+                os.remove(old_path)
+    return path
+
+#%% working datasets (CSV + Parquet)
+
+def write_parquet(df, path):
+    """
+    Writes a dataframe to a Parquet file via a temporary file.
+
+    Parameters:
+    - df: DataFrame to store. The index (e.g. 'Sample ID') is stored as well.
+    - path (str): Output path of the Parquet file.
+    """
+    # write to a temporary file first, so that an interrupted run never leaves a broken file
+    temp_path = path + '.tmp'
+    df.to_parquet(temp_path)
+    os.replace(temp_path, path)
+
+
+def write_dataset(df, path_csv):
+    """
+    Writes a working dataset as CSV file and as Parquet file next to it.
+    The CSV file is the published dataset, the Parquet file is read by the next script (with the data types of the
+    schema, e.g. categoricals, see Schema.py).
+
+    Parameters:
+    - df: DataFrame to write.
+    - path_csv (str): Output path of the CSV file. The Parquet file gets the same name with the extension '.parquet'.
+    """
+    df = Schema.apply_schema(df)
+    df.to_csv(path_csv)
+    write_parquet(df, os.path.splitext(path_csv)[0] + '.parquet')
+
+
+def read_dataset(path_csv, index_col='Sample ID'):
+    """
+    Reads a working dataset. The Parquet file next to the CSV file is used when it is at least as new as the CSV file,
+    otherwise the CSV file is parsed. The data types of the schema are applied (Schema.py).
+
+    Parameters:
+    - path_csv (str): Path of the CSV file.
+    - index_col (str): Column to use as index when the CSV file is read. Default is 'Sample ID'.
+
+    Returns:
+    - df: The dataset as DataFrame.
+    """
+    path_parquet = os.path.splitext(path_csv)[0] + '.parquet'
+    if os.path.exists(path_parquet) and (not os.path.exists(path_csv) or os.path.getmtime(path_parquet) >= os.path.getmtime(path_csv)):
+        return Schema.apply_schema(pd.read_parquet(path_parquet))
+    return Schema.apply_schema(pd.read_csv(path_csv, index_col=(index_col)))
@@ -18,52 +18,209 @@ General info:
 #%% import modules
 import pandas as pd
 import os
+import DataCache
+import DetectionLimits
+import Instrumentation
+import Schema
 
-#%% read datasets and combine
+#%% set paths
 
-# set directory paths
-repo_dir = r'C:\GitHub\Temp_CleaningTheGanga_Paper1' # change this to the location where you stored the reposiotry
-datadir = os.path.join(repo_dir, r'Data\StartData')
+def input_paths(repo_dir):
+    """
+    Returns the paths of the metadata, hydrochemistry and isotope datasets.
 
-# read metadata collected (ground)water samples
-path_meta = os.path.join(datadir, 'Metadata_samples_vanBroekhoven_v1.csv')
-df_meta = pd.read_csv(path_meta, delimiter=(';'), index_col=('Sample ID'))
-df = df_meta.copy()
+    Parameters:
+    - repo_dir (str): Location of the repository.
 
-# read hydrochemistry data NIH
-path_hydrochem = os.path.join(datadir, 'Hydrochemical_analysis_NIH_v1.csv')
-df_hydrochem = pd.read_csv(path_hydrochem, delimiter=(';'), index_col=('Sample ID'), encoding="ISO-8859-1")
-df = pd.concat([df, df_hydrochem], axis=1)
+    Returns:
+    - paths (list): Paths of the metadata, hydrochemistry and isotope datasets.
+    """
+    datadir = os.path.join(repo_dir, 'Data', 'StartData')
+    path_meta = os.path.join(datadir, 'Metadata_samples_vanBroekhoven_v1.csv')
+    path_hydrochem = os.path.join(datadir, 'Hydrochemical_analysis_NIH_v1.csv')
+    path_isotope = os.path.join(datadir, 'Isotope_analysis_NIH_v1.csv')
+    return [path_meta, path_hydrochem, path_isotope]
 
-# read isotope data NIH
-path_isotope = os.path.join(datadir, 'Isotope_analysis_NIH_v1.csv')
-df_isotope = pd.read_csv(path_isotope, delimiter=(';'), index_col=('Sample ID'), encoding="ISO-8859-1")
-df = pd.concat([df, df_isotope], axis=1)
+#%% corrections of the dataset
 
+# correct Field EC value of F4.1 and Lab EC of F9.1 and F2.1: (sample, column, column with the correct value)
+# The field and lab measurements were crosschecked and these three values didn't match.
+# concentration of Cl is used to determine the correct value.
+ec_corrections = [
+    ('F 4.1', 'EC value [microS/cm]', 'EC [µS/cm]'),
+    ('F 9.1', 'EC [µS/cm]', 'EC value [microS/cm]'),
+    ('F 2.1', 'EC [µS/cm]', 'EC value [microS/cm]'),
+    ]
 
-#%% hydrochemical dataset alterations
+#%% function to read datasets, combine and alter
 
-# set below detectable limit measurement to half values BDL value (done for NO2, NH4, Ni, Se and NO3)
-df['NO2 [mg/L]'] = df['NO2 [mg/L]'].replace('ND', 0.005).astype(float) # detection limit = 0.01 mg/L. there are 10 values below detection limit: F11.1, 11.2, 13.2, 14.1, 14.2, 14.3. 15.3. 16.1, 16.3 and 17.1
-df['NH4 [mg/L]'] = df['NH4 [mg/L]'].replace('ND', 0.025).astype(float) # detection limit = 0.05 mg/L. there were 2 values below detection limit: F11.1 and F17.3
-df['Ni [µg/L]'] = df['Ni [µg/L]'].replace('<0.000', 0.005).astype(float) # lowest value in dataset is 0.011725. i assumed 0.01 as detection limit. there were 2 values below detection limit: F14.1 and F16.1    
-df['Se [µg/L]'] = df['Se [µg/L]'].replace('<0.000', 0.005).astype(float) # lowest value in dataset is 0.0334. i assumed 0.01 as detection limit. there are 3 values below detection limit: F9.3, F9.4 and F2.5
-df['NO3 [mg/L]'] = df['NO3 [mg/L]'].replace(0, 0.0005).astype(float) # Sample F8.4 has 0.000 mg/L NO3. i assumed 0.001 as detection limit.
+def read_datasets(path_meta, path_hydrochem, path_isotope):
+    """
+    Reads the metadata, hydrochemistry and isotope datasets and combines them.
 
-# remove variables where 25% of the samples are below detectable limit (PO4, Li, BOD removed)
-df = df.drop(['PO4 [mg/L]', 'Li [mg/L]', 'BOD [mg/L]'], axis=1)
+    Parameters:
+    - path_meta (str): Path of the metadata of the collected (ground)water samples.
+    - path_hydrochem (str): Path of the hydrochemistry data NIH.
+    - path_isotope (str): Path of the isotope data NIH.
+
+    Returns:
+    - df: The combined DataFrame, with 'Sample ID' as index.
+    - hydrochem_columns: The columns of the hydrochemistry data (the analytes checked for BDL values).
+    """
+    with Instrumentation.stage('read'):
+        # read metadata collected (ground)water samples
+        df_meta = pd.read_csv(path_meta, delimiter=(';'), index_col=('Sample ID'))
+
+        # read hydrochemistry data NIH
+        df_hydrochem = pd.read_csv(path_hydrochem, delimiter=(';'), index_col=('Sample ID'), encoding="ISO-8859-1")
+
+        # read isotope data NIH
+        df_isotope = pd.read_csv(path_isotope, delimiter=(';'), index_col=('Sample ID'), encoding="ISO-8859-1")
+
+    # combine the datasets
+    with Instrumentation.stage('merge'):
+        df = df_meta.copy()
+        df = pd.concat([df, df_hydrochem], axis=1)
+        df = pd.concat([df, df_isotope], axis=1)
+    return df, df_hydrochem.columns
+
+
+def alter_dataset(df, hydrochem_columns):
+    """
+    Applies the hydrochemical dataset alterations: BDL values and the corrected EC values.
+
+    Parameters:
+    - df: The combined DataFrame (see read_datasets).
+    - hydrochem_columns: The columns of the hydrochemistry data.
+
+    Returns:
+    - df: The altered DataFrame.
+    """
+    # set below detectable limit measurements to half the detection limit and
+    # remove variables where >25% of the samples are below detectable limit or not analysed (PO4, Li, BOD removed)
+    # the detection limits and BDL markers are listed in DetectionLimits.py
+    with Instrumentation.stage('BDL cleaning'):
+        df, bdl_report = DetectionLimits.substitute_bdl(df, hydrochem_columns)
+    print('Below detection limit values \n%s' %bdl_report.loc[(bdl_report['BDL count'] > 0) | bdl_report['removed']])
+
+    # correct Field EC value of F4.1 and Lab EC of F9.1 and F2.1 (only the samples in the dataset, e.g. of a
+    # campaign read from SampleStore.py)
+    for sample, column, source in ec_corrections:
+        if sample in df.index:
+            df.loc[sample, column] = df.loc[sample, source]
+    return df
+
+
+def prepare_dataset(path_meta, path_hydrochem, path_isotope):
+    """
+    Reads the metadata, hydrochemistry and isotope datasets, combines them and applies the dataset alterations.
+
+    Parameters:
+    - path_meta (str): Path of the metadata of the collected (ground)water samples.
+    - path_hydrochem (str): Path of the hydrochemistry data NIH.
+    - path_isotope (str): Path of the isotope data NIH.
+
+    Returns:
+    - df: The combined and altered DataFrame, with 'Sample ID' as index.
+    """
+    ### read datasets and combine
+    df, hydrochem_columns = read_datasets(path_meta, path_hydrochem, path_isotope)
+
+    ### hydrochemical dataset alterations, data types of the schema (Schema.py)
+    return Schema.apply_schema(alter_dataset(df, hydrochem_columns))
+
+#%% read combined and altered dataset from cache, or prepare it
+
+def cache_key(repo_dir, paths=None):
+    """
+    Returns the cache key of the prepared dataset: a hash of the content of the three datasets,
+    this script, the detection limit table and the schema.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - paths (list, optional): Paths of the metadata, hydrochemistry and isotope datasets. Default is None (input_paths).
+
+    Returns:
+    - key (str): The cache key.
+    """
+    if paths is None:
+        paths = input_paths(repo_dir)
+    return DataCache.hash_files(list(paths) + [os.path.abspath(__file__), DetectionLimits.__file__, Schema.__file__])
+
+
+def load_prepared_dataset(repo_dir, paths=None):
+    """
+    Reads the combined and altered dataset from the cache, or prepares it and stores it in the cache.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - paths (list, optional): Paths of the metadata, hydrochemistry and isotope datasets. Default is None (input_paths).
+
+    Returns:
+    - df: The combined and altered DataFrame.
+    - cache_hit (bool): True if the dataset was read from the cache.
+    """
+    cachedir = os.path.join(repo_dir, 'Data', 'WorkingData', 'cache')
+    if paths is None:
+        paths = input_paths(repo_dir)
+    key = cache_key(repo_dir, paths)
+    df = DataCache.read_cache(cachedir, 'prepared_dataset', key)
+    cache_hit = df is not None
+    if not cache_hit:
+        df = prepare_dataset(*paths)
+        DataCache.write_cache(df, cachedir, 'prepared_dataset', key)
+    return df, cache_hit
+
+
+def write_prepared_dataset(df, repo_dir, cache_hit=False, outpath=None):
+    """
+    Writes the combined and altered dataset as CSV and Parquet (input DataAnalysis.py).
+    Writing is skipped when the dataset came from the cache and the output already exists.
+
+    Parameters:
+    - df: The combined and altered DataFrame.
+    - repo_dir (str): Location of the repository.
+    - cache_hit (bool): True if the dataset was read from the cache. Default is False.
+    - outpath (str, optional): Path of the CSV file. Default is None (Data/WorkingData/prepared_dataset_v1.csv).
+
+    Returns:
+    - outpath (str): Path of the CSV file.
+    """
+    if outpath is None:
+        outpath = os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv')
+    if not cache_hit or not os.path.exists(os.path.splitext(outpath)[0] + '.parquet'):
+        DataCache.write_dataset(df, outpath)
+    return outpath
+
+#%% run data preparation
+
+def run_preparation(repo_dir, paths=None, outpath=None):
+    """
+    Runs the data preparation: reads the combined and altered dataset from the cache, or prepares it, and writes it.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - paths (list, optional): Paths of the metadata, hydrochemistry and isotope datasets. Default is None (input_paths).
+    - outpath (str, optional): Path of the CSV file. Default is None (Data/WorkingData/prepared_dataset_v1.csv).
+
+    Returns:
+    - outpath (str): Path of the CSV file.
+    """
+    # read combined and altered dataset from cache, or prepare it
+    with Instrumentation.stage('prepare dataset'):
+        df, cache_hit = load_prepared_dataset(repo_dir, paths)
+
+    # write combined and altered dataset (input DataAnalysis.py)
+    with Instrumentation.stage('write'):
+        return write_prepared_dataset(df, repo_dir, cache_hit, outpath)
 
-# correct Field EC value of F4.1 and Lab EC of F9.1 and F2.1
-# The field and lab measurements were crosschecked and these three values didn't match.
-# concentration of Cl is used to determine the correct value.
-df['EC value [microS/cm]']['F 4.1'] = df['EC [µS/cm]']['F 4.1']
-df['EC [µS/cm]']['F 9.1'] = df['EC value [microS/cm]']['F 9.1']
-df['EC [µS/cm]']['F 2.1'] = df['EC value [microS/cm]']['F 2.1']
 
-#%% write combined and altered dataset
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# set output path
-outpath = os.path.join(repo_dir, r'Data\WorkingData\prepared_dataset_v1.csv')
-# write output (input DataAnalysis.py)
-df.to_csv(outpath)
+    # prepare and write the combined and altered dataset (input DataAnalysis.py)
+    run_preparation(repo_dir)
 
+    # stage timings and memory (when switched on, see Instrumentation.py)
+    Instrumentation.write_records('DataPreparation')
@@ -5,10 +5,10 @@ Author: "Frank van Broekhoven"
 ORCiD: https://orcid.org/0009-0008-1593-9842
 Date: '2024-06-24'
 General info:
-    
+
     This script is part of the article
     - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
-    
+
     This script is used for:
     - to make the raw figures used in the article
         - figure 2 (PDF)
@@ -17,36 +17,194 @@ General info:
         - figure 5 (PDF)
         - calculates tables 1 and S1
         - supplementary figures S1 and S6
+    - render the figures S6 headless in parallel (process pool), with a manifest of the files and render timings
 
 """
 #%% Import modules
 import pandas as pd
-import geopandas as gpd
 import numpy as np
 import seaborn as sns
 import matplotlib.pyplot as plt
 import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import os
+import gc
+import time
+from concurrent.futures import ProcessPoolExecutor
+import DataCache
+import ClusterSummary
+import Correlation
+import Instrumentation
+import Isotopes
+import TransectGrid
 
 # Set pdf.fonttype to make sure that the figure labels are 'text' in the pdf exports and not 'outlines'
-matplotlib.rcParams['pdf.fonttype'] = 42 
+matplotlib.rcParams['pdf.fonttype'] = 42
+
+# Define the palette for clusters (clusters that are not in the palette, e.g. with n_clusters=5, get the colours of
+# extra_palette, see cluster_colours)
+cluster_palette = {'1':"darkorange", '2':"dodgerblue", '3':"gold",'4':"limegreen",'village pond':"red",'irrigation canal':"slateblue"}
+extra_palette = 'husl'
+
+# groundwater sample types
+groundwater_types = ['deep tubewell', 'shallow tubewell']
+
+# large-data mode: above this number of samples the scatter layers are rasterized inside the vector PDF and only the
+# labels that do not overlap are drawn (at most max_labels); the Sample IDs are written to a sidecar CSV file
+large_data_limit = 1000
+max_labels = 2000
+
+#%% Labels of large datasets
+
+def label_boxes(ax, x, y, labels, dx=0, fontsize=None):
+    """
+    Positions and approximate sizes of the labels in pixels, for all labels at once (one transformation).
+
+    Parameters:
+    - ax: The axes with their final limits and size.
+    - x, y: Arrays with the data coordinates of the points.
+    - labels: Array with the labels.
+    - dx (float): Offset of the labels in data units along x. Default is 0.
+    - fontsize (float, optional): Font size in points. Default is None (rcParams['font.size']).
+
+    Returns:
+    - anchors: Array (labels x 2) with the position of the lower left corner of the labels [pixels].
+    - widths: Array with the widths of the labels [pixels].
+    - height (float): Height of the labels [pixels].
+    """
+    fontsize = matplotlib.rcParams['font.size'] if fontsize is None else fontsize
+    pixels = fontsize * ax.figure.dpi / 72
+    anchors = ax.transData.transform(np.column_stack([np.asarray(x, dtype=float) + dx, np.asarray(y, dtype=float)]))
+    widths = np.char.str_len(np.asarray(labels).astype(str)) * 0.6 * pixels
+    return anchors, widths, 1.2 * pixels
+
+
+def cull_labels(ax, x, y, labels, dx=0, max_labels=max_labels, fontsize=None):
+    """
+    Selects the labels that can be drawn without overlap. The labels are binned in a grid with cells of the size of
+    the largest label and one label per cell is kept (decimation, in the order of the samples); a label is then
+    dropped when it overlaps a kept label of the neighbouring cells (collision culling).
+
+    Parameters:
+    - ax: The axes with their final limits and size.
+    - x, y: Arrays with the data coordinates of the points.
+    - labels: Array with the labels.
+    - dx (float): Offset of the labels in data units along x. Default is 0.
+    - max_labels (int): Maximum number of labels. Default is max_labels.
+    - fontsize (float, optional): Font size in points. Default is None (rcParams['font.size']).
+
+    Returns:
+    - keep: Boolean array, True for the labels to draw.
+    """
+    anchors, widths, height = label_boxes(ax, x, y, labels, dx, fontsize)
+    keep = np.zeros(len(anchors), dtype=bool)
+    bbox = ax.get_window_extent()
+    inside = np.flatnonzero(np.isfinite(anchors).all(axis=1)
+                            & (anchors[:, 0] >= bbox.x0) & (anchors[:, 0] <= bbox.x1)
+                            & (anchors[:, 1] >= bbox.y0) & (anchors[:, 1] <= bbox.y1))
+    if len(inside) == 0:
+        return keep
+
+    # decimation: the first label per cell
+    cell_size = np.array([max(widths[inside].max(), 1), height])
+    cells = np.floor(anchors / cell_size).astype(int)
+    _, first = np.unique(cells[inside], axis=0, return_index=True)
+    candidates = inside[np.sort(first)]
+
+    # collision culling: labels are at most one cell large, so only the 3 x 3 neighbouring cells can overlap
+    kept = {}
+    for i in candidates:
+        x0, y0 = anchors[i]
+        x1, y1 = x0 + widths[i], y0 + height
+        cx, cy = cells[i]
+        neighbours = (kept.get((cx + a, cy + b)) for a in (-1, 0, 1) for b in (-1, 0, 1))
+        if any(box is not None and x0 < box[2] and box[0] < x1 and y0 < box[3] and box[1] < y1 for box in neighbours):
+            continue
+        kept[(cx, cy)] = (x0, y0, x1, y1)
+        keep[i] = True
+        if len(kept) >= max_labels:
+            break
+    return keep
+
+
+def large_data_labels(ax, x, y, labels, dx=0, max_labels=max_labels):
+    """
+    Draws the labels that do not overlap (see cull_labels) and returns the sample index for the sidecar file.
+
+    Parameters:
+    - ax: The axes with their final limits and size.
+    - x, y: Series with the data coordinates of the points (their names are used as columns of the index).
+    - labels: Array with the labels (Sample IDs).
+    - dx (float): Offset of the labels in data units along x. Default is 0.
+    - max_labels (int): Maximum number of labels. Default is max_labels.
+
+    Returns:
+    - sample_index: DataFrame with the Sample ID, the coordinates and the column 'labelled'.
+    """
+    keep = cull_labels(ax, x, y, labels, dx, max_labels)
+    for xi, yi, label in zip(np.asarray(x, dtype=float)[keep] + dx, np.asarray(y, dtype=float)[keep], np.asarray(labels)[keep]):
+        ax.text(xi, yi, label)
+    return pd.DataFrame({'Sample ID': np.asarray(labels), x.name: np.asarray(x), y.name: np.asarray(y), 'labelled': keep})
 
-#%% Read dataset
 
-# set path
-repo_dir = r'C:\GitHub\Temp_CleaningTheGanga_Paper1' # change this to the location where you stored the reposiotry
-path = os.path.join(repo_dir, r'Data\WorkingData\analysed_dataset_v1.csv')
+def save_figure(fig, outpath, **kwargs):
+    """
+    Exports a figure and, for figures in large-data mode, the sidecar CSV file with the Sample IDs of all points
+    (<figure name>_samples.csv), so the samples without a label can still be identified.
+
+    Parameters:
+    - fig: The figure.
+    - outpath (str): Path of the figure.
+    - kwargs: Other arguments of savefig, e.g. format='pdf'.
 
-# read dataset (output DataAnalysis.py)
-df = pd.read_csv(path, index_col=('Sample ID'))
+    Returns:
+    - outpath (str): Path of the figure.
+    """
+    fig.savefig(outpath, **kwargs)
+    sample_index = getattr(fig, 'sample_index', None)
+    if sample_index is not None:
+        sample_index.to_csv(os.path.splitext(outpath)[0] + '_samples.csv', index=False)
+    return outpath
 
 #%% Function to make scatter plots
 
-def scatter_plot_Frank(x, y, variable=None, style='Type', xy_line=False, trend=False, manual_colours=False):
+def legend_values(values):
+    """
+    Values of a hue or style column for seaborn: categorical columns (Schema.py) as their values, so the legend only
+    shows the classes in the figure, in the order they appear (as for text columns).
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(object)
+    return values
+
+
+def cluster_colours(values, palette=cluster_palette):
+    """
+    Palette for the levels of a hue column: the colours of the palette, and the colours of extra_palette for the
+    levels that are not in the palette (e.g. the clusters above 4 when the Cluster Analysis is run with more clusters).
+
+    Parameters:
+    - values: Series with the hue values, e.g. the column 'cluster'.
+    - palette (dict): The predefined color palette. Default is cluster_palette.
+
+    Returns:
+    - palette (dict): The palette with a colour for every level of the values.
+    """
+    levels = pd.unique(values.dropna().astype(str))
+    # extra clusters in numerical order, then the other levels
+    extra = [level for level in levels if level not in palette]
+    extra = sorted(extra, key=lambda level: (not level.isdigit(), int(level) if level.isdigit() else 0, level))
+    if not extra:
+        return palette
+    return {**palette, **dict(zip(extra, sns.color_palette(extra_palette, len(extra))))}
+
+
+def scatter_plot_Frank(df, x, y, variable=None, style='Type', xy_line=False, trend=False, manual_colours=False, palette=cluster_palette, show=True, large=None):
     """
     Creates a scatter plot with optional labels, trendline, and x=y line.
-    
+
     Parameters:
+    - df: DataFrame containing the sample data.
     - x (str): The column name for the x-axis values in the dataframe.
     - y (str): The column name for the y-axis values in the dataframe.
     - variable (str, optional): The column name to use for color coding the points. Default is None.
@@ -54,37 +212,45 @@ def scatter_plot_Frank(x, y, variable=None, style='Type', xy_line=False, trend=F
     - xy_line (bool): If True, adds a y=x line to the plot. Default is False.
     - trend (bool): If True, adds a trendline to the plot. Default is False.
     - manual_colours (bool): If True, uses a predefined color palette. Default is False.
-    
+    - palette (dict): The predefined color palette used with manual_colours, extended for levels that are not in it
+      (see cluster_colours). Default is cluster_palette.
+    - show (bool): If True, shows the plot. Default is True.
+    - large (bool, optional): Large-data mode: rasterized points and only non-overlapping labels, with the Sample IDs
+      of all points in fig.sample_index (see save_figure). Default is None (on above large_data_limit samples).
+
     Returns:
     - fig: The created figure.
     - ax: The axes of the created figure.
     """
+    if large is None:
+        large = len(df) > large_data_limit
+
     # Create a new figure and axis
     fig, ax = plt.subplots()
-    
+
     # Set the hue for the scatter plot
     if variable:
-        hue = df[variable]
+        hue = legend_values(df[variable])
     else:
         hue = None
 
-    # Plot the scatter plot with or without manual colours   
+    # Plot the scatter plot with or without manual colours
     if manual_colours:
-        palette={'1':"darkorange", '2':"dodgerblue", '3':"gold",'4':"limegreen",'village pond':"red",'irrigation canal':"slateblue"}
-        sns.scatterplot(ax=ax, x=df[x], y=df[y], hue=hue, style=df[style], palette=palette, s=200, zorder=2)
+        sns.scatterplot(ax=ax, x=df[x], y=df[y], hue=hue, style=legend_values(df[style]), palette=cluster_colours(hue, palette), s=200, zorder=2, rasterized=large)
     else:
-        sns.scatterplot(ax=ax, x=df[x], y=df[y], hue=hue, style=df[style], palette="Spectral_r", s=200, zorder=2)
+        sns.scatterplot(ax=ax, x=df[x], y=df[y], hue=hue, style=legend_values(df[style]), palette="Spectral_r", s=200, zorder=2, rasterized=large)
+
+    # Add label to each point (large-data mode: after the axis limits are final, see below)
+    if not large:
+        for label, xi, yi in zip(df.index, df[x], df[y]):
+            plt.annotate(label, (xi, yi))
 
-    # Add label to each point    
-    for i, label in enumerate(df.index):
-        plt.annotate(label, (df[x][i], df[y][i]))
-    
     # Set axis labels and grid
     plt.xlabel(x)
     plt.ylabel(y)
     plt.grid()
-    
-    # Optionally add a y=x line  
+
+    # Optionally add a y=x line
     if xy_line:
         lims = [np.min([ax.get_xlim(), ax.get_ylim()]),  # min of both axes
                 np.max([ax.get_xlim(), ax.get_ylim()])]  # max of both axes
@@ -92,114 +258,253 @@ def scatter_plot_Frank(x, y, variable=None, style='Type', xy_line=False, trend=F
         ax.set_aspect('equal')
         ax.set_xlim(lims)
         ax.set_ylim(lims)
-        
-    # Optionally add a trendline    
+
+    # Optionally add a trendline
     if trend:
         # Calculate the trendline
         a,b = np.polyfit(df[x], df[y], 1)  #y = ax+b
         poly = np.poly1d([a,b])
-        
+
         # plot trendline
         xx = np.linspace(df[x].min(), df[x].max(), 500)
         plt.plot(xx, poly(xx))
-        
+
         # Display the trendline formula on the plot
         text = f'y = {a:0.2f}x + {b:0.2f}'
         plt.gca().text(0.05, 0.95, text,transform=plt.gca().transAxes, fontsize=12, verticalalignment='top')
-    
+
+    # Large-data mode: only the labels that do not overlap
+    if large:
+        fig.sample_index = large_data_labels(ax, df[x], df[y], df.index)
+
     # Show the plot
-    plt.show()
-    
+    if show:
+        plt.show()
+
     return fig, ax
 
 #%% Scatter plots: figure 3 and figure 5
 
-### Figure 3: Scatter plot of stable isotopes
-
-# Define the variables and plot the scatter plot
-x = 'dO18'
-y = 'dD'
-fig, ax = scatter_plot_Frank(x, y, style='cluster', variable='cluster', trend=True, manual_colours=True)
-
 #add Local Meteoric Water Line (LMWL) to isotope scatter plot
-def LMWL(d18O):
+def LMWL(d18O, line=Isotopes.lmwl):
     """
     Calculate d2H based on d18O
-    
+
     Parameters:
     - d18O: Oxygen-18 isotope ratio.
-    
+    - line (str): Meteoric water line of Isotopes.meteoric_lines, e.g. 'Delhi' [Pang et al., 2004 in Joshi et al., 2018],
+      'Joshi' (study area of Joshi et al., 2018) or 'global'. Default is Isotopes.lmwl ('Delhi').
+
     Returns:
     - d2H: Deuterium isotope ratio.
     """
-    d2H = 7.15 * d18O + 2.60    #Delhi [Pang et al., 2004 in Joshi et al., 2018]
-    #d2H = 7.9 * d18O + 5.56    #study area of Joshi et al., 2018
-    #d2H = 8.14 * d18O + 10.9   #global
-    return d2H
+    return Isotopes.meteoric_line(d18O, line)
 
-# Get the current x-axis limits from the plot
-x_min, x_max = plt.gca().get_xlim()
 
-# Plot the LMWL line on the scatter plot
-plt.plot([x_min, x_max], [LMWL(x_min), LMWL(x_max)], color='grey', linestyle='--', label='LMWL Delhi')
-plt.legend()
+@Instrumentation.instrumented('figure 3')
+def figure_3(df, outpath_fig3=None, palette=cluster_palette, show=True):
+    """
+    Figure 3: Scatter plot of stable isotopes, with trendline and Local Meteoric Water Line (LMWL).
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - outpath_fig3 (str, optional): Path to export the figure as PDF file. Default is None.
+    - palette (dict): Color palette for the clusters. Default is cluster_palette.
+    - show (bool): If True, shows the figure. Default is True.
 
-# Export Figure 3 as a PDF file
-outpath_fig3 = os.path.join(repo_dir, 'Output/Figure_3.pdf')
-plt.savefig(outpath_fig3, format='pdf', bbox_inches="tight")
+    Returns:
+    - fig: The created figure.
+    - ax: The axes of the created figure.
+    """
+    # Define the variables and plot the scatter plot
+    x = 'dO18'
+    y = 'dD'
+    fig, ax = scatter_plot_Frank(df, x, y, style='cluster', variable='cluster', trend=True, manual_colours=True, palette=palette, show=False)
+
+    # Get the current x-axis limits from the plot
+    x_min, x_max = ax.get_xlim()
+
+    # Plot the LMWL line on the scatter plot
+    ax.plot([x_min, x_max], [LMWL(x_min), LMWL(x_max)], color='grey', linestyle='--', label=f'LMWL {Isotopes.lmwl}')
+    ax.legend()
+    if show:
+        plt.show()
+
+    # Export Figure 3 as a PDF file
+    if outpath_fig3:
+        save_figure(fig, outpath_fig3, format='pdf', bbox_inches="tight")
+    return fig, ax
 
 
-### Figure 5: Scatter plot of d18O and distance to the nearest irrigation canal
+@Instrumentation.instrumented('figure 5')
+def figure_5(df, outpath_fig5=None, palette=cluster_palette, show=True):
+    """
+    Figure 5: Scatter plot of d18O and distance to the nearest irrigation canal.
 
-# Define the variables and plot the scatter plot
-x = 'distance to canal [m]'
-y = 'dO18'
-fig, ax = scatter_plot_Frank(x, y, style='cluster', variable='cluster', manual_colours=True)
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - outpath_fig5 (str, optional): Path to export the figure as PDF file. Default is None.
+    - palette (dict): Color palette for the clusters. Default is cluster_palette.
+    - show (bool): If True, shows the figure. Default is True.
 
-# Export Figure 5 as a PDF file
-outpath_fig5 = os.path.join(repo_dir, 'Output/Figure_5.pdf')
-plt.savefig(outpath_fig5, format='pdf', bbox_inches="tight")
+    Returns:
+    - fig: The created figure.
+    - ax: The axes of the created figure.
+    """
+    # Define the variables and plot the scatter plot
+    x = 'distance to canal [m]'
+    y = 'dO18'
+    fig, ax = scatter_plot_Frank(df, x, y, style='cluster', variable='cluster', manual_colours=True, palette=palette, show=show)
+
+    # Export Figure 5 as a PDF file
+    if outpath_fig5:
+        save_figure(fig, outpath_fig5, format='pdf', bbox_inches="tight")
+    return fig, ax
 
 #%% Function to plot cross-sections
 
-# Load elevation profile
-profile_path = os.path.join(repo_dir, r'Data/StartData/DataForFigures/elevation_profile_v1.csv')
-df_profile = pd.read_csv(profile_path)
+def load_crosssection_data(repo_dir):
+    """
+    Loads the elevation profile and the Points of Interest (POIs) along the cross-section.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+
+    Returns:
+    - df_profile: DataFrame with the elevation profile.
+    - POI: List containing POI data [gdf_POI, type_images, zoom_images].
+    """
+    figdir = os.path.join(repo_dir, 'Data', 'StartData', 'DataForFigures')
+
+    # Load elevation profile
+    profile_path = os.path.join(figdir, 'elevation_profile_v1.csv')
+    df_profile = pd.read_csv(profile_path)
+
+    # Load Points of Interest (POIs) along the cross-section (geopandas is only imported for the cross-sections)
+    import geopandas as gpd
+    POI_path = os.path.join(figdir, 'POIs_along_transect_v2.geojson')
+    gdf_POI = gpd.read_file(POI_path)
 
-# Load Points of Interest (POIs) along the cross-section
-POI_path = os.path.join(repo_dir, r'Data/StartData/DataForFigures/POIs_along_transect_v2.geojson')
-gdf_POI = gpd.read_file(POI_path)
+    # Set default elevation for all POIs
+    gdf_POI['y'] = 250
 
-# Set default elevation for all POIs
-gdf_POI['y'] = 250
+    # Adjust elevation for specific types of POIs to make sure they don't overlap
+    gdf_POI.loc[gdf_POI['type']=='River', 'y']              = 250
+    gdf_POI.loc[gdf_POI['type']=='Industry', 'y']           = 260
+    gdf_POI.loc[gdf_POI['type']=='Irrigation canal', 'y']   = 250
+    gdf_POI.loc[gdf_POI['type']=='Village', 'y']            = 255
 
-# Adjust elevation for specific types of POIs to make sure they don't overlap
-gdf_POI.loc[gdf_POI['type']=='River', 'y']              = 250
-gdf_POI.loc[gdf_POI['type']=='Industry', 'y']           = 260
-gdf_POI.loc[gdf_POI['type']=='Irrigation canal', 'y']   = 250
-gdf_POI.loc[gdf_POI['type']=='Village', 'y']            = 255
+    # Define paths to images for different types of POIs
+    type_images = {
+        'Industry'          : plt.imread(os.path.join(figdir, 'POI_symbols', 'Industry.png')),  # Provide the path to your image file
+        'Village'           : plt.imread(os.path.join(figdir, 'POI_symbols', 'house.png')),
+        'Irrigation canal'  : plt.imread(os.path.join(figdir, 'POI_symbols', 'canal.png')),
+        'River'             : plt.imread(os.path.join(figdir, 'POI_symbols', 'River.png')),
+        }
 
-# Define paths to images for different types of POIs
-type_images = {
-    'Industry'          : plt.imread(os.path.join(repo_dir, 'Data\StartData\DataForFigures\POI_symbols\Industry.png')),  # Provide the path to your image file
-    'Village'           : plt.imread(os.path.join(repo_dir, 'Data\StartData\DataForFigures\POI_symbols\house.png')),
-    'Irrigation canal'  : plt.imread(os.path.join(repo_dir, 'Data\StartData\DataForFigures\POI_symbols\canal.png')),
-    'River'             : plt.imread(os.path.join(repo_dir, 'Data\StartData\DataForFigures\POI_symbols\River.png')),
-    }
+    # Define zoom levels for POI images
+    zoom_images = {
+        'Industry'          : 0.025,
+        'Village'           : 0.025,
+        'Irrigation canal'  : 0.2,
+        'River'             : 0.1,
+        }
 
-# Define zoom levels for POI images
-zoom_images = {
-    'Industry'          : 0.025,
-    'Village'           : 0.025,
-    'Irrigation canal'  : 0.2,
-    'River'             : 0.1,
-    }
+    # Package POI data into a list
+    POI = [gdf_POI, type_images, zoom_images]
+    return df_profile, POI
 
-# Package POI data into a list
-POI = [gdf_POI, type_images, zoom_images]
 
+# fixed axis limits of the cross-sections: distance along transect [m] and depth [mMSL]
+crosssection_xlim = (23000, 72000)
+crosssection_ylim = (140, 270)
 
-def crosssection_plot(df, parameter, style='cluster', label='Sample ID', profile=df_profile, POI=POI, palette='Spectral_r'):
+# interpolated values as contours beneath the samples of the figures S6: None (off, as in the article), 'idw' or
+# 'kriging' (see TransectGrid.py)
+crosssection_interpolation = None
+
+
+def draw_crosssection_background(ax, profile=None, POI=None):
+    """
+    Draws the static background of a cross-section: the elevation profile and the POIs.
+
+    Parameters:
+    - ax: The axes to draw on.
+    - profile: DataFrame containing the elevation profile with 'Distance_startpoint_Yamuna' and 'depth_MSL' columns.
+    - POI: List containing POI data [gdf_POI, type_images, zoom_images].
+    """
+    # Plot the elevation profile line
+    if profile is not None:
+        ax.scatter(profile['Distance_startpoint_Yamuna'], profile['depth_MSL'], c='black', s=1, zorder=1)
+        ax.plot(profile['Distance_startpoint_Yamuna'], profile['depth_MSL'], color='black',  zorder=0)
+
+    # Add POIs to the plot
+    if POI:
+        gdf_POI = POI[0]
+        type_images = POI[1]
+        zoom_images = POI[2]
+        for index, point in gdf_POI.iterrows():
+            ab = matplotlib.offsetbox.AnnotationBbox(
+                    matplotlib.offsetbox.OffsetImage(type_images[point['type']], zoom=zoom_images[point['type']]),
+                    (point['HubDist'], point['y']),
+                    frameon=False
+                    )
+            ax.add_artist(ab)
+
+
+# rendered backgrounds, per profile, POIs, size of the axes in pixels and dpi
+background_cache = {}
+
+
+def crosssection_background(profile, POI, size, dpi, pad=100):
+    """
+    Renders the background of the cross-section (elevation profile and POIs) once as an image, and reuses it for
+    every figure with the same axes size. The image covers the axes plus a margin, because the POI symbols at the
+    top extend beyond the axes.
+
+    Parameters:
+    - profile: DataFrame with the elevation profile.
+    - POI: List containing POI data [gdf_POI, type_images, zoom_images].
+    - size (tuple): Width and height of the axes in pixels.
+    - dpi (float): Resolution of the figure.
+    - pad (int): Margin around the axes in pixels. Default is 100.
+
+    Returns:
+    - image: RGBA array with the background (transparent where there is no background).
+    - extent: Extent of the image in data coordinates (left, right, bottom, top).
+    """
+    key = (id(profile), id(POI), size, dpi, pad)
+    if key not in background_cache:
+        width, height = size
+        fig = matplotlib.figure.Figure(figsize=((width + 2*pad) / dpi, (height + 2*pad) / dpi), dpi=dpi)
+        canvas = FigureCanvasAgg(fig)
+        fig.patch.set_alpha(0)
+        ax = fig.add_axes([pad / (width + 2*pad), pad / (height + 2*pad), width / (width + 2*pad), height / (height + 2*pad)])
+        ax.set_axis_off()
+        ax.set_xlim(crosssection_xlim)
+        ax.set_ylim(crosssection_ylim)
+        draw_crosssection_background(ax, profile, POI)
+        canvas.draw()
+        image = np.asarray(canvas.buffer_rgba())
+
+        # crop the image to the pixels with background, so less pixels are composited in every figure
+        rows = np.flatnonzero(image[:, :, 3].any(axis=1))
+        columns = np.flatnonzero(image[:, :, 3].any(axis=0))
+        image = image[rows[0]:rows[-1] + 1, columns[0]:columns[-1] + 1].copy()
+
+        # extent of the cropped image in data coordinates (pixel rows are counted from the top)
+        x_per_pixel = (crosssection_xlim[1] - crosssection_xlim[0]) / width
+        y_per_pixel = (crosssection_ylim[1] - crosssection_ylim[0]) / height
+        extent = (crosssection_xlim[0] + (columns[0] - pad) * x_per_pixel,
+                  crosssection_xlim[0] + (columns[-1] + 1 - pad) * x_per_pixel,
+                  crosssection_ylim[0] + (height + pad - rows[-1] - 1) * y_per_pixel,
+                  crosssection_ylim[0] + (height + pad - rows[0]) * y_per_pixel)
+        # keep profile and POI in the cache, so their id is not reused by other objects
+        background_cache[key] = (profile, POI, image, extent)
+    return background_cache[key][2:]
+
+
+def crosssection_plot(df, parameter, style='cluster', label='Sample ID', profile=None, POI=None, palette='Spectral_r', show=True, background='vector', large=None, grid=None):
     """
     Plots a cross-section figure with sample data, elevation profile, and POIs.
 
@@ -211,185 +516,424 @@ def crosssection_plot(df, parameter, style='cluster', label='Sample ID', profile
     - profile: DataFrame containing the elevation profile with 'Distance_startpoint_Yamuna' and 'depth_MSL' columns.
     - POI: List containing POI data [gdf_POI, type_images, zoom_images].
     - palette: Color palette to use for the scatter plot. Default is 'Spectral_r'.
+    - show (bool): If True, shows the figure. Default is True.
+    - background (str): 'vector' draws the profile and POIs in the figure, 'raster' draws them as one cached image
+      (see crosssection_background), which is much faster for many figures. Default is 'vector'.
+    - large (bool, optional): Large-data mode: rasterized points and only non-overlapping labels, with the Sample IDs
+      of all points in fig.sample_index (see save_figure). Default is None (on above large_data_limit samples).
+    - grid (dict, optional): Interpolated values along the transect (TransectGrid.transect_grids); when it contains
+      the parameter, its contours are drawn beneath the samples. Default is None.
 
     Returns:
     - fig: The created figure.
     - ax: The axes of the created figure.
     """
-    
+    if large is None:
+        large = len(df) > large_data_limit
+
     # Create figure and axis
     fig, ax = plt.subplots(figsize=[30,10])
-    
-    # Plot sample data with scatter plot
-    sns.scatterplot(ax=ax, x=df['distance startpoint Yamuna [m]'], y=df['depth [mMSL]'], hue=df[parameter], style=df[style], palette=palette, s=200, zorder=2)
-    
-    # Add labels to the points if label parameter is provided
+
+    # Plot sample data with scatter plot (a dict palette gets colours for the levels that are not in it)
+    hue = legend_values(df[parameter])
+    sns.scatterplot(ax=ax, x=df['distance startpoint Yamuna [m]'], y=df['depth [mMSL]'], hue=hue, style=legend_values(df[style]),
+                    palette=cluster_colours(hue, palette) if isinstance(palette, dict) else palette, s=200, zorder=2, rasterized=large)
+
+    # Plot the interpolated values as contours beneath the samples, with the colours of the samples (the palette over
+    # the range of the sample values)
+    if grid is not None and parameter in grid['values']:
+        levels = np.linspace(df[parameter].min(), df[parameter].max(), 11)
+        if levels[-1] > levels[0]:
+            ax.contourf(grid['distance'], grid['depth'], grid['values'][parameter], levels=levels, extend='both',
+                        cmap=palette if isinstance(palette, str) else 'Spectral_r', alpha=0.4, zorder=1, rasterized=True)
+
+    # Add labels to the points if label parameter is provided (large-data mode: after the layout, see below)
     if label:
-        df['Sample ID'] = df.index
-        def plotlabel(xvar, yvar, label):
-            ax.text(xvar+200, yvar, label, rotation=0)  # Rotate the label by 45 degrees)
-        df.apply(lambda x: plotlabel(x['distance startpoint Yamuna [m]'],  x['depth [mMSL]'], x[label]), axis=1)
-    
-    # Plot the elevation profile line
-    ax.scatter(df_profile['Distance_startpoint_Yamuna'], df_profile['depth_MSL'], c='black', s=1, zorder=1)
-    ax.plot(df_profile['Distance_startpoint_Yamuna'], df_profile['depth_MSL'], color='black',  zorder=0)
-    
-    # Add POIs to the plot
-    if POI: 
-        gdf_POI = POI[0]
-        type_images = POI[1]
-        zoom_images = POI[2]
-        for index, point in gdf_POI.iterrows():
-            ab = matplotlib.offsetbox.AnnotationBbox(
-                    matplotlib.offsetbox.OffsetImage(type_images[point['type']], zoom=zoom_images[point['type']]),
-                    (point['HubDist'], point['y']), 
-                    frameon=False
-                    )
-            plt.gca().add_artist(ab)
-    
+        labels = df.index if label == 'Sample ID' and label not in df.columns else df[label]
+    if label and not large:
+        for xvar, yvar, text in zip(df['distance startpoint Yamuna [m]'], df['depth [mMSL]'], labels):
+            ax.text(xvar+200, yvar, text, rotation=0)
+
+    # Plot the elevation profile and the POIs as vectors
+    if background == 'vector':
+        draw_crosssection_background(ax, profile, POI)
+
     # Set axis labels and limits
     ax.set_xlabel('Distance along transect [m]')
     ax.set_ylabel('Depth [mMSL]')
-    ax.set_xlim(23000, 72000) 
-    ax.set_ylim(140, 270) 
+    ax.set_xlim(crosssection_xlim)
+    ax.set_ylim(crosssection_ylim)
     fig.tight_layout()
-    plt.show()
-    
+
+    # Plot the elevation profile and the POIs as cached image, with the size of the axes after the layout
+    if background == 'raster' and (profile is not None or POI):
+        bbox = ax.get_window_extent()
+        image, extent = crosssection_background(profile, POI, (round(bbox.width), round(bbox.height)), fig.dpi)
+        im = ax.imshow(image, extent=extent, aspect='auto', interpolation='none', zorder=0, clip_on=False)
+        # the transparent margin of the image is not part of the tight bounding box of the export
+        im.set_in_layout(False)
+        ax.set_xlim(crosssection_xlim)
+        ax.set_ylim(crosssection_ylim)
+
+    # Large-data mode: only the labels that do not overlap, with the axes in their final size
+    if label and large:
+        fig.sample_index = large_data_labels(ax, df['distance startpoint Yamuna [m]'], df['depth [mMSL]'], labels, dx=200)
+
+    if show:
+        plt.show()
+
     return fig, ax
 
 #%% Cross-section plots: figure 2 and figure 4
 
-### Figure 2: Cross-section plot for clusters
+# List of all variables to plot a cross-section (figures S6)
+variables_to_plot = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]',
+                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]',
+                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]',
+                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
+                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]',
+                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]', 'dO18', 'dD']
 
-# Define the palette for clusters
-palette={'1':"darkorange", '2':"dodgerblue", '3':"gold",'4':"limegreen",'village pond':"red",'irrigation canal':"slateblue"}
 
-# Cross-section plot for clusters
-crosssection_plot(df=df, parameter='cluster', label='Sample ID', palette=palette) 
+#%% Figures S6: headless batch rendering
 
-# Export Figure 2 as a PDF file
-outpath_fig2 = os.path.join(repo_dir, 'Output/Figure_2.pdf')
-plt.savefig(outpath_fig2, format='pdf', bbox_inches="tight")
+# data shared with the worker processes, set once per worker by init_render_worker
+worker_data = {}
 
 
-### Figure 4: Cross-section plot for isotopes ('dO18')
-crosssection_plot(df=df, parameter='dO18', label='Sample ID') 
+def render_S6_figure(df, variable, outpath, profile=None, POI=None, background='raster', grid=None):
+    """
+    Plots the cross-section of one variable (figure S6), exports it as jpg and closes the figure.
 
-# Export Figure 4 as a PDF file
-outpath_fig4 = os.path.join(repo_dir, 'Output/Figure_4.pdf')
-plt.savefig(outpath_fig4, format='pdf', bbox_inches="tight")
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - variable (str): Variable to plot.
+    - outpath (str): Path to export the figure.
+    - profile: DataFrame with the elevation profile. Default is None.
+    - POI: List containing POI data [gdf_POI, type_images, zoom_images]. Default is None.
+    - background (str): 'raster' (cached background image) or 'vector'. Default is 'raster'.
+    - grid (dict, optional): Interpolated values along the transect (TransectGrid.transect_grids). Default is None.
 
+    Returns:
+    - record (dict): Variable, exported file, render time in seconds and process id.
+    """
+    start = time.perf_counter()
+    fig, ax = crosssection_plot(df=df, parameter=variable, profile=profile, POI=POI, show=False, background=background, grid=grid)
+    save_figure(fig, outpath, bbox_inches="tight")
+    # close the figure and collect it directly: the figure has reference cycles and with vector POIs it is ~0.5 GB,
+    # so otherwise every figure stays in memory until the garbage collector runs
+    plt.close(fig)
+    del fig, ax
+    gc.collect()
+    return {'variable': variable, 'file': outpath, 'seconds': time.perf_counter() - start, 'pid': os.getpid()}
+
+
+def init_render_worker(df, profile, POI, grid=None):
+    """
+    Initialises a worker process: non-interactive backend and the data shared by all figures.
+    """
+    matplotlib.use('Agg', force=True)
+    worker_data.update(df=df, profile=profile, POI=POI, grid=grid)
 
-### Figures S6: crossection for each variable
 
-# List of all variables to plot a cross-section
-variables_to_plot = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]', 
-                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]', 
-                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]', 
-                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
-                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]', 
-                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]', 'dO18', 'dD']
+def render_S6_task(variable, outpath):
+    """
+    Renders one figure S6 in a worker process, with the data set by init_render_worker.
+    """
+    return render_S6_figure(worker_data['df'], variable, outpath, worker_data['profile'], worker_data['POI'], grid=worker_data['grid'])
+
+
+def render_S6_batch(df, repo_dir, variables=variables_to_plot, profile=None, POI=None, n_jobs=None, grid=None):
+    """
+    Renders the figures S6 headless: the figures are spread over a pool of processes with the non-interactive
+    'Agg' backend and each figure is closed after export.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - repo_dir (str): Location of the repository.
+    - variables (list): Variables to plot a cross-section for. Default is variables_to_plot.
+    - profile: DataFrame with the elevation profile. Default is None (loaded with load_crosssection_data).
+    - POI: List containing POI data. Default is None (loaded with load_crosssection_data).
+    - n_jobs (int, optional): Number of processes. Default is None (number of CPUs). With 1 the figures are
+      rendered one by one in this process.
+    - grid (dict, optional): Interpolated values along the transect (TransectGrid.transect_grids), sent once to
+      every process. Default is None.
+
+    Returns:
+    - manifest: DataFrame with per variable the exported file, render time [s] and process id.
+    """
+    if profile is None or POI is None:
+        profile, POI = load_crosssection_data(repo_dir)
+    outdir = os.path.join(repo_dir, 'Output', 'Supplementary Material')
+    outpaths = [os.path.join(outdir, f'Figure_S6_{variable.split()[0]}.jpg') for variable in variables]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(variables))
+
+    if n_jobs <= 1:
+        records = [render_S6_figure(df, variable, outpath, profile, POI, grid=grid) for variable, outpath in zip(variables, outpaths)]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_render_worker, initargs=(df, profile, POI, grid)) as pool:
+            records = list(pool.map(render_S6_task, variables, outpaths))
+
+    manifest = pd.DataFrame(records, columns=['variable', 'file', 'seconds', 'pid']).set_index('variable')
+    return manifest
 
-# loop to plot each and export (jpg) each variable
-for variable in variables_to_plot:
-    fig, ax = crosssection_plot(df=df, parameter=variable)
-    #set path and export figure
-    outpath_S6 = os.path.join(repo_dir, f'Output/Supplementary Material/Figure_S6_{variable.split()[0]}.jpg')
-    fig.savefig(outpath_S6, bbox_inches="tight")
-    
 
-#%% Table 1: tabel with means per cluster 
+def crosssection_figures(df, repo_dir, variables=variables_to_plot, palette=cluster_palette, show=True, n_jobs=None,
+                         interpolation=crosssection_interpolation):
+    """
+    Plots and exports the cross-section figures: figure 2 (clusters), figure 4 (dO18) and figures S6 (each variable).
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - repo_dir (str): Location of the repository.
+    - variables (list): Variables to plot a cross-section for (figures S6). Default is variables_to_plot.
+    - palette (dict): Color palette for the clusters. Default is cluster_palette.
+    - show (bool): If True, shows the figures. If False, the figures S6 are rendered headless in parallel
+      (see render_S6_batch). Default is True.
+    - n_jobs (int, optional): Number of processes for the headless figures S6. Default is None (number of CPUs).
+    - interpolation (str, optional): 'idw' or 'kriging' for contours of the interpolated values beneath the samples
+      of the figures S6 (TransectGrid.py), None for none. Default is crosssection_interpolation.
+
+    Returns:
+    - outpaths (list): Paths of the exported figures.
+    """
+    with Instrumentation.stage('read cross-section data'):
+        df_profile, POI = load_crosssection_data(repo_dir)
+    outpaths = []
+
+    # interpolated values of all variables of the figures S6 at once (TransectGrid.py)
+    grid = None
+    if interpolation:
+        with Instrumentation.stage('transect grids', variables=len(variables)):
+            grid = TransectGrid.transect_grids(df, variables, interpolation, df_profile)
+
+    ### Figure 2: Cross-section plot for clusters
+    with Instrumentation.stage('figure 2'):
+        fig, ax = crosssection_plot(df=df, parameter='cluster', label='Sample ID', profile=df_profile, POI=POI, palette=palette, show=show)
+
+        # Export Figure 2 as a PDF file
+        outpath_fig2 = os.path.join(repo_dir, 'Output', 'Figure_2.pdf')
+        save_figure(fig, outpath_fig2, format='pdf', bbox_inches="tight")
+        plt.close(fig)
+        outpaths.append(outpath_fig2)
+
+    ### Figure 4: Cross-section plot for isotopes ('dO18')
+    with Instrumentation.stage('figure 4'):
+        fig, ax = crosssection_plot(df=df, parameter='dO18', label='Sample ID', profile=df_profile, POI=POI, show=show)
+
+        # Export Figure 4 as a PDF file
+        outpath_fig4 = os.path.join(repo_dir, 'Output', 'Figure_4.pdf')
+        save_figure(fig, outpath_fig4, format='pdf', bbox_inches="tight")
+        plt.close(fig)
+        outpaths.append(outpath_fig4)
+
+    ### Figures S6: crossection for each variable
+
+    # headless: render in parallel and print the manifest with render timings
+    if not show:
+        with Instrumentation.stage('figures S6', figures=len(variables)):
+            manifest = render_S6_batch(df, repo_dir, variables, df_profile, POI, n_jobs=n_jobs, grid=grid)
+        print(manifest)
+        print(f"figures S6: {len(manifest)} figures, {manifest['seconds'].sum():.1f} s render time")
+        return outpaths + manifest['file'].tolist()
+
+    # loop to plot each and export (jpg) each variable
+    for variable in variables:
+        with Instrumentation.stage('figure S6', variable=variable):
+            fig, ax = crosssection_plot(df=df, parameter=variable, profile=df_profile, POI=POI, show=show, background='raster', grid=grid)
+            #set path and export figure
+            outpath_S6 = os.path.join(repo_dir, 'Output', 'Supplementary Material', f'Figure_S6_{variable.split()[0]}.jpg')
+            save_figure(fig, outpath_S6, bbox_inches="tight")
+            plt.close(fig)
+            outpaths.append(outpath_S6)
+    return outpaths
+
+#%% Table 1: tabel with means per cluster
 
 # Define columns to analyze for each cluster
-columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]', 
-                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]', 
-                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]', 
+columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]',
+                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]',
+                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]',
                       'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
-                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]', 
+                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]',
                       'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]']
 
-# Calculate mean values for each cluster group
-output = df.groupby(['cluster'], as_index=False).agg(['mean'])
-
-# Select only the specified columns for analysis
-output = output[columns_to_analyse]
-
-# Transpose the dataframe to switch rows and columns for better readability
-transposed = output.transpose()
-transposed.index = transposed.index.droplevel(1)
+@Instrumentation.instrumented('table 1')
+def table_1(df, outpath_tab1=None, columns=columns_to_analyse, state=None):
+    """
+    Table 1: heatmap with the mean values per cluster, coloured by the standardised mean relative to all groundwater samples.
+    The statistics per cluster are calculated in one grouped pass (see ClusterSummary.py).
 
-# Calculate mean and Standard deviation values for all groundwater samples together
-# select groundwater samples and variables to analyse
-selection = df.loc[df['Type'].isin(['deep tubewell', 'shallow tubewell'])]
-selection = selection[columns_to_analyse]
+    Parameters:
+    - df: DataFrame containing the sample data with the column 'cluster'.
+    - outpath_tab1 (str, optional): Path to export the table as jpg file. Default is None.
+    - columns (list): Columns to analyse for each cluster. Default is columns_to_analyse.
+    - state (dict, optional): Summary state of the clusters, e.g. of an archive updated with new samples
+      (ClusterSummary.update_state); df is not used when given. Default is None (calculated from df).
 
-# Calculate mean values for all groundwater samples
-total_mean = selection.mean()
-# # Calculate standard deviation for all groundwater samples
-total_std = selection.std()
+    Returns:
+    - transposed: DataFrame with the mean values (variables x clusters).
+    - standardized_T: DataFrame with the standardised mean values (variables x clusters).
+    """
+    # Summary per cluster and of all groundwater samples together (reference group)
+    if state is None:
+        state = ClusterSummary.summary_state(df, columns, 'cluster', reference=df['Type'].isin(groundwater_types))
+    summary = ClusterSummary.cluster_summary(state)
 
-# Standardize group means relative to the mean of all groundwate samples
-cluster_standarized = pd.DataFrame()
-for column in transposed.columns:
-    cluster_standarized[column] = (transposed[column] - total_mean) / total_std
-standardized_T = cluster_standarized
+    # Mean values per cluster (variables x clusters)
+    transposed = summary['mean'].drop(columns=ClusterSummary.reference_group)
 
-# Create a heatmap with a colorbar centered around zeros
-fig, ax = plt.subplots(figsize=[10,15])
-maximum = 2 # Set maximum value for color scale
-sns.heatmap(standardized_T, cmap = 'coolwarm', ax=ax, annot=transposed, fmt='.2f', yticklabels = 1 , vmin=-maximum, vmax=maximum)
-plt.xticks(rotation = 45)
-fig.set_tight_layout(True)
+    # Standardize group means relative to the mean and standard deviation of all groundwater samples
+    standardized_T = summary['z-score']
 
-# Export table 1 as a jpg file
-outpath_tab1 = os.path.join(repo_dir, 'Output/Table_1.jpg')
-plt.savefig(outpath_tab1, bbox_inches="tight")
+    # Create a heatmap with a colorbar centered around zeros
+    fig, ax = plt.subplots(figsize=[10,15])
+    maximum = 2 # Set maximum value for color scale
+    sns.heatmap(standardized_T, cmap = 'coolwarm', ax=ax, annot=transposed, fmt='.2f', yticklabels = 1 , vmin=-maximum, vmax=maximum)
+    plt.xticks(rotation = 45)
+    fig.set_tight_layout(True)
 
+    # Export table 1 as a jpg file
+    if outpath_tab1:
+        fig.savefig(outpath_tab1, bbox_inches="tight")
+    return transposed, standardized_T
 
 #%% Table S2: univariate overview of groundwater samples
 
 # Define columns to analyze for univariate overview
-columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]', 
-                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]', 
-                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]', 
-                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
-                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]', 
-                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]', 'dO18', 'dD']
+columns_overview = columns_to_analyse + ['dO18', 'dD']
+
+@Instrumentation.instrumented('table S2')
+def univariate_overview(df, columns=columns_overview):
+    """
+    Univariate overview of groundwater samples.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - columns (list): Columns to analyse. Default is columns_overview.
 
-#select only groundwater samples and columns to analyse
-gws = df.loc[df['Type'].isin(['deep tubewell', 'shallow tubewell'])]
-gws = gws[columns_to_analyse]
+    Returns:
+    - overview_gws: DataFrame with the description of each variable.
+    """
+    #select only groundwater samples and columns to analyse
+    gws = df.loc[df['Type'].isin(groundwater_types)]
+    gws = gws[columns]
 
-# Get description and transpose the dataframe to switch rows and columns for better readability
-overview_gws = gws.describe().transpose()
-print(overview_gws)
+    # Get description and transpose the dataframe to switch rows and columns for better readability
+    overview_gws = gws.describe().transpose()
+    print(overview_gws)
+    return overview_gws
 
 #%% FIGURE S1: correlation matrix
 
 # Define columns to analyze for correlation matrix
-columns_to_analyse = ['EC value [microS/cm]', 'pH', 'Hard [mg/L]', 'Alk [mg/L]', 
-                      'Cl [mg/L]', 'NO3 [mg/L]', 'SO4 [mg/L]', 'F [mg/L]', 'NO2 [mg/L]', 'Na [mg/L]', 
-                      'K [mg/L]', 'Ca [mg/L]', 'Mg [mg/L]', 'NH4 [mg/L]', 'Silica [mg/L]', 'COD [mg/L]', 
-                      'B  [µg/L]', 'Al [µg/L]', 'V [µg/L]', 'Cr [µg/L]', 'Mn [µg/L]', 'Fe [µg/L]',
-                      'Co [µg/L]', 'Ni [µg/L]', 'Cu [µg/L]', 'Zn [µg/L]', 'As [µg/L]', 'Se [µg/L]', 
-                      'Sr [µg/L]', 'Cd [µg/L]', 'Ba [µg/L]', 'Pb [µg/L]', 'U [µg/L]', 'dO18', 'dD',
-                      'depth [m]'
-                      ]
-
-# Select only groundwater samples and columns to analyse
-df = df.loc[df['Type'].isin(['deep tubewell', 'shallow tubewell'])]
-df_selection = df[columns_to_analyse]
-
-# Plot correlation matrix
-g = sns.clustermap(df_selection.corr(), 
-                    method = 'complete', 
-                    cmap   = 'RdBu', vmin=-1, vmax=1,
-                    annot  = True, 
-                    annot_kws = {'size': 8},
-                    yticklabels = 1 , xticklabels = 1,
-                    figsize=[20,15])
-plt.setp(g.ax_heatmap.get_xticklabels(), rotation=60)
-
-# Export figure S1 as a jpg file
-outpath_S1 = os.path.join(repo_dir, 'Output/Supplementary Material/Figure_S1.jpg')
-plt.savefig(outpath_S1, bbox_inches="tight")
\ No newline at end of file
+columns_correlation = columns_to_analyse + ['dO18', 'dD', 'depth [m]']
+
+# above this number of variables the cells of the correlation matrix are not annotated and not every variable name is
+# shown, so that the figure stays readable and renderable (e.g. 500 x 500)
+annotation_limit = 50
+
+@Instrumentation.instrumented('figure S1')
+def figure_S1(df, outpath_S1=None, columns=columns_correlation, method='pearson', cachedir=None):
+    """
+    Figure S1: clustered correlation matrix of the groundwater samples. The pairwise-complete correlation matrix,
+    the pair counts and the ordering of the clustermap are calculated once per dataset (see Correlation.py).
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - outpath_S1 (str, optional): Path to export the figure as jpg file, the pair counts are exported next to it
+      (<figure name>_pair_counts.csv). Default is None.
+    - columns (list): Columns to analyse. Default is columns_correlation.
+    - method (str): 'pearson' or 'spearman'. Default is 'pearson'.
+    - cachedir (str, optional): Directory to cache the correlation matrix and ordering. Default is None (this session only).
+
+    Returns:
+    - g: The seaborn ClusterGrid.
+    """
+    # Select only groundwater samples and columns to analyse
+    df = df.loc[df['Type'].isin(groundwater_types)]
+    df_selection = df[columns]
+
+    # Correlation matrix, pair counts and ordering of the clustermap (cached)
+    corr, counts, linkage = Correlation.cached_correlation(df_selection, method, 'complete', cachedir)
+    annotate = len(columns) <= annotation_limit
+
+    # Plot correlation matrix
+    g = sns.clustermap(corr,
+                        row_linkage = linkage, col_linkage = linkage,
+                        cmap   = 'RdBu', vmin=-1, vmax=1,
+                        annot  = annotate,
+                        annot_kws = {'size': 8},
+                        yticklabels = 1 if annotate else 'auto', xticklabels = 1 if annotate else 'auto',
+                        figsize=[20,15])
+    plt.setp(g.ax_heatmap.get_xticklabels(), rotation=60)
+
+    # Export figure S1 as a jpg file and the pair counts
+    if outpath_S1:
+        g.savefig(outpath_S1, bbox_inches="tight")
+        counts.to_csv(os.path.splitext(outpath_S1)[0] + '_pair_counts.csv')
+    return g
+
+#%% Make all figures and tables
+
+def render_figures(df, repo_dir, palette=cluster_palette, variables=variables_to_plot, show=True, n_jobs=None,
+                   interpolation=crosssection_interpolation):
+    """
+    Makes and exports all figures and tables of this script.
+
+    Parameters:
+    - df: DataFrame containing the sample data (output DataAnalysis.py).
+    - repo_dir (str): Location of the repository.
+    - palette (dict): Color palette for the clusters. Default is cluster_palette.
+    - variables (list): Variables to plot a cross-section for (figures S6). Default is variables_to_plot.
+    - show (bool): If True, shows the figures. If False, renders headless: figures S6 in parallel and all figures closed after export. Default is True.
+    - n_jobs (int, optional): Number of processes for the headless figures S6. Default is None (number of CPUs).
+    - interpolation (str, optional): Interpolation beneath the figures S6, see crosssection_figures. Default is
+      crosssection_interpolation.
+
+    Returns:
+    - outpaths (list): Paths of the exported figures and tables.
+    """
+    outdir = os.path.join(repo_dir, 'Output')
+
+    # Scatter plots: figure 3 and figure 5
+    outpaths = [os.path.join(outdir, 'Figure_3.pdf'), os.path.join(outdir, 'Figure_5.pdf')]
+    figure_3(df, outpaths[0], palette=palette, show=show)
+    figure_5(df, outpaths[1], palette=palette, show=show)
+
+    # Cross-section plots: figure 2, figure 4 and figures S6
+    if not show:
+        plt.close('all')
+    outpaths += crosssection_figures(df, repo_dir, variables=variables, palette=palette, show=show, n_jobs=n_jobs,
+                                     interpolation=interpolation)
+
+    # Table 1 and the univariate overview
+    outpaths.append(os.path.join(outdir, 'Table_1.jpg'))
+    table_1(df, outpaths[-1])
+    univariate_overview(df)
+
+    # Figure S1
+    outpaths.append(os.path.join(outdir, 'Supplementary Material', 'Figure_S1.jpg'))
+    figure_S1(df, outpaths[-1], cachedir=os.path.join(repo_dir, 'Data', 'WorkingData', 'cache'))
+    if not show:
+        plt.close('all')
+    return outpaths
+
+#%% run data visualisation
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # read dataset (output DataAnalysis.py), from the Parquet file next to the CSV file when available
+    path = os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv')
+    with Instrumentation.stage('read'):
+        df = DataCache.read_dataset(path)
+
+    # make and export all figures and tables
+    # show=False renders headless: the figures S6 in parallel processes, with a manifest of the render timings
+    show = True
+    render_figures(df, repo_dir, show=show)
+
+    # stage timings and memory (when switched on, see Instrumentation.py)
+    Instrumentation.write_records('DataVisualisation')
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "DetectionLimits"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - detection limit table of the hydrochemical parameters
+    - change below detection limit (BDL) values to half the BDL value, for all analyte columns at once
+    - drop variables with >25% of the values BDL or not analysed
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+
+#%% detection limit table
+
+# detection limits per parameter, in the unit of the parameter
+detection_limits = {
+    'NO3 [mg/L]': 0.001, # Sample F8.4 has 0.000 mg/L NO3. i assumed 0.001 as detection limit.
+    'NO2 [mg/L]': 0.01,  # detection limit = 0.01 mg/L. there are 10 values below detection limit: F11.1, 11.2, 13.2, 14.1, 14.2, 14.3. 15.3. 16.1, 16.3 and 17.1
+    'NH4 [mg/L]': 0.05,  # detection limit = 0.05 mg/L. there were 2 values below detection limit: F11.1 and F17.3
+    'Ni [µg/L]': 0.01,   # lowest value in dataset is 0.011725. i assumed 0.01 as detection limit. there were 2 values below detection limit: F14.1 and F16.1
+    'Se [µg/L]': 0.01,   # lowest value in dataset is 0.0334. i assumed 0.01 as detection limit. there are 3 values below detection limit: F9.3, F9.4 and F2.5
+    }
+
+# markers used by the lab for values below detection limit
+# besides these tokens, '<x' values (x is the detection limit, '<0.000' means unknown) and zero values are BDL as well
+bdl_tokens = ['ND', 'BDL']
+
+# values below detection limit are replaced by this fraction of the detection limit
+bdl_factor = 0.5
+
+# variables with more than this fraction of the values BDL or not analysed (NA) are removed
+bdl_threshold = 0.25
+
+#%% functions to parse and substitute BDL values
+
+def parse_bdl(df, columns, tokens=bdl_tokens):
+    """
+    Parses the values of the analyte columns in one pass over all columns.
+
+    Parameters:
+    - df: DataFrame with the analyte columns, as read from the lab export (numbers, BDL tokens and '<x' values).
+    - columns (list): Analyte columns to parse.
+    - tokens (list): Markers for values below detection limit. Default is bdl_tokens.
+
+    Returns:
+    - values: Array (samples x columns) with the measured values, NaN where the value is BDL or not analysed.
+    - bdl: Boolean array (samples x columns), True where the value is below detection limit.
+    - limits: Array (samples x columns) with the detection limit given in the '<x' values, NaN elsewhere.
+    """
+    block = df[list(columns)]
+    n_rows, n_columns = block.shape
+    numeric = np.array([pd.api.types.is_numeric_dtype(dtype) for dtype in block.dtypes], dtype=bool)
+
+    values = np.full((n_rows, n_columns), np.nan)
+    bdl = np.zeros((n_rows, n_columns), dtype=bool)
+    limits = np.full((n_rows, n_columns), np.nan)
+
+    # numeric columns can be used directly
+    values[:, numeric] = block.loc[:, numeric].to_numpy(dtype=float)
+
+    # columns with text are flattened and parsed at once
+    if (~numeric).any():
+        raw = pd.Series(block.loc[:, ~numeric].to_numpy(dtype=object).ravel())
+        parsed = pd.to_numeric(raw, errors='coerce').to_numpy(dtype=float)
+        text = np.isnan(parsed) & raw.notna().to_numpy()
+
+        # markers: tokens and '<x' values
+        strings = raw[text].astype(str).str.strip()
+        is_token = strings.str.upper().isin([token.upper() for token in tokens]).to_numpy()
+        is_less = strings.str.startswith('<').to_numpy()
+        less_value = pd.to_numeric(strings.str[1:].where(is_less), errors='coerce').to_numpy(dtype=float, copy=True)
+
+        # text that is no marker is an error in the lab export
+        unknown = ~(is_token | is_less) | (is_less & np.isnan(less_value))
+        if unknown.any():
+            text_columns = block.columns[~numeric]
+            cells = np.flatnonzero(text)[unknown]
+            examples = [f'{text_columns[cell % len(text_columns)]}: {raw[cell]!r}' for cell in cells[:5]]
+            raise ValueError('Values that are no number or BDL marker: ' + ', '.join(examples))
+
+        # '<0.000' means the detection limit is not given, use the detection limit table instead
+        less_value[less_value <= 0] = np.nan
+
+        text_bdl = np.zeros(raw.shape, dtype=bool)
+        text_bdl[text] = True
+        text_limits = np.full(raw.shape, np.nan)
+        text_limits[np.flatnonzero(text)] = less_value
+
+        values[:, ~numeric] = parsed.reshape(n_rows, -1)
+        bdl[:, ~numeric] = text_bdl.reshape(n_rows, -1)
+        limits[:, ~numeric] = text_limits.reshape(n_rows, -1)
+
+    # zero values are below detection limit as well
+    bdl |= values == 0
+    values[bdl] = np.nan
+    return values, bdl, limits
+
+
+def substitute_bdl(df, columns, limits=detection_limits, tokens=bdl_tokens, factor=bdl_factor, threshold=bdl_threshold):
+    """
+    Changes below detection limit values to half the detection limit and removes variables with too many BDL values.
+
+    Parameters:
+    - df: DataFrame with the analyte columns, as read from the lab export.
+    - columns (list): Analyte columns to check.
+    - limits (dict): Detection limit per parameter. Default is detection_limits.
+    - tokens (list): Markers for values below detection limit. Default is bdl_tokens.
+    - factor (float): Fraction of the detection limit used for BDL values. Default is 0.5.
+    - threshold (float): Variables with more than this fraction of the values BDL or not analysed are removed. Default is 0.25.
+
+    Returns:
+    - df: Copy of the DataFrame with float analyte columns, BDL values substituted and variables removed.
+    - report: DataFrame with per column the detection limit, number of BDL values, BDL fraction,
+              fraction not analysed and whether the column is removed.
+    """
+    columns = list(columns)
+    values, bdl, cell_limits = parse_bdl(df, columns, tokens)
+
+    # BDL and not analysed fractions per column
+    not_analysed = np.isnan(values) & ~bdl
+    bdl_fraction = bdl.mean(axis=0)
+    na_fraction = not_analysed.mean(axis=0)
+    drop = (bdl_fraction > threshold) | (na_fraction > threshold)
+
+    # detection limit per cell: the '<x' value when given, otherwise the detection limit table
+    table_limits = np.array([limits.get(column, np.nan) for column in columns])
+    cell_limits = np.where(np.isnan(cell_limits), table_limits, cell_limits)
+
+    # all BDL values of the remaining columns need a detection limit
+    missing_limit = (bdl & np.isnan(cell_limits)).any(axis=0) & ~drop
+    if missing_limit.any():
+        raise ValueError(f'No detection limit for BDL values in: {[c for c, m in zip(columns, missing_limit) if m]}')
+
+    # substitute half the detection limit
+    values = np.where(bdl, factor * cell_limits, values)
+
+    report = pd.DataFrame({
+        'detection limit': table_limits,
+        'BDL count': bdl.sum(axis=0),
+        'BDL fraction': bdl_fraction,
+        'not analysed fraction': na_fraction,
+        'removed': drop,
+        }, index=columns)
+
+    df = df.copy()
+    df[columns] = values
+    df = df.drop([column for column, removed in zip(columns, drop) if removed], axis=1)
+    return df, report
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "FactorModel"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - principal factor analysis with varimax rotation for a batch of datasets at once (numpy only),
+      giving the same loadings and factor values as FactorAnalyzer(rotation='varimax', method='principal')
+      in DataAnalysis.py, but with one batched eigendecomposition instead of one fit per dataset
+    - align the factors of resampled datasets with the factors of the full dataset (order and sign)
+
+"""
+#%% import modules
+import numpy as np
+import itertools
+
+#%% batched principal factor analysis
+
+def standardize_batch(X):
+    """
+    Standardises every dataset in the batch (mean zero, population standard deviation one, as in FactorAnalyzer).
+
+    Parameters:
+    - X: Array (batch x samples x variables).
+
+    Returns:
+    - Z: Standardised array (batch x samples x variables).
+    - mean: Array (batch x variables) with the means.
+    - std: Array (batch x variables) with the standard deviations.
+    """
+    mean = X.mean(axis=1)
+    std = X.std(axis=1)
+    return (X - mean[:, None, :]) / std[:, None, :], mean, std
+
+
+def principal_loadings(corr, n_factors):
+    """
+    Unrotated loadings of the principal method: eigenvectors of the correlation matrix scaled by the square root of
+    their eigenvalue, for the n_factors largest eigenvalues.
+
+    Parameters:
+    - corr: Array (batch x variables x variables) with correlation matrices.
+    - n_factors (int): Number of factors.
+
+    Returns:
+    - loadings: Array (batch x variables x factors).
+    - eigenvalues: Array (batch x variables) with all eigenvalues, largest first.
+    """
+    # eigh returns the eigenvalues in ascending order
+    values, vectors = np.linalg.eigh(corr)
+    values = values[:, ::-1]
+    vectors = vectors[:, :, ::-1]
+    loadings = vectors[:, :, :n_factors] * np.sqrt(np.clip(values[:, None, :n_factors], 0, None))
+    return loadings, values
+
+
+def varimax_batch(loadings, normalize=True, max_iter=500, tol=1e-5):
+    """
+    Varimax rotation of a batch of loading matrices, with the same algorithm and stopping rule as the
+    Rotator of factor_analyzer. Datasets that converged are not updated further.
+
+    Parameters:
+    - loadings: Array (batch x variables x factors).
+    - normalize (bool): If True, Kaiser normalisation of the rows before rotation. Default is True.
+    - max_iter (int): Maximum number of iterations. Default is 500.
+    - tol (float): Convergence tolerance. Default is 1e-5.
+
+    Returns:
+    - rotated: Array (batch x variables x factors) with the rotated loadings.
+    """
+    X = loadings.copy()
+    n_batch, n_rows, n_cols = X.shape
+    if n_cols < 2:
+        return X
+
+    # Kaiser normalisation: rows scaled to unit length
+    if normalize:
+        norms = np.sqrt((X**2).sum(axis=2, keepdims=True))
+        X = X / norms
+
+    rotation = np.repeat(np.eye(n_cols)[None], n_batch, axis=0)
+    d = np.zeros(n_batch)
+    active = np.ones(n_batch, dtype=bool)
+    for _ in range(max_iter):
+        basis = X[active] @ rotation[active]
+        transformed = np.swapaxes(X[active], 1, 2) @ (basis**3 - basis * (basis**2).sum(axis=1, keepdims=True) / n_rows)
+        U, S, V = np.linalg.svd(transformed)
+        rotation[active] = U @ V
+        old_d = d[active]
+        d[active] = S.sum(axis=1)
+
+        # stop the datasets that converged
+        converged = d[active] < old_d * (1 + tol)
+        active[np.flatnonzero(active)[converged]] = False
+        if not active.any():
+            break
+
+    X = X @ rotation
+    if normalize:
+        X = X * norms
+    return X
+
+
+def fit_batch(X, n_factors=3, rotation='varimax'):
+    """
+    Principal factor analysis of a batch of datasets with the same variables.
+
+    Parameters:
+    - X: Array (batch x samples x variables), e.g. resamples of the transformed dataset.
+    - n_factors (int): Number of factors. Default is 3.
+    - rotation (str or None): 'varimax' or None. Default is 'varimax'.
+
+    Returns:
+    - loadings: Array (batch x variables x factors).
+    - scores: Array (batch x samples x factors) with the factor values of the samples of each dataset.
+    - eigenvalues: Array (batch x variables) with the eigenvalues of the correlation matrices, largest first.
+    """
+    if rotation not in ('varimax', None):
+        raise ValueError(f"Rotation {rotation!r} is not supported, use 'varimax' or None")
+    Z, mean, std = standardize_batch(np.asarray(X, dtype=float))
+    corr = np.swapaxes(Z, 1, 2) @ Z / Z.shape[1]
+
+    loadings, eigenvalues = principal_loadings(corr, n_factors)
+    if rotation == 'varimax':
+        loadings = varimax_batch(loadings)
+
+    # signs of the factors so that the column sums of the loadings are positive (as FactorAnalyzer)
+    if n_factors > 1:
+        signs = np.sign(loadings.sum(axis=1, keepdims=True))
+        signs[signs == 0] = 1
+        loadings = loadings * signs
+
+    # factor values with the regression method: weights = inverse(correlation) x loadings
+    weights = np.linalg.solve(corr, loadings)
+    scores = Z @ weights
+    return loadings, scores, eigenvalues
+
+
+def factor_variance(loadings):
+    """
+    Sum of squared loadings, proportional and cumulative variance per factor (as get_factor_variance of FactorAnalyzer).
+
+    Parameters:
+    - loadings: Array (batch x variables x factors).
+
+    Returns:
+    - variance: Array (batch x 3 x factors).
+    """
+    ss_loadings = (loadings**2).sum(axis=1)
+    proportional = ss_loadings / loadings.shape[1]
+    return np.stack([ss_loadings, proportional, np.cumsum(proportional, axis=1)], axis=1)
+
+#%% align factors with a reference
+
+def align_factors(loadings, reference):
+    """
+    Orders and flips the factors of every dataset in the batch so that they match the factors of a reference
+    (e.g. the full dataset): the permutation with the highest total absolute Tucker congruence is chosen.
+
+    Parameters:
+    - loadings: Array (batch x variables x factors).
+    - reference: Array (variables x factors) with the reference loadings.
+
+    Returns:
+    - order: Array (batch x factors) with per reference factor the index of the matching factor.
+    - signs: Array (batch x factors) with the sign (+1 or -1) of the matching factor.
+    - congruence: Array (batch x factors) with the absolute Tucker congruence of the matched factors.
+    """
+    n_factors = reference.shape[1]
+    # Tucker congruence between all factors and all reference factors (batch x factors x reference factors)
+    norms = np.sqrt((loadings**2).sum(axis=1))[:, :, None] * np.sqrt((reference**2).sum(axis=0))[None, None, :]
+    phi = np.swapaxes(loadings, 1, 2) @ reference / norms
+
+    # best permutation per dataset, all permutations at once
+    permutations = np.array(list(itertools.permutations(range(n_factors))))
+    totals = np.abs(phi[:, permutations, np.arange(n_factors)]).sum(axis=2)
+    order = permutations[totals.argmax(axis=1)]
+
+    matched = phi[np.arange(len(phi))[:, None], order, np.arange(n_factors)]
+    signs = np.where(matched < 0, -1, 1)
+    return order, signs, np.abs(matched)
+
+
+def apply_alignment(values, order, signs):
+    """
+    Reorders and flips the factors (last axis) of loadings or scores with the result of align_factors.
+
+    Parameters:
+    - values: Array (batch x ... x factors), e.g. loadings or scores.
+    - order: Array (batch x factors) from align_factors.
+    - signs: Array (batch x factors) from align_factors.
+
+    Returns:
+    - aligned: Array with the same shape as values.
+    """
+    index = order.reshape(order.shape[0], *([1] * (values.ndim - 2)), order.shape[1])
+    return np.take_along_axis(values, index, axis=-1) * signs.reshape(index.shape)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "FactorRetention"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - number of factors to retain for the factor analysis of DataAnalysis.py (n_factors), from the eigenvalues of
+      the correlation matrix of the log transformed and standardised groundwater samples:
+        - Horn's parallel analysis: eigenvalues above the eigenvalues of random data of the same size
+        - scree test: optimal coordinates and acceleration factor (non-graphical scree tests), and a scree plot
+        - Kaiser criterion: eigenvalues above 1
+    - the eigenvalues of the random data are simulated in batches (one batched eigendecomposition per batch) and
+      the batches are spread over a pool of processes
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor
+import DataAnalysis
+import DataCache
+import FactorModel
+
+#%% settings of the parallel analysis
+
+# number of random datasets
+n_replicates = 1000
+
+# random data: 'normal' (independent normal variables) or 'permutation' (each variable of the dataset permuted
+# independently, which keeps the distribution of the variables)
+simulation = 'normal'
+
+# percentile of the random eigenvalues that an eigenvalue has to exceed
+percentile = 95
+
+# number of random datasets per batch
+batch_size = 200
+
+# seed of the random datasets, so the results can be reproduced
+seed = 2024
+
+#%% eigenvalues
+
+def observed_eigenvalues(X):
+    """
+    Eigenvalues of the correlation matrix of a dataset, largest first.
+
+    Parameters:
+    - X: Array (samples x variables).
+
+    Returns:
+    - eigenvalues: Array (variables).
+    """
+    Z, mean, std = FactorModel.standardize_batch(np.asarray(X, dtype=float)[None])
+    corr = np.swapaxes(Z, 1, 2) @ Z / Z.shape[1]
+    return np.linalg.eigvalsh(corr)[0, ::-1]
+
+
+def random_correlations(n_samples, n_variables, n_replicates, rng):
+    """
+    Correlation matrices of random datasets of independent normal variables. The cross products of n centred normal
+    samples follow a Wishart distribution with n - 1 degrees of freedom, which is drawn directly with the Bartlett
+    decomposition (variables x variables numbers per dataset instead of samples x variables); with fewer samples
+    than variables the datasets are drawn.
+
+    Parameters:
+    - n_samples (int): Number of samples of the datasets.
+    - n_variables (int): Number of variables.
+    - n_replicates (int): Number of datasets.
+    - rng: numpy random Generator.
+
+    Returns:
+    - corr: Array (replicates x variables x variables).
+    """
+    df = n_samples - 1
+    if df < n_variables:
+        Z = FactorModel.standardize_batch(rng.standard_normal((n_replicates, n_samples, n_variables)))[0]
+        return np.swapaxes(Z, 1, 2) @ Z / n_samples
+
+    # Bartlett decomposition: W = L L', L lower triangular with chi distributed diagonal and normal values below it
+    L = np.tril(rng.standard_normal((n_replicates, n_variables, n_variables)), k=-1)
+    diagonal = np.sqrt(rng.chisquare(df - np.arange(n_variables), size=(n_replicates, n_variables)))
+    L[:, np.arange(n_variables), np.arange(n_variables)] = diagonal
+    W = L @ np.swapaxes(L, 1, 2)
+    scale = 1 / np.sqrt(np.diagonal(W, axis1=1, axis2=2))
+    return W * scale[:, :, None] * scale[:, None, :]
+
+
+def random_eigenvalues(X, n_replicates, simulation=simulation, seed=seed):
+    """
+    Eigenvalues of the correlation matrices of a batch of random datasets with the size of X.
+
+    Parameters:
+    - X: Array (samples x variables) with the dataset.
+    - n_replicates (int): Number of random datasets.
+    - simulation (str): 'normal' or 'permutation'. Default is simulation.
+    - seed: Seed (or numpy SeedSequence) of the random generator. Default is seed.
+
+    Returns:
+    - eigenvalues: Array (replicates x variables), largest first.
+    """
+    rng = np.random.default_rng(seed)
+    n_samples, n_variables = X.shape
+    if simulation == 'normal':
+        corr = random_correlations(n_samples, n_variables, n_replicates, rng)
+    elif simulation == 'permutation':
+        # each variable permuted independently: random sort keys per replicate and variable
+        order = np.argsort(rng.random((n_replicates, n_samples, n_variables)), axis=1)
+        Z = FactorModel.standardize_batch(np.take_along_axis(np.broadcast_to(X, order.shape), order, axis=1))[0]
+        corr = np.swapaxes(Z, 1, 2) @ Z / n_samples
+    else:
+        raise ValueError(f"Unknown simulation {simulation!r}, use 'normal' or 'permutation'")
+    return np.linalg.eigvalsh(corr)[:, ::-1]
+
+
+# data shared with the worker processes, set once per worker by init_retention_worker
+worker_data = {}
+
+
+def init_retention_worker(X, simulation):
+    """
+    Initialises a worker process with the dataset and the settings shared by all batches.
+    """
+    worker_data.update(X=X, simulation=simulation)
+
+
+def random_eigenvalues_task(batch):
+    """
+    Simulates one batch (number of replicates, seed) in a worker process, with the data set by init_retention_worker.
+    """
+    return random_eigenvalues(worker_data['X'], batch[0], worker_data['simulation'], batch[1])
+
+#%% retention criteria
+
+def scree_test(eigenvalues, threshold=None):
+    """
+    Non-graphical scree tests (Raiche et al., 2013).
+    - Optimal coordinates: an eigenvalue is retained when it is above the line through the next eigenvalue and the
+      last eigenvalue (and above the threshold, e.g. the random eigenvalues of the parallel analysis).
+    - Acceleration factor: the elbow of the scree is the eigenvalue with the largest second difference; the
+      eigenvalues before the elbow are retained.
+
+    Parameters:
+    - eigenvalues: Array with the eigenvalues, largest first.
+    - threshold: Array with the minimum of each eigenvalue. Default is None (1, as the Kaiser criterion).
+
+    Returns:
+    - n_optimal_coordinates (int): Number of factors of the optimal coordinates.
+    - n_acceleration_factor (int): Number of factors of the acceleration factor.
+    - predicted: Array with the eigenvalue predicted by the line of the optimal coordinates (NaN for the last two).
+    """
+    eigenvalues = np.asarray(eigenvalues, dtype=float)
+    p = len(eigenvalues)
+    threshold = np.ones(p) if threshold is None else np.asarray(threshold, dtype=float)
+
+    # optimal coordinates: line through eigenvalue i + 1 and the last eigenvalue, extrapolated to i
+    i = np.arange(p - 2)
+    predicted = np.full(p, np.nan)
+    predicted[i] = eigenvalues[i + 1] + (eigenvalues[i + 1] - eigenvalues[-1]) / (p - 1 - (i + 1))
+    retained = (eigenvalues > predicted) & (eigenvalues > threshold)
+    n_optimal_coordinates = int(np.argmin(retained[:-2])) if not retained[:-2].all() else p - 2
+
+    # acceleration factor: second differences (the first is at component 2), elbow at the largest
+    acceleration = eigenvalues[2:] - 2 * eigenvalues[1:-1] + eigenvalues[:-2]
+    n_acceleration_factor = int(np.argmax(acceleration)) + 1 if p > 2 else 0
+    return n_optimal_coordinates, n_acceleration_factor, predicted
+
+
+def leading_count(retained):
+    """
+    Number of leading True values (the factors are retained until the first factor that is not).
+    """
+    retained = np.asarray(retained, dtype=bool)
+    return int(np.argmin(retained)) if not retained.all() else len(retained)
+
+
+def factor_retention(df_transformed, n_replicates=n_replicates, simulation=simulation, percentile=percentile,
+                     batch_size=batch_size, seed=seed, n_jobs=None):
+    """
+    Parallel analysis, scree test and Kaiser criterion for the number of factors.
+
+    Parameters:
+    - df_transformed: DataFrame with the log transformed and standardised columns (DataAnalysis.transform_dataset).
+    - n_replicates (int): Number of random datasets. Default is n_replicates.
+    - simulation (str): 'normal' or 'permutation'. Default is simulation.
+    - percentile (float): Percentile of the random eigenvalues. Default is 95.
+    - batch_size (int): Number of random datasets per batch. Default is batch_size.
+    - seed (int): Seed of the random datasets. Default is seed.
+    - n_jobs (int, optional): Number of processes. Default is None (number of CPUs). With 1 all batches are
+      simulated in this process.
+
+    Returns:
+    - eigenvalues: DataFrame per component with the observed eigenvalue, the mean and percentile of the random
+      eigenvalues, the line of the optimal coordinates and whether the component is retained by each criterion.
+    - n_factors: Series with the number of factors of each criterion.
+    """
+    X = df_transformed.to_numpy(dtype=float)
+    observed = observed_eigenvalues(X)
+
+    # random datasets in batches, each batch with its own seed (the result does not depend on the number of processes)
+    sizes = [min(batch_size, n_replicates - start) for start in range(0, n_replicates, batch_size)]
+    batches = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(batches))
+    if n_jobs <= 1:
+        results = [random_eigenvalues(X, size, simulation, batch_seed) for size, batch_seed in batches]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_retention_worker, initargs=(X, simulation)) as pool:
+            results = list(pool.map(random_eigenvalues_task, batches))
+    simulated = np.concatenate(results)
+    random_percentile = np.percentile(simulated, percentile, axis=0)
+
+    n_optimal_coordinates, n_acceleration_factor, predicted = scree_test(observed, random_percentile)
+    eigenvalues = pd.DataFrame({
+        'eigenvalue': observed,
+        'random mean': simulated.mean(axis=0),
+        f'random {percentile}th percentile': random_percentile,
+        'optimal coordinates line': predicted,
+        'parallel analysis': observed > random_percentile,
+        'Kaiser': observed > 1,
+        }, index=pd.RangeIndex(1, len(observed) + 1, name='component'))
+
+    n_factors = pd.Series({
+        'parallel analysis': leading_count(eigenvalues['parallel analysis']),
+        'Kaiser': int(eigenvalues['Kaiser'].sum()),
+        'optimal coordinates': n_optimal_coordinates,
+        'acceleration factor': n_acceleration_factor,
+        }, name='n_factors')
+    return eigenvalues, n_factors
+
+
+def plot_scree(eigenvalues, outpath=None, show=True):
+    """
+    Scree plot: observed eigenvalues, the percentile of the random eigenvalues and the Kaiser criterion.
+
+    Parameters:
+    - eigenvalues: DataFrame from factor_retention.
+    - outpath (str, optional): Path to export the figure as jpg file. Default is None.
+    - show (bool): If True, shows the plot. Default is True.
+
+    Returns:
+    - fig: The created figure.
+    - ax: The axes of the created figure.
+    """
+    import matplotlib.pyplot as plt
+    random_column = [column for column in eigenvalues.columns if column.endswith('percentile')][0]
+    fig, ax = plt.subplots()
+    ax.plot(eigenvalues.index, eigenvalues['eigenvalue'], marker='o', label='observed')
+    ax.plot(eigenvalues.index, eigenvalues[random_column], marker='.', linestyle='--', label=f'parallel analysis ({random_column})')
+    ax.axhline(1, color='grey', linewidth=1, label='Kaiser criterion')
+    ax.set_xlabel('Component')
+    ax.set_ylabel('Eigenvalue')
+    ax.legend()
+    if outpath:
+        fig.savefig(outpath, bbox_inches="tight")
+    if show:
+        plt.show()
+    return fig, ax
+
+#%% run factor retention
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # read dataset (output DataPreparations.py) and transform it as in DataAnalysis.py
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv'))
+    df_transformed = DataAnalysis.transform_dataset(df, DataAnalysis.columns_to_analyse)
+
+    # number of factors of each criterion (the article uses DataAnalysis.n_factors)
+    eigenvalues, n_factors = factor_retention(df_transformed)
+    print(eigenvalues.head(10))
+    print(n_factors)
+    print(f'n_factors of the article: {DataAnalysis.n_factors}')
+
+    # export the eigenvalues and the scree plot
+    outdir = os.path.join(repo_dir, 'Output', 'FactorRetention')
+    os.makedirs(outdir, exist_ok=True)
+    eigenvalues.to_csv(os.path.join(outdir, f'factor_retention_{simulation}.csv'))
+    plot_scree(eigenvalues, os.path.join(outdir, 'scree_plot.jpg'))
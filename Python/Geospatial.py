@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Geospatial"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - compute the location features of (new) samples from their coordinates, instead of the manual GIS step:
+        - 'distance startpoint Yamuna [m]': distance to the start point of the transect at the Yamuna river bank
+          (as the HubDist of the POIs)
+        - 'transect chainage [m]' and 'transect offset [m]': position along the transect line and distance to it
+        - 'distance to canal [m]': distance to the nearest canal of a canal network (line file, e.g. GeoJSON)
+        - 'Elevation surface [mMSL] profile' and 'depth [mMSL] profile': surface elevation interpolated from the
+          elevation profile at the distance of each sample, and the depth of the well below it
+    - elevation profiles of any length (e.g. from a high-resolution DEM) are stored as .npy file and memory-mapped,
+      so only the parts of the profile that are looked up are read
+    - the lines (canals, transect) are split in short pieces, indexed with a KD-tree, and the exact distance to the
+      line segments of the nearest pieces is calculated for all samples at once, in chunks for millions of samples
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+from scipy.spatial import cKDTree
+from pyproj import Transformer
+
+#%% settings of the spatial features
+
+# coordinates of the samples (columns 'x' and 'y' of the metadata: longitude and latitude)
+crs_geographic = 'EPSG:4326'
+
+# projected coordinate system for distances in metres: UTM zone 43N (the study area lies between 72 and 78 degrees E)
+crs_projected = 'EPSG:32643'
+
+# maximum length of the pieces of the lines in the KD-tree [m]
+piece_length = 50
+
+# number of nearest pieces of which the line segment is checked first, and the maximum number
+n_candidates = 8
+max_candidates = 128
+
+# number of samples per chunk
+chunksize = 1000000
+
+# feet -> m, for the depth of the wells
+feet_to_m = 0.3048
+
+#%% coordinates and lines
+
+def project(x, y, crs_from=crs_geographic, crs_to=crs_projected):
+    """
+    Transforms coordinates, for all samples at once.
+
+    Parameters:
+    - x, y: Arrays with the coordinates (longitude and latitude for EPSG:4326).
+    - crs_from (str): Coordinate system of x and y. Default is crs_geographic.
+    - crs_to (str): Coordinate system of the output. Default is crs_projected.
+
+    Returns:
+    - X, Y: Arrays with the transformed coordinates.
+    """
+    transformer = Transformer.from_crs(crs_from, crs_to, always_xy=True)
+    return transformer.transform(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+
+def line_segments(geometries):
+    """
+    Splits lines in their straight segments.
+
+    Parameters:
+    - geometries: Iterable of shapely LineStrings or MultiLineStrings (projected coordinates).
+
+    Returns:
+    - segments: Array (segments x 4) with the start and end point of each segment [x0, y0, x1, y1].
+    """
+    segments = []
+    for geometry in geometries:
+        if geometry is None or geometry.is_empty:
+            continue
+        lines = geometry.geoms if hasattr(geometry, 'geoms') else [geometry]
+        for line in lines:
+            coords = np.asarray(line.coords)[:, :2]
+            segments.append(np.hstack([coords[:-1], coords[1:]]))
+    if not segments:
+        raise ValueError('No line segments found')
+    return np.vstack(segments)
+
+
+def load_segments(path, crs=crs_projected):
+    """
+    Reads a line file (e.g. the canal network as GeoJSON or shapefile) and splits it in segments.
+
+    Parameters:
+    - path (str): Path of the line file.
+    - crs (str): Projected coordinate system of the segments. Default is crs_projected.
+
+    Returns:
+    - segments: Array (segments x 4) with projected coordinates [x0, y0, x1, y1].
+    """
+    import geopandas as gpd
+    gdf = gpd.read_file(path).to_crs(crs)
+    return line_segments(gdf.geometry)
+
+#%% spatial index
+
+def build_index(segments, piece_length=piece_length):
+    """
+    Builds a KD-tree over the lines: every segment is split in pieces of at most piece_length, the
+    midpoints of the pieces are the points of the tree.
+
+    Parameters:
+    - segments: Array (segments x 4) with projected coordinates [x0, y0, x1, y1].
+    - piece_length (float): Maximum length of the pieces [m]. Default is piece_length.
+
+    Returns:
+    - index (dict): 'tree' (the KD-tree), 'segments', 'piece_segment' (segment of each point of the tree) and
+      'half_piece' (half the length of the longest piece).
+    """
+    segments = np.asarray(segments, dtype=float)
+    lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    n_pieces = np.maximum(np.ceil(lengths / piece_length).astype(int), 1)
+
+    # midpoints of the pieces of all segments at once
+    piece_segment = np.repeat(np.arange(len(segments)), n_pieces)
+    start = np.cumsum(n_pieces) - n_pieces
+    fraction = (np.arange(len(piece_segment)) - start[piece_segment] + 0.5) / n_pieces[piece_segment]
+    px = segments[piece_segment, 0] + fraction * (segments[piece_segment, 2] - segments[piece_segment, 0])
+    py = segments[piece_segment, 1] + fraction * (segments[piece_segment, 3] - segments[piece_segment, 1])
+    return {'tree': cKDTree(np.column_stack([px, py])), 'segments': segments, 'piece_segment': piece_segment,
+            'half_piece': (lengths / n_pieces).max() / 2}
+
+
+def segment_distance(X, Y, segments):
+    """
+    Distance of points to segments (pairwise, same length) and the position of the nearest point on the segment.
+
+    Parameters:
+    - X, Y: Arrays with the projected coordinates of the points.
+    - segments: Array (points x 4) with the segment of each point.
+
+    Returns:
+    - distance: Array with the distances [m].
+    - t: Array with the position of the nearest point on the segment (0 at the start, 1 at the end).
+    """
+    dx = segments[..., 2] - segments[..., 0]
+    dy = segments[..., 3] - segments[..., 1]
+    squared_length = dx**2 + dy**2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = ((X - segments[..., 0]) * dx + (Y - segments[..., 1]) * dy) / squared_length
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    return np.hypot(segments[..., 0] + t * dx - X, segments[..., 1] + t * dy - Y), t
+
+
+def nearest_segment(index, X, Y, k=n_candidates, chunksize=chunksize):
+    """
+    Nearest line segment of every point: the KD-tree gives the k nearest pieces, the exact distance to their segments
+    is calculated and the nearest is kept. A segment at distance d has a piece within d + half a piece, so when the
+    k-th piece is closer than that, the point is checked again with 4 x more pieces (up to max_candidates) and
+    then with all pieces within that radius.
+
+    Parameters:
+    - index (dict): Spatial index (see build_index).
+    - X, Y: Arrays with the projected coordinates of the points.
+    - k (int): Number of nearest pieces to check. Default is n_candidates.
+    - chunksize (int): Number of points per chunk. Default is chunksize.
+
+    Returns:
+    - distance: Array with the distance to the nearest segment [m] (NaN for points without coordinates).
+    - segment: Array with the number of the nearest segment (-1 for points without coordinates).
+    - t: Array with the position of the nearest point on that segment.
+    """
+    X = np.asarray(X, dtype=float)
+    Y = np.asarray(Y, dtype=float)
+    k = min(k, index['tree'].n)
+    distance = np.full(len(X), np.nan)
+    segment = np.full(len(X), -1)
+    t = np.full(len(X), np.nan)
+    valid = np.flatnonzero(np.isfinite(X) & np.isfinite(Y))
+
+    for start in range(0, len(valid), chunksize):
+        rows = valid[start:start + chunksize]
+        points = np.column_stack([X[rows], Y[rows]])
+
+        # the points of which a nearer segment may not be among the candidates are checked again with 4 x more pieces
+        todo = np.arange(len(rows))
+        n_pieces = min(k, index['tree'].n)
+        while len(todo):
+            piece_distance, pieces = index['tree'].query(points[todo], k=n_pieces)
+            piece_distance = piece_distance.reshape(len(todo), n_pieces)
+            candidates = index['piece_segment'][pieces.reshape(len(todo), n_pieces)]
+            d, s = segment_distance(points[todo, 0, None], points[todo, 1, None], index['segments'][candidates])
+            best = d.argmin(axis=1)
+            distance[rows[todo]] = d[np.arange(len(todo)), best]
+            segment[rows[todo]] = candidates[np.arange(len(todo)), best]
+            t[rows[todo]] = s[np.arange(len(todo)), best]
+
+            todo = todo[piece_distance[:, -1] <= distance[rows[todo]] + index['half_piece']]
+            if n_pieces == index['tree'].n:
+                todo = todo[:0]
+            elif n_pieces >= max_candidates:
+                break
+            n_pieces = min(4 * n_pieces, index['tree'].n)
+
+        # remaining points (dense networks): all pieces within the radius
+        for i in todo:
+            radius = distance[rows[i]] + index['half_piece']
+            nearby = np.unique(index['piece_segment'][index['tree'].query_ball_point(points[i], radius)])
+            d, s = segment_distance(points[i, 0], points[i, 1], index['segments'][nearby])
+            distance[rows[i]], segment[rows[i]], t[rows[i]] = d.min(), nearby[d.argmin()], s[d.argmin()]
+    return distance, segment, t
+
+
+def transect_line(gdf_POI, crs=crs_projected):
+    """
+    Transect line from the Points of Interest (POIs along the cross-section): from the start point at the Yamuna
+    (smallest HubDist) to the end point at the Ganges (largest HubDist).
+
+    Parameters:
+    - gdf_POI: GeoDataFrame with the POIs and the column 'HubDist'.
+    - crs (str): Projected coordinate system. Default is crs_projected.
+
+    Returns:
+    - line: Array (points x 2) with the projected coordinates of the transect line.
+    """
+    points = gdf_POI.to_crs(crs).sort_values('HubDist').geometry
+    return np.array([[points.iloc[0].x, points.iloc[0].y], [points.iloc[-1].x, points.iloc[-1].y]])
+
+
+def chainage(X, Y, line, chunksize=chunksize):
+    """
+    Position of the points along a line (chainage) and their distance to the line (offset).
+
+    Parameters:
+    - X, Y: Arrays with the projected coordinates of the points.
+    - line: Array (points x 2) with the projected coordinates of the line.
+    - chunksize (int): Number of points per chunk. Default is chunksize.
+
+    Returns:
+    - chainage: Array with the distance along the line to the projection of each point [m].
+    - offset: Array with the distance of each point to the line [m].
+    """
+    line = np.asarray(line, dtype=float)
+    segments = np.hstack([line[:-1], line[1:]])
+    lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    cumulative = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+
+    offset, segment, t = nearest_segment(build_index(segments), X, Y, chunksize=chunksize)
+    found = segment >= 0
+    along = np.full(len(offset), np.nan)
+    along[found] = cumulative[segment[found]] + t[found] * lengths[segment[found]]
+    return along, offset
+
+
+#%% surface elevation from the elevation profile
+
+def convert_profile(path_csv, path_npy, distance_column='Distance_startpoint_Yamuna', elevation_column='depth_MSL'):
+    """
+    Converts an elevation profile (CSV) to a .npy file that can be memory-mapped: an array (2 x vertices) with the
+    distance along the profile and the elevation, sorted by distance. Large profiles are read in chunks.
+
+    Parameters:
+    - path_csv (str): Path of the profile (CSV).
+    - path_npy (str): Path of the .npy file.
+    - distance_column (str): Column with the distance from the start point [m]. Default is 'Distance_startpoint_Yamuna'.
+    - elevation_column (str): Column with the surface elevation [mMSL]. Default is 'depth_MSL'.
+
+    Returns:
+    - path_npy (str): Path of the .npy file.
+    """
+    chunks = pd.read_csv(path_csv, usecols=[distance_column, elevation_column], chunksize=chunksize)
+    profile = np.concatenate([chunk[[distance_column, elevation_column]].to_numpy(dtype=float).T for chunk in chunks], axis=1)
+    profile = profile[:, np.argsort(profile[0], kind='stable')]
+    np.save(path_npy, profile)
+    return path_npy
+
+
+def load_profile(path, distance_column='Distance_startpoint_Yamuna', elevation_column='depth_MSL'):
+    """
+    Loads an elevation profile: a .npy file (see convert_profile) is memory-mapped, a CSV file is read.
+
+    Parameters:
+    - path (str): Path of the profile (.npy or CSV).
+    - distance_column, elevation_column (str): Columns of a CSV profile (see convert_profile).
+
+    Returns:
+    - profile: Array (2 x vertices) with the distance [m] and the surface elevation [mMSL], sorted by distance.
+    """
+    if path.endswith('.npy'):
+        profile = np.load(path, mmap_mode='r')
+        if profile.ndim != 2 or profile.shape[0] != 2:
+            raise ValueError(f'{path} is not a profile (array of 2 x vertices), see convert_profile')
+        return profile
+    df_profile = pd.read_csv(path, usecols=[distance_column, elevation_column]).sort_values(distance_column, kind='stable')
+    return df_profile[[distance_column, elevation_column]].to_numpy(dtype=float).T
+
+
+def surface_elevation(distance, profile):
+    """
+    Interpolates the surface elevation at the distances of the samples, for all samples at once. The distances are
+    looked up with a binary search in the sorted profile, so a memory-mapped profile is only read where it is needed.
+
+    Parameters:
+    - distance: Array with the distance from the start point of each sample [m].
+    - profile: Array (2 x vertices) with the distance and the elevation (see load_profile).
+
+    Returns:
+    - elevation: Array with the surface elevation [mMSL] (NaN outside the profile).
+    """
+    distance = np.asarray(distance, dtype=float)
+    elevation = np.full(len(distance), np.nan)
+    for start in range(0, len(distance), chunksize):
+        part = distance[start:start + chunksize]
+        elevation[start:start + chunksize] = np.interp(part, profile[0], profile[1], left=np.nan, right=np.nan)
+    return elevation
+
+
+def well_depth(df):
+    """
+    Depth of the wells [m]: the column 'depth [m]', or 'depth [feet]' converted to m where it is missing.
+
+    Parameters:
+    - df: DataFrame with 'depth [m]' and/or 'depth [feet]'.
+
+    Returns:
+    - depth: Array with the depth below the surface [m].
+    """
+    depth = np.full(len(df), np.nan)
+    if 'depth [feet]' in df.columns:
+        depth = (df['depth [feet]'].to_numpy(dtype=float) * feet_to_m).round(1)
+    if 'depth [m]' in df.columns:
+        depth_m = df['depth [m]'].to_numpy(dtype=float)
+        depth = np.where(np.isnan(depth_m), depth, depth_m)
+    return depth
+
+#%% features of the samples
+
+def spatial_features(df, start_point, line=None, canal_index=None, profile=None, x='x', y='y', crs=crs_geographic):
+    """
+    Calculates the location features of the samples from their coordinates.
+
+    Parameters:
+    - df: DataFrame with the coordinates of the samples.
+    - start_point (tuple): Projected coordinates of the start point of the transect at the Yamuna.
+    - line (optional): Array (points x 2) with the projected transect line (see transect_line). Default is None.
+    - canal_index (dict, optional): Spatial index of the canal network (see build_index). Default is None.
+    - profile (optional): Array (2 x vertices) with the elevation profile (see load_profile). Default is None.
+    - x, y (str): Columns with the coordinates. Default is 'x' and 'y' (longitude and latitude).
+    - crs (str): Coordinate system of the columns x and y. Default is crs_geographic.
+
+    Returns:
+    - features: DataFrame with 'distance startpoint Yamuna [m]' and, when the line, canal index and profile are
+      given, 'transect chainage [m]', 'transect offset [m]', 'distance to canal [m]', 'Elevation surface [mMSL] profile',
+      'depth [m]' and 'depth [mMSL] profile'.
+    """
+    X, Y = project(df[x], df[y], crs_from=crs)
+    features = pd.DataFrame(index=df.index)
+    features['distance startpoint Yamuna [m]'] = np.hypot(X - start_point[0], Y - start_point[1])
+    if line is not None:
+        features['transect chainage [m]'], features['transect offset [m]'] = chainage(X, Y, line)
+    if canal_index is not None:
+        features['distance to canal [m]'] = nearest_segment(canal_index, X, Y)[0]
+    if profile is not None:
+        features['Elevation surface [mMSL] profile'] = surface_elevation(features['distance startpoint Yamuna [m]'], profile)
+        features['depth [m]'] = well_depth(df)
+        features['depth [mMSL] profile'] = features['Elevation surface [mMSL] profile'] - features['depth [m]']
+    return features
+
+
+def load_transect(repo_dir, crs=crs_projected):
+    """
+    Start point and transect line of the article, from the POIs along the cross-section.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - crs (str): Projected coordinate system. Default is crs_projected.
+
+    Returns:
+    - start_point: Projected coordinates of the start point at the Yamuna.
+    - line: Array (points x 2) with the projected transect line.
+    """
+    import geopandas as gpd
+    gdf_POI = gpd.read_file(os.path.join(repo_dir, 'Data', 'StartData', 'DataForFigures', 'POIs_along_transect_v2.geojson'))
+    line = transect_line(gdf_POI, crs)
+    return line[0], line
+
+
+def profile_path(repo_dir):
+    """
+    Returns the path of the elevation profile of the article (Data/StartData/DataForFigures/elevation_profile_v1.csv).
+    """
+    return os.path.join(repo_dir, 'Data', 'StartData', 'DataForFigures', 'elevation_profile_v1.csv')
+
+#%% location features of the samples of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # line file of the canal network (not part of the repository), e.g. exported from the GIS project
+    canal_path = None
+
+    df_meta = pd.read_csv(os.path.join(repo_dir, 'Data', 'StartData', 'Metadata_samples_vanBroekhoven_v1.csv'), delimiter=';', index_col='Sample ID')
+    start_point, line = load_transect(repo_dir)
+    canal_index = build_index(load_segments(canal_path)) if canal_path else None
+    profile = load_profile(profile_path(repo_dir))
+    features = spatial_features(df_meta, start_point, line, canal_index, profile)
+
+    # compare with the values of the manual GIS step in the metadata (the profile follows the transect line,
+    # the Hydrosheds elevation is taken at the well itself)
+    for column, metadata_column in [('distance startpoint Yamuna [m]', 'distance startpoint Yamuna [m]'),
+                                    ('distance to canal [m]', 'distance to canal [m]'),
+                                    ('Elevation surface [mMSL] profile', 'Elevation surface [mMSL] Hydrosheds'),
+                                    ('depth [mMSL] profile', 'depth [mMSL]')]:
+        if column in features:
+            difference = (features[column] - df_meta[metadata_column]).abs()
+            print(f'{column}: median difference with the metadata {difference.median():.1f} m, largest {difference.max():.1f} m')
+    print(features.describe())
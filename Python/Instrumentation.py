@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Instrumentation"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - record wall time, CPU time and peak memory of each section (stage) of the scripts: read, merge, BDL cleaning,
+      transform, factor analysis, clustering, figure exports and tables
+    - write the records as JSON to Output/Instrumentation
+    - profile one named stage with cProfile and a tracemalloc snapshot, to find the hot spots
+
+    The instrumentation is off by default and switched on without editing the scripts, with environment variables:
+    - HINDON_INSTRUMENTATION=1          record all stages
+    - HINDON_PROFILE_STAGE=<stage>      also profile this stage, e.g. HINDON_PROFILE_STAGE="factor analysis"
+    - HINDON_TRACE_MEMORY=1             also measure the peak memory with tracemalloc
+    or from Python with Instrumentation.enable().
+
+    Tracing every allocation makes Python-heavy stages up to ~15x slower, so the memory is not traced by default and
+    the records show whether a stage ran traced ('memory traced'); compare times of untraced runs only. A stage that
+    starts tracemalloc also stops it, so tracing for one profiled stage does not slow down the stages after it.
+
+"""
+#%% import modules
+import os
+import json
+import time
+import platform
+import functools
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+
+#%% settings of the instrumentation
+
+# name of the stage to profile with cProfile and tracemalloc, None for no profile
+profile_stage = os.environ.get('HINDON_PROFILE_STAGE') or None
+
+# record the stages (switched on with HINDON_INSTRUMENTATION=1, a stage to profile or enable())
+enabled = os.environ.get('HINDON_INSTRUMENTATION', '0') == '1' or profile_stage is not None
+
+# measure the peak memory of the stages with tracemalloc (off by default: tracing slows down the stages)
+trace_memory = os.environ.get('HINDON_TRACE_MEMORY', '0') == '1'
+
+# number of lines in the text reports of the profile
+profile_lines = 30
+
+# repository of the output (Output/Instrumentation), None for the repository of this script (hindon sets --repo-dir)
+output_repo_dir = None
+
+# records of the finished stages and the stages that are running (nested stages)
+records = []
+open_stages = []
+
+#%% switch the instrumentation on and off
+
+def enable(profile=None, memory=None):
+    """
+    Switches the instrumentation on.
+
+    Parameters:
+    - profile (str, optional): Name of the stage to profile with cProfile and tracemalloc. Default is None.
+    - memory (bool, optional): If True, the peak memory of the stages is measured with tracemalloc (the times of the
+      stages are then measured under tracing). Default is None (trace_memory, HINDON_TRACE_MEMORY).
+    """
+    global enabled, profile_stage, trace_memory
+    enabled = True
+    profile_stage = profile
+    if memory is not None:
+        trace_memory = memory
+
+
+def disable():
+    """
+    Switches the instrumentation off (the records are kept).
+    """
+    global enabled
+    enabled = False
+
+
+def clear():
+    """
+    Removes the records.
+    """
+    records.clear()
+
+#%% stages
+
+@contextlib.contextmanager
+def stage(name, **info):
+    """
+    Records a section of a script as stage: wall time, CPU time and, when the memory is traced (trace_memory or the
+    profiled stage), peak memory. Stages can be nested; the peak memory of a stage includes the memory of its nested
+    stages. The stage that starts tracemalloc stops it at its end. Does nothing when the instrumentation is off.
+
+    Parameters:
+    - name (str): Name of the stage, e.g. 'factor analysis'.
+    - info: Other fields to add to the record, e.g. rows=len(df).
+
+    Example:
+        with Instrumentation.stage('factor analysis'):
+            fa.fit(df_transformed)
+    """
+    if not enabled:
+        yield
+        return
+
+    # memory: the peak of the running stage is kept before the peak is reset for this stage
+    memory = trace_memory or name == profile_stage
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if open_stages and tracemalloc.is_tracing():
+        open_stages[-1]['peak'] = max(open_stages[-1]['peak'], tracemalloc.get_traced_memory()[1])
+    start_memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    record = {'stage': name, 'parent': open_stages[-1]['record']['stage'] if open_stages else None,
+              'start': time.strftime('%Y-%m-%d %H:%M:%S'), 'memory traced': tracemalloc.is_tracing(), **info}
+    entry = {'record': record, 'peak': 0}
+    open_stages.append(entry)
+
+    profiler = None
+    if name == profile_stage:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    start, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    except BaseException as error:
+        record['error'] = repr(error)
+        raise
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        record['cpu seconds'] = time.process_time() - start_cpu
+        if profiler is not None:
+            profiler.disable()
+        open_stages.pop()
+
+        # peak memory above the memory at the start of the stage (the peaks of nested stages are kept in the entry),
+        # passed on to the running stage
+        if tracemalloc.is_tracing():
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            record['peak memory [MB]'] = (peak - start_memory) / 1e6
+            if open_stages:
+                open_stages[-1]['peak'] = max(open_stages[-1]['peak'], peak)
+        if profiler is not None:
+            record['profile'] = write_profile(name, profiler)
+        if started_tracing:
+            tracemalloc.stop()
+        records.append(record)
+
+
+def instrumented(name):
+    """
+    Decorator that records every call of a function as stage.
+
+    Parameters:
+    - name (str): Name of the stage.
+
+    Example:
+        @Instrumentation.instrumented('figure 3')
+        def figure_3(df, ...):
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+#%% output
+
+def output_dir(repo_dir=None):
+    """
+    Returns the directory of the instrumentation output: Output/Instrumentation of the repository.
+
+    Parameters:
+    - repo_dir (str, optional): Location of the repository. Default is None (output_repo_dir, or the repository of
+      this script).
+
+    Returns:
+    - outdir (str): The directory of the output.
+    """
+    repo_dir = repo_dir or output_repo_dir or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(repo_dir, 'Output', 'Instrumentation')
+
+
+def write_profile(name, profiler):
+    """
+    Writes the profile of a stage: the cProfile statistics (.prof, readable with pstats or snakeviz), the functions
+    with the highest cumulative time and the lines that allocated the most memory (tracemalloc).
+
+    Parameters:
+    - name (str): Name of the stage.
+    - profiler: The cProfile.Profile of the stage.
+
+    Returns:
+    - paths (list): Paths of the written files.
+    """
+    outdir = output_dir()
+    os.makedirs(outdir, exist_ok=True)
+    base = os.path.join(outdir, 'profile_' + ''.join(c if c.isalnum() else '_' for c in name))
+
+    profiler.dump_stats(base + '.prof')
+    with open(base + '_cprofile.txt', 'w') as file:
+        pstats.Stats(profiler, stream=file).sort_stats('cumulative').print_stats(profile_lines)
+    paths = [base + '.prof', base + '_cprofile.txt']
+
+    if tracemalloc.is_tracing():
+        statistics = tracemalloc.take_snapshot().statistics('lineno')
+        with open(base + '_tracemalloc.txt', 'w') as file:
+            file.write('\n'.join(str(statistic) for statistic in statistics[:profile_lines]))
+        paths.append(base + '_tracemalloc.txt')
+    return paths
+
+
+def write_records(script, path=None, repo_dir=None):
+    """
+    Writes the records of the stages as JSON, when the instrumentation is on.
+
+    Parameters:
+    - script (str): Name of the script, e.g. 'DataAnalysis'.
+    - path (str, optional): Path of the JSON file. Default is None (Output/Instrumentation/<script>_<time>.json).
+    - repo_dir (str, optional): Location of the repository of the output. Default is None (see output_dir).
+
+    Returns:
+    - path (str): Path of the JSON file, None when nothing was recorded.
+    """
+    if not enabled or not records:
+        return None
+    if path is None:
+        path = os.path.join(output_dir(repo_dir), f"{script}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    output = {
+        'script': script,
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'pid': os.getpid(),
+        'stages': records,
+        }
+    with open(path, 'w') as file:
+        json.dump(output, file, indent=1)
+    return path
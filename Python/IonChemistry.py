@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "IonChemistry"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - convert the major ions from mg/L to meq/L for all ions at once (conversion factors as vector, one matrix product)
+    - ion balance (electro-neutrality) and a flag for samples above the tolerance
+    - hydrochemical indices in the same pass: hardness check, sodium adsorption ratio (SAR), sodium percentage (Na%)
+      and water type (dominant cation and anion)
+    - process large lab archives (CSV) in chunks
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+
+#%% conversion factors
+
+# dictionaries for cations and anions with parameter name and conversion factor from mg/L -> mEq/L  (valance/molar mass)
+anions = {
+    'Alk [mg/L]': 0.02,
+    'SO4 [mg/L]': 0.02082,
+    'Cl [mg/L]': 0.02821,
+    'F [mg/L]': 0.05264,
+    'NO2 [mg/L]': 0.02174,
+    'NO3 [mg/L]': 0.01613,
+    }
+
+cations = {
+    'Ca [mg/L]': 0.04990,
+    'Mg [mg/L]': 0.08229,
+    'Na [mg/L]': 0.04350,
+    'K [mg/L]': 0.02558,
+    'NH4 [mg/L]': 0.05544,
+    }
+
+# all ions, conversion factors as vector and the charge matrix (ions x [anions, cations])
+ion_columns = list(anions) + list(cations)
+conversion = np.array(list(anions.values()) + list(cations.values()))
+charge = np.zeros((len(ion_columns), 2))
+charge[:len(anions), 0] = 1
+charge[len(anions):, 1] = 1
+
+# samples with an absolute ion balance error above this percentage are flagged
+balance_tolerance = 5
+
+# mg/L Ca and Mg -> mg/L CaCO3 (molar mass CaCO3 / molar mass ion)
+hardness_factors = {'Ca [mg/L]': 2.497, 'Mg [mg/L]': 4.118}
+
+# ion groups of the water type (dominant cation and anion in meq/L), alkalinity is expressed as HCO3
+cation_groups = {'Ca': ['Ca [mg/L]'], 'Mg': ['Mg [mg/L]'], 'Na+K': ['Na [mg/L]', 'K [mg/L]']}
+anion_groups = {'HCO3': ['Alk [mg/L]'], 'Cl': ['Cl [mg/L]'], 'SO4': ['SO4 [mg/L]']}
+
+#%% ion balance and indices
+
+def milliequivalents(df):
+    """
+    Converts all ions from mg/L to meq/L at once.
+
+    Parameters:
+    - df: DataFrame with the ion concentrations [mg/L] (columns of anions and cations).
+
+    Returns:
+    - meq: Array (samples x ions) in meq/L, in the order of ion_columns.
+    """
+    return df[ion_columns].to_numpy(dtype=float) * conversion
+
+
+def ion_balance(df, meq=None):
+    """
+    Calculates the sum of anions and cations [mEq/L] and the Anion-Cation Balance Difference [%] with one matrix product.
+
+    Parameters:
+    - df: DataFrame with the anion and cation concentrations [mg/L].
+    - meq (optional): Array (samples x ions) in meq/L of the samples of df (see milliequivalents), when it is already
+      calculated. Default is None (converted from df).
+
+    Returns:
+    - balance: DataFrame with the columns 'sum anions [mEq/L]', 'sum cations [mEq/L]' and 'an/cat_diff%'.
+    """
+    if meq is None:
+        meq = milliequivalents(df)
+    sums = meq @ charge
+    anion_sum, cation_sum = sums[:, 0], sums[:, 1]
+    return pd.DataFrame({
+        'sum anions [mEq/L]': anion_sum,
+        'sum cations [mEq/L]': cation_sum,
+        'an/cat_diff%': (cation_sum - anion_sum) / (cation_sum + anion_sum) * 100,
+        }, index=df.index)
+
+
+def hydrochemical_indices(df, tolerance=balance_tolerance):
+    """
+    Calculates the ion balance and the hydrochemical indices in one pass.
+
+    Parameters:
+    - df: DataFrame with the ion concentrations [mg/L] and, optionally, the measured hardness 'Hard [mg/L]'.
+    - tolerance (float): Samples with an absolute ion balance error above this percentage are flagged. Default is 5.
+
+    Returns:
+    - indices: DataFrame with the ion balance, 'balance flag', calculated hardness and difference with the measured
+      hardness, 'SAR', 'Na%' and 'water type'.
+    """
+    # the ions are converted to meq/L once, for the ion balance and the indices
+    meq = milliequivalents(df)
+    indices = ion_balance(df, meq)
+    meq = pd.DataFrame(meq, columns=ion_columns, index=df.index)
+    indices['balance flag'] = indices['an/cat_diff%'].abs() > tolerance
+
+    # hardness check: Ca and Mg as mg/L CaCO3 against the measured hardness
+    calculated = sum(df[column].to_numpy(dtype=float) * factor for column, factor in hardness_factors.items())
+    indices['hardness calculated [mg/L CaCO3]'] = calculated
+    if 'Hard [mg/L]' in df.columns:
+        measured = df['Hard [mg/L]'].to_numpy(dtype=float)
+        indices['hardness diff%'] = (calculated - measured) / measured * 100
+
+    # sodium adsorption ratio and sodium percentage (meq/L)
+    ca, mg, na, k = (meq[column].to_numpy() for column in ['Ca [mg/L]', 'Mg [mg/L]', 'Na [mg/L]', 'K [mg/L]'])
+    indices['SAR'] = na / np.sqrt((ca + mg) / 2)
+    indices['Na%'] = (na + k) / (ca + mg + na + k) * 100
+
+    # water type: dominant cation group and anion group
+    cation_meq = np.stack([meq[columns].sum(axis=1, min_count=1).to_numpy() for columns in cation_groups.values()], axis=1)
+    anion_meq = np.stack([meq[columns].sum(axis=1, min_count=1).to_numpy() for columns in anion_groups.values()], axis=1)
+    cation_type = np.array(list(cation_groups))[np.nan_to_num(cation_meq, nan=-1).argmax(axis=1)]
+    anion_type = np.array(list(anion_groups))[np.nan_to_num(anion_meq, nan=-1).argmax(axis=1)]
+    water_type = pd.Series(np.char.add(np.char.add(cation_type.astype(str), '-'), anion_type.astype(str)), index=df.index)
+    water_type[np.isnan(cation_meq).all(axis=1) | np.isnan(anion_meq).all(axis=1)] = np.nan
+    indices['water type'] = water_type
+    return indices
+
+#%% large lab archives
+
+def process_csv(path_in, path_out, chunksize=1000000, tolerance=balance_tolerance, **read_csv_kwargs):
+    """
+    Calculates the hydrochemical indices of a (large) CSV file in chunks, so the file does not have to fit in memory.
+    The indices are appended to the columns of the input file.
+
+    Parameters:
+    - path_in (str): Path of the CSV file with the ion concentrations [mg/L].
+    - path_out (str): Path of the output CSV file.
+    - chunksize (int): Number of rows per chunk. Default is 1000000.
+    - tolerance (float): Tolerance of the ion balance error [%]. Default is 5.
+    - read_csv_kwargs: Other arguments of pandas.read_csv, e.g. index_col='Sample ID'.
+
+    Returns:
+    - summary: Series with the number of rows, the number of flagged rows and the number of rows per water type.
+    """
+    rows = 0
+    flagged = 0
+    water_types = pd.Series(dtype=float)
+    for i, chunk in enumerate(pd.read_csv(path_in, chunksize=chunksize, **read_csv_kwargs)):
+        indices = hydrochemical_indices(chunk, tolerance)
+        chunk.drop(columns=indices.columns, errors='ignore').join(indices).to_csv(
+            path_out, mode='w' if i == 0 else 'a', header=(i == 0))
+        rows += len(chunk)
+        flagged += int(indices['balance flag'].sum())
+        water_types = water_types.add(indices['water type'].value_counts(), fill_value=0)
+    return pd.concat([pd.Series({'rows': rows, 'flagged': flagged}), water_types.astype(int)])
+
+#%% hydrochemical indices of the article dataset
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import DataCache
+
+    # read dataset (output DataAnalysis.py)
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv'))
+    indices = hydrochemical_indices(df)
+    print(indices)
+    print(f"{indices['balance flag'].sum()} of {len(indices)} samples with an ion balance error above {balance_tolerance}%")
+    print(indices.groupby(df['cluster'], observed=True)['water type'].value_counts())
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Isotopes"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - stable isotopes (dO18 and dD) of every sample: deuterium excess and the offset from a meteoric water line
+    - regression line (dD against dO18) of every group (cluster or sample type), for all groups at once from the
+      sums of each group (samples sorted once by group, np.add.reduceat)
+    - bootstrap confidence intervals of the slopes and intercepts: all resamples of a batch are drawn at once
+      (samples resampled within their group) and fitted with the same sums
+    - comparison of the regression lines with the reference meteoric water lines of meteoric_lines
+      (figure 3 of DataVisualisation.py draws the LMWL of Delhi)
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import warnings
+
+#%% settings
+
+# reference meteoric water lines: name -> (slope, intercept) of dD = slope * dO18 + intercept
+meteoric_lines = {
+    'GMWL': (8.0, 10.0),        # global meteoric water line [Craig, 1961]
+    'Delhi': (7.15, 2.60),      # Delhi [Pang et al., 2004 in Joshi et al., 2018]
+    'Joshi': (7.9, 5.56),       # study area of Joshi et al., 2018
+    'global': (8.14, 10.9),     # global [Rozanski et al., 1993]
+    }
+
+# meteoric water line of the offsets and of figure 3
+lmwl = 'Delhi'
+
+# columns of the isotopes
+x_column = 'dO18'
+y_column = 'dD'
+
+# bootstrap: number of resamples, resamples per batch, confidence level (%) and seed
+n_bootstrap = 1000
+batch_size = 100
+confidence = 95
+seed = 2024
+
+#%% meteoric water lines and indices of the samples
+
+def meteoric_line(d18O, line=lmwl):
+    """
+    dD of a meteoric water line.
+
+    Parameters:
+    - d18O: dO18 value(s).
+    - line (str or tuple): Name of a line of meteoric_lines, or (slope, intercept). Default is lmwl.
+
+    Returns:
+    - d2H: dD value(s) on the line.
+    """
+    slope, intercept = meteoric_lines[line] if isinstance(line, str) else line
+    return slope * np.asarray(d18O) + intercept
+
+
+def isotope_indices(df, line=lmwl, x=x_column, y=y_column):
+    """
+    Deuterium excess (dD - 8 * dO18, Dansgaard, 1964) and the offset from a meteoric water line
+    (dD - dD of the line at the dO18 of the sample) of every sample.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - line (str or tuple): Meteoric water line of the offset. Default is lmwl.
+    - x (str): Column with dO18. Default is x_column.
+    - y (str): Column with dD. Default is y_column.
+
+    Returns:
+    - df_indices: DataFrame with the columns 'd-excess' and '<line> offset'.
+    """
+    d18O, d2H = df[x].to_numpy(dtype=float), df[y].to_numpy(dtype=float)
+    name = line if isinstance(line, str) else 'LMWL'
+    return pd.DataFrame({'d-excess': d2H - 8 * d18O,
+                         f'{name} offset': d2H - meteoric_line(d18O, line)}, index=df.index)
+
+#%% regression lines of all groups
+
+def sort_groups(df, by, x=x_column, y=y_column):
+    """
+    Samples with both isotopes and a group, sorted by group.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - by (str): Column with the groups.
+    - x (str): Column with dO18. Default is x_column.
+    - y (str): Column with dD. Default is y_column.
+
+    Returns:
+    - groups (list): Names of the groups, sorted.
+    - xs, ys: Arrays with the values, sorted by group.
+    - starts, sizes: Arrays with the first position and the number of samples of each group.
+    """
+    valid = df[x].notna() & df[y].notna() & df[by].notna()
+    codes, groups = pd.factorize(df.loc[valid, by].astype(str), sort=True)
+    order = np.argsort(codes, kind='stable')
+    present, starts = np.unique(codes[order], return_index=True)
+    sizes = np.diff(np.append(starts, len(codes)))
+    xs = df.loc[valid, x].to_numpy(dtype=float)[order]
+    ys = df.loc[valid, y].to_numpy(dtype=float)[order]
+    return [groups[code] for code in present], xs, ys, starts, sizes
+
+
+def group_fit(xs, ys, starts, sizes):
+    """
+    Least-squares lines of all groups at once, from the centred sums of each group. The samples are along the last
+    axis (sorted by group), so a batch of resamples (resamples x samples) is fitted in the same way.
+
+    Parameters:
+    - xs, ys: Arrays (... x samples) sorted by group.
+    - starts, sizes: Arrays with the first position and the number of samples of each group.
+
+    Returns:
+    - fit (dict): Arrays (... x groups): 'slope', 'intercept', 'r2', 'slope se' and 'intercept se' (NaN for groups
+      with too few samples or without spread in dO18).
+    """
+    n = sizes.astype(float)
+    mean_x = np.add.reduceat(xs, starts, axis=-1) / n
+    mean_y = np.add.reduceat(ys, starts, axis=-1) / n
+    dx = xs - np.repeat(mean_x, sizes, axis=-1)
+    dy = ys - np.repeat(mean_y, sizes, axis=-1)
+    Sxx = np.add.reduceat(dx * dx, starts, axis=-1)
+    Syy = np.add.reduceat(dy * dy, starts, axis=-1)
+    Sxy = np.add.reduceat(dx * dy, starts, axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Sxx = np.where(Sxx > 0, Sxx, np.nan)
+        slope = Sxy / Sxx
+        intercept = mean_y - slope * mean_x
+        residual = np.clip(Syy - slope * Sxy, 0, None)
+        r2 = 1 - residual / Syy
+        variance = np.where(n > 2, residual / (n - 2), np.nan)
+        slope_se = np.sqrt(variance / Sxx)
+        intercept_se = np.sqrt(variance * (1 / n + mean_x**2 / Sxx))
+    return {'slope': slope, 'intercept': intercept, 'r2': r2, 'slope se': slope_se, 'intercept se': intercept_se}
+
+
+def bootstrap_fit(xs, ys, starts, sizes, n_bootstrap=n_bootstrap, batch_size=batch_size, seed=seed):
+    """
+    Slopes and intercepts of bootstrap resamples of all groups: every sample is replaced by a random sample of its
+    own group (the groups keep their size), for a batch of resamples at once.
+
+    Parameters:
+    - xs, ys: Arrays sorted by group.
+    - starts, sizes: Arrays with the first position and the number of samples of each group.
+    - n_bootstrap (int): Number of resamples. Default is n_bootstrap.
+    - batch_size (int): Resamples per batch. Default is batch_size.
+    - seed (int): Seed of the resamples. Default is seed.
+
+    Returns:
+    - slopes, intercepts: Arrays (resamples x groups).
+    """
+    rng = np.random.default_rng(seed)
+    group_start = np.repeat(starts, sizes)
+    group_size = np.repeat(sizes, sizes)
+    slopes, intercepts = [], []
+    for start in range(0, n_bootstrap, batch_size):
+        size = min(batch_size, n_bootstrap - start)
+        index = group_start + (rng.random((size, len(xs))) * group_size).astype(np.intp)
+        fit = group_fit(xs[index], ys[index], starts, sizes)
+        slopes.append(fit['slope'])
+        intercepts.append(fit['intercept'])
+    return np.concatenate(slopes), np.concatenate(intercepts)
+
+
+def fit_lines(df, by='cluster', x=x_column, y=y_column, n_bootstrap=n_bootstrap, confidence=confidence, seed=seed):
+    """
+    Regression line (dD against dO18) of every group, with bootstrap confidence intervals.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - by (str): Column with the groups, e.g. 'cluster' or 'Type'. Default is 'cluster'.
+    - x (str): Column with dO18. Default is x_column.
+    - y (str): Column with dD. Default is y_column.
+    - n_bootstrap (int): Number of bootstrap resamples, 0 for none. Default is n_bootstrap.
+    - confidence (float): Confidence level (%) of the intervals. Default is 95.
+    - seed (int): Seed of the resamples. Default is seed.
+
+    Returns:
+    - df_lines: DataFrame per group with 'n', 'slope', 'intercept', 'r2', the standard errors and the bootstrap
+      confidence intervals ('slope lower', 'slope upper', 'intercept lower', 'intercept upper').
+    """
+    groups, xs, ys, starts, sizes = sort_groups(df, by, x, y)
+    df_lines = pd.DataFrame(group_fit(xs, ys, starts, sizes), index=pd.Index(groups, name=by))
+    df_lines.insert(0, 'n', sizes)
+
+    if n_bootstrap:
+        slopes, intercepts = bootstrap_fit(xs, ys, starts, sizes, n_bootstrap, seed=seed)
+        tail = (100 - confidence) / 2
+        # groups without a line in any resample (one sample or one dO18 value) give NaN
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            df_lines[['slope lower', 'slope upper']] = np.nanpercentile(slopes, [tail, 100 - tail], axis=0).T
+            df_lines[['intercept lower', 'intercept upper']] = np.nanpercentile(intercepts, [tail, 100 - tail], axis=0).T
+    return df_lines
+
+
+def compare_lines(df_lines, lines=None):
+    """
+    Compares the regression lines of the groups with reference meteoric water lines: t-test of the slope
+    ((slope - reference slope) / standard error, n - 2 degrees of freedom) and whether the reference slope and
+    intercept are within the bootstrap confidence intervals.
+
+    Parameters:
+    - df_lines: DataFrame from fit_lines.
+    - lines (list, optional): Names of meteoric_lines. Default is None (all lines).
+
+    Returns:
+    - df_comparison: DataFrame per group and reference line.
+    """
+    from scipy import stats
+    lines = list(meteoric_lines) if lines is None else list(lines)
+    reference = np.array([meteoric_lines[line] for line in lines])
+
+    # groups x lines
+    t = (df_lines['slope'].to_numpy()[:, None] - reference[None, :, 0]) / df_lines['slope se'].to_numpy()[:, None]
+    p = 2 * stats.t.sf(np.abs(t), (df_lines['n'].to_numpy() - 2)[:, None])
+    index = pd.MultiIndex.from_product([df_lines.index, lines], names=[df_lines.index.name, 'line'])
+    df_comparison = pd.DataFrame({
+        'reference slope': np.tile(reference[:, 0], len(df_lines)),
+        'reference intercept': np.tile(reference[:, 1], len(df_lines)),
+        'slope difference': (df_lines['slope'].to_numpy()[:, None] - reference[None, :, 0]).ravel(),
+        'slope t': t.ravel(),
+        'slope p': p.ravel(),
+        }, index=index)
+    if 'slope lower' in df_lines.columns:
+        within = lambda name, column: ((df_lines[f'{name} lower'].to_numpy()[:, None] <= reference[None, :, column])
+                                       & (reference[None, :, column] <= df_lines[f'{name} upper'].to_numpy()[:, None])).ravel()
+        df_comparison['slope in CI'] = within('slope', 0)
+        df_comparison['intercept in CI'] = within('intercept', 1)
+    return df_comparison
+
+#%% isotopes of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import DataCache
+
+    # read dataset (output DataAnalysis.py)
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv'))
+
+    # indices of the samples, lines and comparison per cluster and per sample type
+    outdir = os.path.join(repo_dir, 'Output', 'Isotopes')
+    os.makedirs(outdir, exist_ok=True)
+    isotope_indices(df).to_csv(os.path.join(outdir, 'isotope_indices.csv'))
+    for by in ['cluster', 'Type']:
+        df_lines = fit_lines(df, by)
+        df_comparison = compare_lines(df_lines)
+        print(df_lines.round(2))
+        print(df_comparison.round(3))
+        df_lines.to_csv(os.path.join(outdir, f'isotope_lines_{by}.csv'))
+        df_comparison.to_csv(os.path.join(outdir, f'isotope_lines_{by}_comparison.csv'))
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Mixing"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - end-member mixing model: the fractions of the recharge sources (end-members) in every groundwater sample,
+      from conservative tracers (dO18, dD and Cl)
+    - end-members from the surface water samples of the dataset (irrigation canal and village pond), and end-members
+      that are not sampled (e.g. rainfall) from a given mean and standard deviation per tracer
+    - the fractions are non-negative and sum to one: least squares of every subset of end-members (with the
+      sum-to-one constraint) and per sample the best subset with non-negative fractions, for all samples at once
+    - uncertainty by Monte Carlo: the end-members are drawn from their spread and the samples from the analytical
+      error, and all draws of a chunk of samples are solved at once
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import time
+import itertools
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+#%% settings
+
+# end-members from the samples of the dataset: name -> (column, value)
+end_members = {
+    'irrigation canal': ('Type', 'irrigation canal'),
+    'village pond': ('Type', 'village pond'),
+    }
+
+# end-members that are not sampled: name -> {tracer: (mean, standard deviation)}, e.g. rainfall
+# {'rainfall': {'dO18': (..., ...), 'dD': (..., ...), 'Cl [mg/L]': (..., ...)}}; every tracer needs a value
+extra_end_members = {}
+
+# conservative tracers
+tracers = ['dO18', 'dD', 'Cl [mg/L]']
+
+# analytical error (standard deviation) of the tracers, and the relative error of the tracers that are not listed
+analytical_error = {'dO18': 0.1, 'dD': 1.0}
+relative_error = 0.05
+
+# sample types to unmix
+groundwater_types = ['deep tubewell', 'shallow tubewell']
+
+# Monte Carlo: number of draws, samples per chunk, confidence level (%) and seed
+n_draws = 1000
+chunk_size = 500
+confidence = 95
+seed = 2024
+
+#%% end-members
+
+def end_member_table(df, end_members=end_members, tracers=tracers, extra=extra_end_members):
+    """
+    Composition of the end-members: mean and standard deviation (spread of the samples) of every tracer.
+
+    Parameters:
+    - df: DataFrame containing the sample data.
+    - end_members (dict): Sampled end-members, name -> (column, value). Default is end_members.
+    - tracers (list): Tracers. Default is tracers.
+    - extra (dict): End-members that are not sampled, name -> {tracer: (mean, sd)}. Default is extra_end_members.
+
+    Returns:
+    - df_mean: DataFrame (end-members x tracers) with the means.
+    - df_sd: DataFrame (end-members x tracers) with the standard deviations (0 for a single sample).
+    - counts: Series with the number of samples of every end-member (0 for the extra end-members).
+    """
+    means, sds, counts = {}, {}, {}
+    for name, (column, value) in end_members.items():
+        rows = df.loc[df[column].astype(str) == str(value), tracers].astype(float)
+        means[name] = rows.mean()
+        sds[name] = rows.std().fillna(0)
+        counts[name] = len(rows)
+    for name, values in extra.items():
+        means[name] = pd.Series({tracer: values[tracer][0] for tracer in tracers})
+        sds[name] = pd.Series({tracer: values[tracer][1] for tracer in tracers})
+        counts[name] = 0
+
+    df_mean, df_sd = pd.DataFrame(means).T[tracers], pd.DataFrame(sds).T[tracers]
+    missing = df_mean.isna()
+    if missing.any().any():
+        raise ValueError(f'End-members without a value of a tracer: {missing.stack()[missing.stack()].index.tolist()}')
+    return df_mean, df_sd, pd.Series(counts)
+
+
+def tracer_errors(Y, tracers=tracers, analytical_error=analytical_error, relative_error=relative_error):
+    """
+    Analytical error (standard deviation) of the tracers of the samples.
+
+    Parameters:
+    - Y: Array (samples x tracers).
+    - tracers (list): Tracers (columns of Y). Default is tracers.
+    - analytical_error (dict): Absolute error per tracer. Default is analytical_error.
+    - relative_error (float): Relative error of the other tracers. Default is 0.05.
+
+    Returns:
+    - errors: Array (samples x tracers).
+    """
+    absolute = np.array([analytical_error.get(tracer, np.nan) for tracer in tracers])
+    return np.where(np.isnan(absolute), relative_error * np.abs(Y), absolute)
+
+#%% constrained mixing fractions
+
+def supports(n_end_members):
+    """
+    All non-empty subsets of the end-members, as boolean array (subsets x end-members).
+    """
+    return np.array([subset for subset in itertools.product([False, True], repeat=n_end_members) if any(subset)])
+
+
+def solve_fractions(Y, E, tolerance=1e-9):
+    """
+    Non-negative mixing fractions that sum to one, for all samples (and draws) at once. For every subset of the
+    end-members the least squares fractions with the sum-to-one constraint follow from one (small) linear system per
+    end-member matrix, which is solved for all samples together; per sample the subset with non-negative fractions
+    and the smallest misfit is the solution of the constrained problem.
+
+    Parameters:
+    - Y: Array (... x samples x tracers) with the scaled tracers of the samples.
+    - E: Array (... x tracers x end-members) with the scaled end-members; the leading dimensions (e.g. the Monte
+      Carlo draws) broadcast with those of Y.
+    - tolerance (float): Tolerance of the non-negative fractions. Default is 1e-9.
+
+    Returns:
+    - fractions: Array (... x samples x end-members).
+    - misfit: Array (... x samples) with the sum of squared residuals of the scaled tracers.
+    """
+    m = E.shape[-1]
+    batch = np.broadcast_shapes(Y.shape[:-2], E.shape[:-2])
+    fractions = np.full(batch + (Y.shape[-2], m), np.nan)
+    misfit = np.full(batch + (Y.shape[-2],), np.inf)
+
+    # products of all end-members once: Gram matrix E'E, E'y and y'y of every sample
+    G = np.swapaxes(E, -1, -2) @ E
+    B = Y @ E
+    yy = (Y ** 2).sum(axis=-1)
+    for support in supports(m):
+        s = int(support.sum())
+        Gs = G[..., support, :][..., support]
+        Bs = B[..., support]
+
+        # Lagrange system [[2 Es'Es, 1], [1', 0]] [f, lambda] = [2 Es'y, 1]; pinv for end-members that coincide
+        K = np.ones(G.shape[:-2] + (s + 1, s + 1))
+        K[..., :s, :s] = 2 * Gs
+        K[..., s, s] = 0
+        Kinv = np.linalg.pinv(K)
+        f = 2 * Bs @ Kinv[..., :s, :s] + Kinv[..., s:, :s]
+
+        # misfit |y - Es f|^2 = y'y - 2 f'Es'y + f'Es'Es f
+        residual = yy - ((2 * Bs - f @ Gs) * f).sum(axis=-1)
+        better = (f >= -tolerance).all(axis=-1) & (residual < misfit - tolerance)
+        candidate = np.zeros(batch + (Y.shape[-2], m))
+        candidate[..., support] = np.clip(f, 0, None)
+        np.copyto(fractions, candidate, where=better[..., None])
+        np.copyto(misfit, residual, where=better)
+    fractions /= fractions.sum(axis=-1, keepdims=True)
+    return fractions, misfit
+
+
+def solve_patterns(Y, E, solve=solve_fractions):
+    """
+    Solves the fractions per pattern of measured tracers: samples without a tracer are unmixed with the other
+    tracers (samples without any tracer give NaN).
+
+    Parameters:
+    - Y: Array (... x samples x tracers) with the scaled tracers, NaN where a tracer is not measured.
+    - E: Array (... x tracers x end-members) with the scaled end-members.
+    - solve (function): Solver of the fractions. Default is solve_fractions.
+
+    Returns:
+    - fractions, misfit: As solve_fractions.
+    """
+    measured = ~np.isnan(Y).reshape(-1, Y.shape[-2], Y.shape[-1]).any(axis=0)
+    batch = np.broadcast_shapes(Y.shape[:-2], E.shape[:-2])
+    fractions = np.full(batch + (Y.shape[-2], E.shape[-1]), np.nan)
+    misfit = np.full(batch + (Y.shape[-2],), np.nan)
+    patterns, inverse = np.unique(measured, axis=0, return_inverse=True)
+    for number, pattern in enumerate(patterns):
+        if not pattern.any():
+            continue
+        rows = np.flatnonzero(inverse.ravel() == number)
+        f, r = solve(Y[..., rows, :][..., pattern], E[..., pattern, :])
+        fractions[..., rows, :] = f
+        misfit[..., rows] = r
+    return fractions, misfit
+
+#%% Monte Carlo
+
+def monte_carlo_chunk(Y, errors, E, sequence, confidence=confidence):
+    """
+    Monte Carlo fractions of a chunk of samples: every draw has its own end-members and the samples are drawn from
+    their analytical error; all draws of the chunk are solved at once.
+
+    Parameters:
+    - Y: Array (samples x tracers) with the scaled tracers of the chunk.
+    - errors: Array (samples x tracers) with the scaled analytical errors.
+    - E: Array (draws x tracers x end-members) with the scaled end-members of the draws.
+    - sequence: SeedSequence of the random stream of the chunk.
+    - confidence (float): Confidence level (%) of the intervals. Default is 95.
+
+    Returns:
+    - summary: Array (samples x 4 * end-members) with the mean, standard deviation, lower and upper bound of the
+      fractions over the draws.
+    """
+    rng = np.random.default_rng(sequence)
+    draws = Y[None] + errors[None] * rng.standard_normal((len(E),) + Y.shape)
+    f, _ = solve_patterns(draws, E)
+    tail = (100 - confidence) / 2
+    # samples without tracers give NaN
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        lower, upper = np.nanpercentile(f, [tail, 100 - tail], axis=0)
+        return np.concatenate([np.nanmean(f, axis=0), np.nanstd(f, axis=0), lower, upper], axis=1)
+
+
+# data shared with the worker processes, set once per worker by init_mixing_worker
+worker_data = {}
+
+
+def init_mixing_worker(E, confidence):
+    """
+    Initialises a worker process with the end-members of the draws.
+    """
+    worker_data.update(E=E, confidence=confidence)
+
+
+def monte_carlo_chunk_task(arguments):
+    """
+    Monte Carlo fractions of one chunk in a worker process, with the end-members set by init_mixing_worker.
+    """
+    Y, errors, sequence = arguments
+    return monte_carlo_chunk(Y, errors, worker_data['E'], sequence, worker_data['confidence'])
+
+#%% mixing model of the samples
+
+def mixing_model(df, end_members=end_members, tracers=tracers, extra=extra_end_members, types=groundwater_types,
+                 n_draws=n_draws, chunk_size=chunk_size, confidence=confidence, seed=seed, n_jobs=1):
+    """
+    Fractions of the end-members in every groundwater sample, with Monte Carlo confidence intervals.
+
+    Parameters:
+    - df: DataFrame containing the sample data (with the end-member samples).
+    - end_members (dict): Sampled end-members, name -> (column, value). Default is end_members.
+    - tracers (list): Tracers. Default is tracers.
+    - extra (dict): End-members that are not sampled, name -> {tracer: (mean, sd)}. Default is extra_end_members.
+    - types (list): Sample types to unmix. Default is groundwater_types.
+    - n_draws (int): Number of Monte Carlo draws, 0 for none. Default is n_draws.
+    - chunk_size (int): Samples per chunk (all draws of a chunk are solved at once). Default is chunk_size.
+    - confidence (float): Confidence level (%) of the intervals. Default is 95.
+    - seed (int): Seed of the draws. Default is seed.
+    - n_jobs (int, optional): Number of processes for the chunks. Default is 1 (this process); None for the number
+      of CPUs. The results do not depend on it.
+
+    Returns:
+    - df_mixing: DataFrame per sample with the fraction of every end-member ('<end-member>'), the misfit and the
+      number of tracers, and with Monte Carlo the mean, standard deviation and interval of every fraction
+      ('<end-member> mean', '<end-member> sd', '<end-member> lower', '<end-member> upper').
+    - df_mean: DataFrame with the composition of the end-members (see end_member_table).
+    """
+    df_mean, df_sd, _ = end_member_table(df, end_members, tracers, extra)
+    names = list(df_mean.index)
+    samples = df.loc[df['Type'].isin(types)] if types is not None else df
+    Y = samples[tracers].to_numpy(dtype=float)
+
+    # tracers scaled by their spread over the samples and the end-members, so they weigh equally in the misfit
+    scale = np.nanstd(np.vstack([Y, df_mean.to_numpy()]), axis=0)
+    scale = np.where(scale > 0, scale, 1)
+    mean, sd = df_mean.to_numpy().T / scale[:, None], df_sd.to_numpy().T / scale[:, None]
+
+    fractions, misfit = solve_patterns(Y / scale, mean)
+    df_mixing = pd.DataFrame(fractions, index=samples.index, columns=names)
+    df_mixing['misfit'] = misfit
+    df_mixing['tracers'] = (~np.isnan(Y)).sum(axis=1)
+    if not n_draws:
+        return df_mixing, df_mean
+
+    # end-members of all draws once (draws x tracers x end-members); each chunk of samples gets its own random stream
+    starts = range(0, len(Y), chunk_size)
+    sequences = np.random.SeedSequence(seed).spawn(1 + len(starts))
+    E = mean[None] + sd[None] * np.random.default_rng(sequences[0]).standard_normal((n_draws,) + mean.shape)
+    errors = tracer_errors(Y, tracers) / scale
+    chunks = [(Y[start:start + chunk_size] / scale, errors[start:start + chunk_size], sequence) for start, sequence in zip(starts, sequences[1:])]
+
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(chunks))
+    if n_jobs <= 1:
+        summary = [monte_carlo_chunk(values, value_errors, E, sequence, confidence) for values, value_errors, sequence in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_mixing_worker, initargs=(E, confidence)) as pool:
+            summary = list(pool.map(monte_carlo_chunk_task, chunks))
+    columns = [f'{name} {statistic}' for statistic in ['mean', 'sd', 'lower', 'upper'] for name in names]
+    df_mixing[columns] = np.vstack(summary)
+    return df_mixing, df_mean
+
+#%% mixing fractions of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import DataCache
+
+    # read dataset (output DataAnalysis.py)
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv'))
+
+    start = time.perf_counter()
+    df_mixing, df_mean = mixing_model(df)
+    print(f'{len(df_mixing)} samples, {n_draws} draws in {time.perf_counter() - start:.2f} s')
+    print(df_mean.round(2))
+    print(df_mixing.join(df['cluster']).round(2))
+
+    # export the fractions and the end-members
+    outdir = os.path.join(repo_dir, 'Output', 'Mixing')
+    os.makedirs(outdir, exist_ok=True)
+    df_mixing.to_csv(os.path.join(outdir, 'mixing_fractions.csv'))
+    df_mean.to_csv(os.path.join(outdir, 'end_members.csv'))
+
+    # regional well inventory: the groundwater samples of the article repeated to 10000 wells
+    df_large = pd.concat([df.loc[df['Type'].isin(groundwater_types)]] * 250 + [df.loc[~df['Type'].isin(groundwater_types)]])
+    start = time.perf_counter()
+    df_mixing_large, _ = mixing_model(df_large, n_jobs=None)
+    print(f'{len(df_mixing_large)} wells, {n_draws} draws in {time.perf_counter() - start:.1f} s')
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "ParameterSweep"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - sensitivity of the Factor Analysis and Cluster Analysis of DataAnalysis.py to their settings: a grid of the
+      columns to analyse, number of factors, rotation, fitting method, linkage and number of clusters
+    - the log transformed and standardised matrix is computed once and shared by all configurations; every
+      combination of columns, factors, rotation and method is fitted once, and all linkages and numbers of clusters
+      are derived from its factor values
+    - the configurations are spread over a pool of processes
+    - one table with per configuration the silhouette, the adjusted Rand index with the clusters of the article
+      (published configuration), the cumulative variance of the factors and the size of the smallest cluster
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import DataAnalysis
+import DataCache
+import Schema
+
+#%% settings of the sweep
+
+# sets of columns to analyse: the columns of the article and the columns without the trace elements
+column_sets = {
+    'article': DataAnalysis.columns_to_analyse,
+    'without trace elements': [column for column in DataAnalysis.columns_to_analyse
+                               if Schema.schema.get(column, {}).get('group') != 'trace elements'],
+    }
+
+# grid of the settings (linkages of scipy: 'ward', 'average', 'complete', 'single')
+sweep_grid = {
+    'columns': list(column_sets),
+    'n_factors': [2, 3, 4, 5, 6],
+    'rotation': ['varimax', 'quartimax', 'promax', None],
+    'method': ['principal', 'minres'],
+    'linkage': ['ward', 'average', 'complete'],
+    'n_clusters': list(range(2, 9)),
+    }
+
+# configuration of the article
+published = {
+    'columns': 'article',
+    'n_factors': DataAnalysis.n_factors,
+    'rotation': DataAnalysis.rotation,
+    'method': DataAnalysis.method,
+    'linkage': 'ward',
+    'n_clusters': DataAnalysis.n_clusters,
+    }
+
+#%% fit the configurations
+
+def transformed_columns(df_transformed, columns):
+    """
+    Positions of the columns to analyse in the transformed matrix (named '<column> log', pH is not log transformed).
+    """
+    names = list(df_transformed.columns)
+    return [names.index(column) if column in names else names.index(f'{column} log') for column in columns]
+
+
+def fit_configuration(X, positions, n_factors, rotation, method, linkages, cluster_range):
+    """
+    Factor Analysis of one combination of columns, factors, rotation and method, and the clusters of all
+    linkages and numbers of clusters cut from the factor values.
+
+    Parameters:
+    - X: Array (samples x variables) with the log transformed and standardised values of all columns of the sweep.
+    - positions (list): Columns of X to analyse.
+    - n_factors (int): Number of factors.
+    - rotation (str or None): Rotation of the factors.
+    - method (str): Fitting method of the factor analysis.
+    - linkages (list): Linkage methods.
+    - cluster_range (list): Numbers of clusters.
+
+    Returns:
+    - scores: Array (samples x factors) with the factor values.
+    - cumulative_variance (float): Share of the variance of the factors.
+    - labels (dict): Cluster numbers of the samples per (linkage, number of clusters).
+    """
+    from factor_analyzer.factor_analyzer import FactorAnalyzer
+    import scipy.cluster.hierarchy as shc
+    fa = FactorAnalyzer(n_factors=n_factors, rotation=rotation, method=method)
+    fa.fit(X[:, positions])
+    scores = fa.transform(X[:, positions])
+    cumulative_variance = float(fa.get_factor_variance()[2][-1])
+
+    labels = {}
+    for linkage in linkages:
+        Z = shc.linkage(scores, method=linkage, metric='euclidean')
+        for k in cluster_range:
+            labels[(linkage, k)] = DataAnalysis.cut_linkage(Z, k)
+    return scores, cumulative_variance, labels
+
+
+def evaluate_configuration(X, positions, configuration, linkages, cluster_range, reference):
+    """
+    Fits one combination of columns, factors, rotation and method and scores all its clusterings.
+
+    Parameters:
+    - X, positions, linkages, cluster_range: See fit_configuration.
+    - configuration (dict): 'columns', 'n_factors', 'rotation' and 'method'.
+    - reference: Array with the clusters of the published configuration.
+
+    Returns:
+    - rows (list): One dict per linkage and number of clusters, with the silhouette, adjusted Rand index,
+      cumulative variance and size of the smallest cluster (or the error when the configuration cannot be fitted).
+    """
+    from sklearn.metrics import silhouette_score, adjusted_rand_score
+    from scipy.spatial.distance import pdist, squareform
+    try:
+        scores, cumulative_variance, labels = fit_configuration(X, positions, configuration['n_factors'], configuration['rotation'],
+                                                                configuration['method'], linkages, cluster_range)
+    except Exception as error:
+        return [dict(configuration, linkage=linkage, n_clusters=k, error=f'{type(error).__name__}: {error}')
+                for linkage in linkages for k in cluster_range]
+
+    # distances between the samples once, for the silhouettes of all clusterings
+    distances = squareform(pdist(scores))
+    rows = []
+    for (linkage, k), clusters in labels.items():
+        rows.append(dict(configuration, linkage=linkage, n_clusters=k,
+                         silhouette=silhouette_score(distances, clusters, metric='precomputed'),
+                         adjusted_rand=adjusted_rand_score(reference, clusters),
+                         cumulative_variance=cumulative_variance,
+                         smallest_cluster=int(np.bincount(clusters)[1:].min()),
+                         error=None))
+    return rows
+
+
+# data shared with the worker processes, set once per worker by init_sweep_worker
+worker_data = {}
+
+
+def init_sweep_worker(X, positions, linkages, cluster_range, reference):
+    """
+    Initialises a worker process with the matrix and the settings shared by all configurations.
+    """
+    worker_data.update(X=X, positions=positions, linkages=linkages, cluster_range=cluster_range, reference=reference)
+
+
+def evaluate_configuration_task(configuration):
+    """
+    Evaluates one configuration in a worker process, with the data set by init_sweep_worker.
+    """
+    return evaluate_configuration(worker_data['X'], worker_data['positions'][configuration['columns']], configuration,
+                                  worker_data['linkages'], worker_data['cluster_range'], worker_data['reference'])
+
+#%% sweep
+
+def parameter_sweep(df, grid=sweep_grid, column_sets=column_sets, published=published, n_jobs=None):
+    """
+    Evaluates the grid of settings of the Factor Analysis and Cluster Analysis.
+
+    Parameters:
+    - df: DataFrame with all samples (prepared dataset).
+    - grid (dict): Values of 'columns' (names of column_sets), 'n_factors', 'rotation', 'method', 'linkage' and
+      'n_clusters'. Default is sweep_grid.
+    - column_sets (dict): Columns to analyse per name. Default is column_sets.
+    - published (dict): Configuration of the article, the reference of the adjusted Rand index. Default is published.
+    - n_jobs (int, optional): Number of processes. Default is None (number of CPUs). With 1 all configurations are
+      evaluated in this process.
+
+    Returns:
+    - df_sweep: DataFrame with one row per configuration, with the columns 'silhouette', 'adjusted_rand',
+      'cumulative_variance', 'smallest_cluster', 'error' and 'published' (True for the configuration of the article).
+    """
+    # log transformed and standardised matrix of all columns of the sweep, once
+    used_sets = list(dict.fromkeys(list(grid['columns']) + [published['columns']]))
+    all_columns = list(dict.fromkeys(column for name in used_sets for column in column_sets[name]))
+    df_transformed = DataAnalysis.transform_dataset(df, all_columns)
+    X = df_transformed.to_numpy(dtype=float)
+    positions = {name: transformed_columns(df_transformed, column_sets[name]) for name in used_sets}
+    linkages, cluster_range = list(grid['linkage']), list(grid['n_clusters'])
+
+    # clusters of the published configuration
+    reference = fit_configuration(X, positions[published['columns']], published['n_factors'], published['rotation'],
+                                  published['method'], [published['linkage']], [published['n_clusters']])[2][(published['linkage'], published['n_clusters'])]
+
+    # one task per combination of columns, factors, rotation and method
+    configurations = [dict(zip(['columns', 'n_factors', 'rotation', 'method'], values))
+                      for values in itertools.product(grid['columns'], grid['n_factors'], grid['rotation'], grid['method'])]
+    n_jobs = min(n_jobs or os.cpu_count() or 1, len(configurations))
+    if n_jobs <= 1:
+        results = [evaluate_configuration(X, positions[configuration['columns']], configuration, linkages, cluster_range, reference)
+                   for configuration in configurations]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=init_sweep_worker, initargs=(X, positions, linkages, cluster_range, reference)) as pool:
+            results = list(pool.map(evaluate_configuration_task, configurations, chunksize=max(1, len(configurations) // (4 * n_jobs))))
+
+    df_sweep = pd.DataFrame([row for rows in results for row in rows])
+    df_sweep['rotation'] = df_sweep['rotation'].fillna('none')
+    df_sweep['published'] = np.logical_and.reduce([df_sweep[key] == (value if value is not None else 'none') for key, value in published.items()])
+    return df_sweep
+
+#%% run the sweep
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # read dataset (output DataPreparation.py)
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv'))
+
+    start = time.perf_counter()
+    df_sweep = parameter_sweep(df)
+    print(f'{len(df_sweep)} configurations in {time.perf_counter() - start:.1f} s')
+    print(df_sweep.loc[df_sweep['published']].T)
+    print(df_sweep.sort_values('silhouette', ascending=False).head(10))
+
+    # export the table
+    outdir = os.path.join(repo_dir, 'Output', 'Sweep')
+    os.makedirs(outdir, exist_ok=True)
+    df_sweep.to_csv(os.path.join(outdir, 'parameter_sweep.csv'), index=False)
@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Pipeline"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - run DataPreparation.py -> DataAnalysis.py -> DataVisualisation.py as one pipeline of stages
+    - memoize each stage on a hash of its inputs and parameters, so only the stages with changed inputs
+      or parameters are run again (e.g. a new palette does not re-run the factor analysis,
+      a new number of clusters does not re-merge the raw data)
+
+"""
+#%% import modules
+import pandas as pd
+import hashlib
+import json
+import os
+import DataCache
+import Instrumentation
+
+#%% stages of the pipeline
+
+# directory of the Python scripts, used to hash the source code of the stages
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# stages in the order they are run:
+# - inputs: stages of which the outputs are used
+# - parameters: parameters of which the values are used
+# - sources: scripts with the code of the stage (Schema.py and DataCache.py for the stages after 'prepare', which
+#   read and write their dataframes through the cache with the data types of the schema)
+# - outputs: names of the output dataframes (files that a stage exports, like figures, are tracked in a manifest)
+stages = {
+    'prepare': {
+        'inputs': [],
+        'parameters': [],
+        'sources': ['DataPreparation.py', 'DetectionLimits.py', 'Schema.py'],
+        'outputs': ['prepared_dataset'],
+        },
+    'factors': {
+        'inputs': ['prepare'],
+        'parameters': ['columns_to_analyse', 'n_factors', 'rotation', 'method'],
+        'sources': ['DataAnalysis.py', 'Schema.py', 'DataCache.py'],
+        'outputs': ['factor_loadings', 'factor_variance', 'factor_values'],
+        },
+    'linkage': {
+        'inputs': ['factors'],
+        'parameters': [],
+        'sources': ['DataAnalysis.py', 'Schema.py', 'DataCache.py'],
+        'outputs': ['ward_linkage'],
+        },
+    'clusters': {
+        'inputs': ['factors', 'linkage'],
+        'parameters': ['n_clusters'],
+        'sources': ['DataAnalysis.py', 'Schema.py', 'DataCache.py'],
+        'outputs': ['cluster_values'],
+        },
+    'analysed': {
+        'inputs': ['prepare', 'clusters'],
+        'parameters': [],
+        'sources': ['DataAnalysis.py', 'IonChemistry.py', 'Schema.py', 'DataCache.py'],
+        'outputs': ['analysed_dataset'],
+        },
+    'model': {
+        'inputs': ['prepare', 'factors', 'clusters'],
+        'parameters': ['columns_to_analyse', 'rotation', 'method'],
+        'sources': ['DataAnalysis.py', 'ScoringModel.py', 'Schema.py', 'DataCache.py'],
+        'outputs': [],
+        },
+    'analysis_figures': {
+        'inputs': ['clusters', 'linkage'],
+        'parameters': [],
+        'sources': ['DataAnalysis.py', 'Schema.py', 'DataCache.py'],
+        'outputs': [],
+        },
+    'render': {
+        'inputs': ['analysed'],
+        'parameters': ['palette', 'variables_to_plot', 'crosssection_interpolation'],
+        'sources': ['DataVisualisation.py', 'ClusterSummary.py', 'Correlation.py', 'Isotopes.py', 'TransectGrid.py', 'Geospatial.py', 'Schema.py', 'DataCache.py'],
+        'outputs': [],
+        },
+    }
+
+
+# parameters of the pipeline: the script and the setting with the default value, as used in the article. A script is
+# only imported for the parameters of the stages that are run, so e.g. the stage 'prepare' does not import
+# DataVisualisation.py (matplotlib and seaborn).
+parameter_settings = {
+    'columns_to_analyse': ('DataAnalysis', 'columns_to_analyse'),
+    'n_factors': ('DataAnalysis', 'n_factors'),
+    'rotation': ('DataAnalysis', 'rotation'),
+    'method': ('DataAnalysis', 'method'),
+    'n_clusters': ('DataAnalysis', 'n_clusters'),
+    'palette': ('DataVisualisation', 'cluster_palette'),
+    'variables_to_plot': ('DataVisualisation', 'variables_to_plot'),
+    'crosssection_interpolation': ('DataVisualisation', 'crosssection_interpolation'),
+    }
+
+
+def default_parameters(names=None):
+    """
+    Returns the default parameters of the pipeline, as used in the article.
+
+    Parameters:
+    - names (list, optional): Names of the parameters. Default is None (all parameters).
+
+    Returns:
+    - parameters (dict): Parameter name and value.
+    """
+    import importlib
+    return {name: getattr(importlib.import_module(script), setting) for name, (script, setting) in parameter_settings.items()
+            if names is None or name in names}
+
+#%% functions of the stages
+# each stage returns a dictionary with the output dataframes and a list with the exported files
+
+def run_prepare(repo_dir, inputs, parameters):
+    """
+    Stage 'prepare': merges the datasets and changes the BDL values (DataPreparation.py).
+    """
+    import DataPreparation
+    df = DataPreparation.prepare_dataset(*DataPreparation.input_paths(repo_dir))
+    outpath = DataPreparation.write_prepared_dataset(df, repo_dir)
+    return {'prepared_dataset': df}, [outpath]
+
+
+def run_factors(repo_dir, inputs, parameters):
+    """
+    Stage 'factors': log transformation, standardisation and factor analysis (DataAnalysis.py).
+    """
+    import DataAnalysis
+    df_transformed = DataAnalysis.transform_dataset(inputs['prepare']['prepared_dataset'], parameters['columns_to_analyse'])
+    loadings, factor_variance, df_reduced = DataAnalysis.factor_analysis(df_transformed, parameters['n_factors'], parameters['rotation'], parameters['method'])
+    return {'factor_loadings': loadings, 'factor_variance': factor_variance, 'factor_values': df_reduced}, []
+
+
+def run_linkage(repo_dir, inputs, parameters):
+    """
+    Stage 'linkage': Ward linkage of the factor values, computed once for all numbers of clusters (DataAnalysis.py).
+    """
+    import DataAnalysis
+    Z = DataAnalysis.ward_linkage(inputs['factors']['factor_values'])
+    outpath = os.path.join(repo_dir, 'Data', 'WorkingData', 'ward_linkage_v1.csv')
+    df_linkage = DataAnalysis.linkage_frame(Z)
+    DataCache.write_dataset(df_linkage, outpath)
+    return {'ward_linkage': df_linkage}, [outpath]
+
+
+def run_clusters(repo_dir, inputs, parameters):
+    """
+    Stage 'clusters': cuts the Ward linkage into the clusters (DataAnalysis.py).
+    """
+    import DataAnalysis
+    Z = inputs['linkage']['ward_linkage'].to_numpy(dtype=float)
+    df_CA = DataAnalysis.cluster_analysis(inputs['factors']['factor_values'], parameters['n_clusters'], Z=Z)
+    return {'cluster_values': df_CA}, []
+
+
+def run_analysed(repo_dir, inputs, parameters):
+    """
+    Stage 'analysed': adds the clusters and the electro-neutrality check to the dataset (DataAnalysis.py).
+    """
+    import DataAnalysis
+    df = DataAnalysis.add_clusters(inputs['prepare']['prepared_dataset'], inputs['clusters']['cluster_values'])
+    df = DataAnalysis.electro_neutrality(df)
+    outpath = os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv')
+    DataCache.write_dataset(df, outpath)
+    return {'analysed_dataset': df}, [outpath]
+
+
+def run_model(repo_dir, inputs, parameters):
+    """
+    Stage 'model': the fitted transformation, factor analysis and cluster centroids to score new samples (ScoringModel.py).
+    """
+    import DataAnalysis
+    import ScoringModel
+    df = inputs['prepare']['prepared_dataset']
+    df_transformed = DataAnalysis.transform_dataset(df, parameters['columns_to_analyse'])
+    model = ScoringModel.build_model(df, df_transformed, inputs['factors']['factor_loadings'], inputs['clusters']['cluster_values'],
+                                     parameters['columns_to_analyse'], parameters['rotation'], parameters['method'])
+    outpath = ScoringModel.model_path(repo_dir)
+    ScoringModel.save_model(model, outpath)
+    return {}, [outpath, os.path.splitext(outpath)[0] + '.npz']
+
+
+def run_analysis_figures(repo_dir, inputs, parameters):
+    """
+    Stage 'analysis_figures': supplementary figures S3 and S4 (DataAnalysis.py).
+    """
+    import DataAnalysis
+    df_CA = inputs['clusters']['cluster_values']
+    outpath_S3 = os.path.join(repo_dir, 'Output', 'Supplementary Material', 'Figure_S3.jpg')
+    outpath_S4 = os.path.join(repo_dir, 'Output', 'Supplementary Material', 'Figure_S4.jpg')
+    Z = inputs['linkage']['ward_linkage'].to_numpy(dtype=float)
+    DataAnalysis.plot_dendrogram(df_CA.drop('cluster', axis=1), outpath_S3, show=False, Z=Z)
+    DataAnalysis.plot_factor_pairs(df_CA, outpath_S4)
+    return {}, [outpath_S3, outpath_S4]
+
+
+def run_render(repo_dir, inputs, parameters):
+    """
+    Stage 'render': figures and tables of the article (DataVisualisation.py).
+    """
+    import DataVisualisation
+    outpaths = DataVisualisation.render_figures(inputs['analysed']['analysed_dataset'], repo_dir,
+                                                palette=parameters['palette'], variables=parameters['variables_to_plot'], show=False,
+                                                interpolation=parameters['crosssection_interpolation'])
+    return {}, outpaths
+
+#%% memoization of the stages
+
+def stage_key(name, repo_dir, input_keys, parameters):
+    """
+    Calculates the memoization key of a stage from the keys of its input stages, its parameters and its source code.
+    The key of the stage 'prepare' is the cache key of DataPreparation.py (content of the raw datasets).
+
+    Parameters:
+    - name (str): Name of the stage.
+    - repo_dir (str): Location of the repository.
+    - input_keys (dict): Keys of the input stages.
+    - parameters (dict): All parameters of the pipeline.
+
+    Returns:
+    - key (str): The memoization key.
+    """
+    stage = stages[name]
+    if name == 'prepare':
+        import DataPreparation
+        return DataPreparation.cache_key(repo_dir)
+    payload = {
+        'stage': name,
+        'inputs': {stage_name: input_keys[stage_name] for stage_name in stage['inputs']},
+        'parameters': {parameter: parameters[parameter] for parameter in stage['parameters']},
+        'sources': DataCache.hash_files([os.path.join(script_dir, source) for source in stage['sources']]),
+        }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def manifest_path(cachedir, name, key):
+    """
+    Returns the path of the manifest of a stage: the files it exported, with their size and modification time.
+    """
+    return os.path.join(cachedir, f'{name}_{key}.json')
+
+
+def file_stamps(paths):
+    """
+    Returns the size and modification time of files, used to check that exported files were not overwritten since.
+    """
+    return {path: [os.path.getsize(path), os.path.getmtime(path)] for path in paths}
+
+
+def is_memoized(name, key, cachedir):
+    """
+    Checks if the outputs of a stage are stored for this key.
+    The exported files must still be the files of this key: figures of another palette overwrite the same files.
+
+    Parameters:
+    - name (str): Name of the stage.
+    - key (str): Memoization key of the stage.
+    - cachedir (str): Directory where the memoized outputs are stored.
+
+    Returns:
+    - memoized (bool): True if all outputs of the stage are stored.
+    """
+    path = manifest_path(cachedir, name, key)
+    if not os.path.exists(path):
+        return False
+    with open(path) as file:
+        stamps = json.load(file)
+    if any(not os.path.exists(outpath) for outpath in stamps) or file_stamps(stamps) != stamps:
+        return False
+    return all(os.path.exists(DataCache.cache_path(cachedir, output, key)) for output in stages[name]['outputs'])
+
+
+def read_memo(name, key, cachedir):
+    """
+    Reads the stored output dataframes of a stage.
+    """
+    return {output: DataCache.read_cache(cachedir, output, key) for output in stages[name]['outputs']}
+
+
+def write_memo(name, key, cachedir, frames, files):
+    """
+    Stores the output dataframes and the manifest of the exported files of a stage.
+    Outputs of earlier keys are kept, so switching back to earlier parameters is memoized as well.
+    """
+    for output, df in frames.items():
+        DataCache.write_cache(df, cachedir, output, key, clean=(name == 'prepare'))
+    with open(manifest_path(cachedir, name, key), 'w') as file:
+        json.dump(file_stamps(files), file, indent=1)
+
+#%% run the pipeline
+
+def run_pipeline(repo_dir, parameters=None, targets=None, force=()):
+    """
+    Runs the stages of the pipeline that are needed for the targets and of which the outputs are not memoized.
+
+    Parameters:
+    - repo_dir (str): Location of the repository.
+    - parameters (dict, optional): Parameters that differ from default_parameters() (see parameter_settings). Default is None.
+    - targets (list, optional): Stages to make; the stages they depend on are made as well. Default is None (all stages).
+    - force (list): Stages that are run again even when their outputs are memoized. Default is none.
+
+    Returns:
+    - report: DataFrame with per stage the memoization key and whether it was run or memoized.
+    - results (dict): Outputs of the stages that were run or read.
+    """
+    cachedir = os.path.join(repo_dir, 'Data', 'WorkingData', 'cache')
+    parameters = dict(parameters or {})
+    unknown = set(parameters) - set(parameter_settings)
+    if unknown:
+        raise KeyError(f'Unknown pipeline parameters: {sorted(unknown)}')
+
+    # stages needed for the targets
+    needed = set()
+    def add_needed(name):
+        if name not in needed:
+            needed.add(name)
+            for input_name in stages[name]['inputs']:
+                add_needed(input_name)
+    for name in (targets or stages):
+        add_needed(name)
+
+    # defaults of the parameters of the needed stages only, and the keys of these stages (stages are defined in
+    # dependency order)
+    used = {parameter for name in needed for parameter in stages[name]['parameters']}
+    all_parameters = default_parameters([parameter for parameter in used if parameter not in parameters])
+    all_parameters.update(parameters)
+    keys = {}
+    for name in stages:
+        if name in needed:
+            keys[name] = stage_key(name, repo_dir, keys, all_parameters)
+
+    # outputs are only read from the memo when a stage downstream has to be run
+    results = {}
+    def get_results(name):
+        if name not in results:
+            results[name] = read_memo(name, keys[name], cachedir)
+        return results[name]
+
+    run_stage = {
+        'prepare': run_prepare,
+        'factors': run_factors,
+        'linkage': run_linkage,
+        'clusters': run_clusters,
+        'analysed': run_analysed,
+        'model': run_model,
+        'analysis_figures': run_analysis_figures,
+        'render': run_render,
+        }
+
+    report = []
+    for name in stages:
+        if name not in needed:
+            continue
+        if name not in force and is_memoized(name, keys[name], cachedir):
+            report.append({'stage': name, 'key': keys[name], 'status': 'memoized'})
+            continue
+        inputs = {input_name: get_results(input_name) for input_name in stages[name]['inputs']}
+        with Instrumentation.stage(f'pipeline {name}'):
+            results[name], files = run_stage[name](repo_dir, inputs, all_parameters)
+        write_memo(name, keys[name], cachedir, results[name], files)
+        report.append({'stage': name, 'key': keys[name], 'status': 'run'})
+
+    report = pd.DataFrame(report).set_index('stage')
+    print(report)
+    return report, results
+
+#%% run pipeline with the settings of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # parameters that differ from the article, e.g. {'n_clusters': 5}
+    parameters = {}
+
+    run_pipeline(repo_dir, parameters)
+
+    # stage timings and memory (when switched on, see Instrumentation.py)
+    Instrumentation.write_records('Pipeline')
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "SampleStore"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - append-only store of the samples of all campaigns (Data/SampleStore), partitioned by campaign and sample type:
+      Data/SampleStore/campaign=<campaign>/type=<type>/part-<batch>.parquet
+    - append a lab batch: only the metadata, hydrochemistry and isotope rows of that batch are merged
+      (DataPreparation.read_datasets) and written as new files; the store is never rewritten
+    - a manifest (manifest.json) with per file the campaign, type, number of samples, date range (CreationDate),
+      locations and coordinate range, so a query reads only the files that can contain matching samples
+    - the stored rows are the merged lab rows (BDL markers kept); prepare_from_store applies the dataset alterations
+      of DataPreparation.py and the data types of Schema.py to the samples of a query
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import json
+import time
+import DataCache
+import DataPreparation
+import Schema
+
+#%% settings
+
+# formats of CreationDate (month-day-year, with or without seconds)
+date_formats = ['%m-%d-%Y %H:%M:%S', '%m-%d-%Y %H:%M']
+
+# column with the sample type (partitions)
+type_column = 'Type'
+
+#%% paths and manifest
+
+def store_path(repo_dir):
+    """
+    Returns the directory of the sample store: Data/SampleStore.
+    """
+    return os.path.join(repo_dir, 'Data', 'SampleStore')
+
+
+def partition_name(value):
+    """
+    Directory name of a partition value, e.g. 'deep tubewell' -> 'deep_tubewell'.
+    """
+    return 'unknown' if pd.isna(value) else str(value).strip().replace(' ', '_').replace(os.sep, '_')
+
+
+def read_manifest(store_dir):
+    """
+    Reads the manifest of the store.
+
+    Parameters:
+    - store_dir (str): Directory of the store.
+
+    Returns:
+    - manifest (dict): {'batches': {batch: description}, 'files': [file description]}, empty for a new store.
+    """
+    path = os.path.join(store_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return {'batches': {}, 'files': []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def write_manifest(manifest, store_dir):
+    """
+    Writes the manifest of the store via a temporary file, so an interrupted append leaves the old manifest.
+    """
+    path = os.path.join(store_dir, 'manifest.json')
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def parse_dates(dates):
+    """
+    Parses CreationDate with the formats of date_formats.
+
+    Parameters:
+    - dates: Series with the dates as text.
+
+    Returns:
+    - dates: Series with datetimes (NaT for dates that do not match a format).
+    """
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    for date_format in date_formats:
+        missing = parsed.isna()
+        parsed[missing] = pd.to_datetime(dates[missing], format=date_format, errors='coerce')
+    return parsed
+
+#%% append a batch
+
+def store_columns(df, hydrochem_columns):
+    """
+    Prepares the merged rows for Parquet: text values of the lab export (e.g. 'BDL' or '<0.5') are kept as text,
+    so the BDL markers are parsed when the samples are prepared.
+    """
+    df = df.copy()
+    for column in hydrochem_columns:
+        if df[column].dtype == object:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def append_batch(store_dir, campaign, paths, batch=None):
+    """
+    Appends a lab batch to the store. Only the rows of the batch are read and merged; each sample type of the batch
+    is written as new file in its partition. A batch that is already in the store (same content) is skipped.
+
+    Parameters:
+    - store_dir (str): Directory of the store.
+    - campaign (str): Name of the campaign, e.g. '2023-03'.
+    - paths (list): Paths of the metadata, hydrochemistry and isotope files of the batch.
+    - batch (str, optional): Name of the batch. Default is None (content hash of the three files).
+
+    Returns:
+    - files (list): Descriptions of the written files (empty when the batch was already in the store).
+    """
+    manifest = read_manifest(store_dir)
+    key = DataCache.hash_files(list(paths))
+    batch = batch or key
+    if any(description['key'] == key for description in manifest['batches'].values()):
+        print(f'batch {batch} is already in the store')
+        return []
+    if batch in manifest['batches']:
+        raise ValueError(f'Batch name {batch} is already used in the store, with other files')
+
+    # merge the rows of this batch only
+    df, hydrochem_columns = DataPreparation.read_datasets(*paths)
+    stored_ids = {sample for description in manifest['files'] for sample in description['samples']}
+    duplicates = df.index[df.index.isin(stored_ids)]
+    if len(duplicates):
+        raise ValueError(f'Samples already in the store: {list(duplicates[:5])}')
+    df = store_columns(df, hydrochem_columns)
+    dates = parse_dates(df['CreationDate'].astype(str)) if 'CreationDate' in df.columns else pd.Series(pd.NaT, index=df.index)
+
+    files = []
+    for sample_type, rows in df.groupby(df[type_column].map(partition_name), sort=True):
+        directory = os.path.join(f'campaign={partition_name(campaign)}', f'type={sample_type}')
+        path = os.path.join(directory, f'part-{partition_name(batch)}.parquet')
+        os.makedirs(os.path.join(store_dir, directory), exist_ok=True)
+        DataCache.write_parquet(rows, os.path.join(store_dir, path))
+
+        # statistics of the file for the queries
+        batch_dates = dates[rows.index].dropna()
+        coordinates = rows[['x', 'y']].astype(float) if {'x', 'y'}.issubset(rows.columns) else pd.DataFrame({'x': [np.nan], 'y': [np.nan]})
+        files.append({
+            'path': path.replace(os.sep, '/'),
+            'campaign': str(campaign),
+            'type': sample_type,
+            'batch': batch,
+            'rows': len(rows),
+            'samples': list(rows.index.astype(str)),
+            'date min': str(batch_dates.min()) if len(batch_dates) else None,
+            'date max': str(batch_dates.max()) if len(batch_dates) else None,
+            'locations': sorted(rows['Location'].dropna().astype(str).unique()) if 'Location' in rows.columns else [],
+            'x min': float(coordinates['x'].min()), 'x max': float(coordinates['x'].max()),
+            'y min': float(coordinates['y'].min()), 'y max': float(coordinates['y'].max()),
+            })
+
+    # the manifest is written last: a batch is only part of the store when all its files are written
+    manifest['batches'][batch] = {'key': key, 'campaign': str(campaign), 'files': [os.path.basename(path) for path in paths],
+                                  'hydrochemistry columns': list(hydrochem_columns), 'appended': time.strftime('%Y-%m-%d %H:%M:%S')}
+    manifest['files'].extend(files)
+    write_manifest(manifest, store_dir)
+    return files
+
+#%% queries
+
+def select_files(manifest, campaigns=None, types=None, start=None, end=None, locations=None, bbox=None):
+    """
+    Files of the manifest that can contain samples of the query (from the partitions and the statistics of the files).
+
+    Parameters: see read_store.
+
+    Returns:
+    - files (list): Descriptions of the selected files.
+    """
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    campaigns = None if campaigns is None else {partition_name(campaign) for campaign in campaigns}
+    types = None if types is None else {partition_name(sample_type) for sample_type in types}
+    locations = None if locations is None else {str(location) for location in locations}
+
+    selected = []
+    for description in manifest['files']:
+        if campaigns is not None and partition_name(description['campaign']) not in campaigns:
+            continue
+        if types is not None and description['type'] not in types:
+            continue
+        if start is not None and (description['date max'] is None or pd.Timestamp(description['date max']) < start):
+            continue
+        if end is not None and (description['date min'] is None or pd.Timestamp(description['date min']) > end):
+            continue
+        if locations is not None and not locations.intersection(description['locations']):
+            continue
+        if bbox is not None:
+            xmin, ymin, xmax, ymax = bbox
+            if not (description['x max'] >= xmin and description['x min'] <= xmax and description['y max'] >= ymin and description['y min'] <= ymax):
+                continue
+        selected.append(description)
+    return selected
+
+
+def read_store(store_dir, campaigns=None, types=None, start=None, end=None, locations=None, bbox=None, columns=None):
+    """
+    Reads the samples of a query from the store; only the files that can contain matching samples are read.
+
+    Parameters:
+    - store_dir (str): Directory of the store.
+    - campaigns (list, optional): Campaigns. Default is None (all).
+    - types (list, optional): Sample types, e.g. ['deep tubewell', 'shallow tubewell']. Default is None (all).
+    - start, end (str or Timestamp, optional): Date range of CreationDate (inclusive). Default is None (open).
+    - locations (list, optional): Values of the column 'Location'. Default is None (all).
+    - bbox (tuple, optional): (x min, y min, x max, y max) of the coordinates. Default is None (all).
+    - columns (list, optional): Columns to read. Default is None (all).
+
+    Returns:
+    - df: DataFrame with the samples, with 'Sample ID' as index and the column 'campaign'.
+    """
+    manifest = read_manifest(store_dir)
+    files = select_files(manifest, campaigns, types, start, end, locations, bbox)
+
+    # the columns of the row filters are read as well
+    read_columns = None
+    if columns is not None:
+        filter_columns = ['CreationDate'] * (start is not None or end is not None) + ['Location'] * (locations is not None) + ['x', 'y'] * (bbox is not None)
+        read_columns = list(dict.fromkeys(list(columns) + filter_columns))
+
+    frames = []
+    for description in files:
+        frame = pd.read_parquet(os.path.join(store_dir, description['path']), columns=read_columns)
+        frames.append(frame.assign(campaign=description['campaign']))
+    if not frames:
+        return pd.DataFrame(columns=list(columns or []) + ['campaign'], index=pd.Index([], name='Sample ID'))
+    df = pd.concat(frames)
+
+    # rows of the query within the selected files
+    keep = np.ones(len(df), dtype=bool)
+    if start is not None or end is not None:
+        dates = parse_dates(df['CreationDate'].astype(str))
+        if start is not None:
+            keep &= (dates >= pd.Timestamp(start)).to_numpy()
+        if end is not None:
+            keep &= (dates <= pd.Timestamp(end)).to_numpy()
+    if locations is not None:
+        keep &= df['Location'].astype(str).isin([str(location) for location in locations]).to_numpy()
+    if bbox is not None:
+        xmin, ymin, xmax, ymax = bbox
+        keep &= (df['x'].between(xmin, xmax) & df['y'].between(ymin, ymax)).to_numpy()
+    df = df.loc[keep]
+    return df if columns is None else df[list(columns) + ['campaign']]
+
+
+def prepare_from_store(store_dir, **query):
+    """
+    Reads the samples of a query and applies the dataset alterations of DataPreparation.py (BDL values and the
+    corrected EC values), over the samples of the query, and the data types of the schema (Schema.py).
+
+    Parameters:
+    - store_dir (str): Directory of the store.
+    - query: Arguments of read_store, e.g. campaigns=['v1'] or types=['deep tubewell'].
+
+    Returns:
+    - df: The combined and altered DataFrame (as DataPreparation.prepare_dataset), with the column 'campaign'.
+    """
+    manifest = read_manifest(store_dir)
+    df = read_store(store_dir, **query)
+    hydrochem_columns = list(dict.fromkeys(column for batch in manifest['batches'].values() for column in batch['hydrochemistry columns']))
+    df = DataPreparation.alter_dataset(df, [column for column in hydrochem_columns if column in df.columns])
+    return Schema.apply_schema(df)
+
+#%% store with the campaign of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # the datasets of the article as campaign 'v1'
+    store_dir = store_path(repo_dir)
+    append_batch(store_dir, 'v1', DataPreparation.input_paths(repo_dir), batch='v1')
+
+    # groundwater samples of March 14 and 15, 2023
+    df = read_store(store_dir, types=['deep tubewell', 'shallow tubewell'], start='2023-03-14', end='2023-03-15 23:59')
+    print(df[['CreationDate', 'Type', 'campaign']])
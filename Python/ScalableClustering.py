@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "ScalableClustering"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - Agglomerative Hierarchical Clustering (Ward) of large datasets, e.g. a regional database of wells:
+      the factor values are summarised in micro-clusters (mini-batch k-means or BIRCH) and Ward is
+      run on the weighted centroids only, so memory and time no longer grow with the square of the samples
+    - map the clusters of the centroids back to every sample
+    - compare with exact Ward (DataAnalysis.py) on datasets that are small enough for both
+    - the number of micro-clusters is capped (n_micro_clusters, also for BIRCH), and Ward on the weighted centroids
+      uses the nearest-neighbour chain, so its time grows with the square of the micro-clusters
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import time
+import scipy.cluster.hierarchy as shc
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import MiniBatchKMeans, Birch
+from sklearn.metrics import adjusted_rand_score
+import DataAnalysis
+
+#%% settings of the scalable clustering
+
+# number of micro-clusters on which Ward is run (k-means; the maximum for BIRCH)
+n_micro_clusters = 500
+
+# method of the micro-clusters: 'kmeans' (mini-batch k-means) or 'birch'
+micro_method = 'kmeans'
+
+# radius of the BIRCH subclusters, in units of the (standardised) factor values
+birch_threshold = 0.3
+
+# seed of the mini-batch k-means
+seed = 2024
+
+#%% micro-clusters
+
+def micro_clusters(scores, n_micro=n_micro_clusters, method=micro_method, threshold=birch_threshold, seed=seed):
+    """
+    Summarises the samples in micro-clusters.
+
+    Parameters:
+    - scores: Array (samples x factors) with the factor values.
+    - n_micro (int): Number of micro-clusters ('kmeans'), or the maximum number ('birch': when BIRCH finds more
+      subclusters, they are grouped by mini-batch k-means into n_micro micro-clusters). Default is n_micro_clusters.
+    - method (str): 'kmeans' or 'birch'. Default is micro_method.
+    - threshold (float): Radius of the BIRCH subclusters. Default is birch_threshold.
+    - seed (int): Seed of the mini-batch k-means. Default is seed.
+
+    Returns:
+    - labels: Array with the micro-cluster of each sample.
+    - centroids: Array (micro-clusters x factors).
+    - weights: Array with the number of samples in each micro-cluster.
+    """
+    if method == 'kmeans':
+        model = MiniBatchKMeans(n_clusters=n_micro, batch_size=4096, random_state=seed)
+        labels = model.fit_predict(scores)
+    elif method == 'birch':
+        model = Birch(threshold=threshold, n_clusters=None).fit(scores)
+        if len(model.subcluster_centers_) > n_micro:
+            model.set_params(n_clusters=MiniBatchKMeans(n_clusters=n_micro, batch_size=4096, random_state=seed))
+            model.partial_fit()
+        labels = model.predict(scores)
+    else:
+        raise ValueError(f"Unknown micro-cluster method {method!r}, use 'kmeans' or 'birch'")
+
+    # centroids and weights from the assigned samples; empty micro-clusters are dropped
+    used, labels = np.unique(labels, return_inverse=True)
+    weights = np.bincount(labels)
+    centroids = np.stack([np.bincount(labels, weights=column) for column in scores.T], axis=1) / weights[:, None]
+    return labels, centroids, weights
+
+#%% Ward on weighted centroids
+
+def weighted_ward(centroids, weights):
+    """
+    Ward clustering of weighted points: the merge cost of two clusters is the increase of the within-cluster sum of
+    squares, w_a*w_b/(w_a+w_b) * |c_a - c_b|^2, so the result equals Ward on all samples of the micro-clusters
+    when every micro-cluster is one point. Ward is reducible, so the merges are found with the nearest-neighbour
+    chain (one vectorised row of merge costs per step, no cost matrix) and then sorted by cost.
+
+    Parameters:
+    - centroids: Array (points x factors).
+    - weights: Array with the weight (number of samples) of each point.
+
+    Returns:
+    - Z: Linkage matrix in the format of scipy (distance sqrt(2 x merge cost), as scipy's Ward), with the
+      number of points (micro-clusters) in the fourth column.
+    """
+    n = len(centroids)
+    centroids = np.array(centroids, dtype=float)
+    weights = np.array(weights, dtype=float)
+    alive = np.ones(n, dtype=bool)
+
+    # nearest-neighbour chain: merges as (kept position, removed position, cost), the merged cluster takes the
+    # position of the kept cluster
+    merges = []
+    chain = []
+    while len(merges) < n - 1:
+        if not chain:
+            chain.append(int(np.flatnonzero(alive)[0]))
+        top = chain[-1]
+        cost = weights[top] * weights / (weights[top] + weights) * ((centroids - centroids[top])**2).sum(axis=1)
+        cost[~alive] = np.inf
+        cost[top] = np.inf
+        nearest = int(np.argmin(cost))
+        # prefer the previous cluster of the chain on ties, so the chain always ends in a merge
+        if len(chain) > 1 and cost[chain[-2]] <= cost[nearest]:
+            nearest = chain[-2]
+        if len(chain) > 1 and nearest == chain[-2]:
+            chain.pop()
+            chain.pop()
+            a, b = min(top, nearest), max(top, nearest)
+            merges.append((a, b, cost[nearest]))
+            centroids[a] = (weights[a] * centroids[a] + weights[b] * centroids[b]) / (weights[a] + weights[b])
+            weights[a] = weights[a] + weights[b]
+            alive[b] = False
+        else:
+            chain.append(nearest)
+
+    # merges sorted by cost (stable, so a cluster is always made before it is merged again) and numbered as scipy
+    order = np.argsort([merge[2] for merge in merges], kind='stable')
+    ids = np.arange(n)
+    points = np.ones(n)
+    Z = np.zeros((n - 1, 4))
+    for step, number in enumerate(order):
+        a, b, cost = merges[number]
+        Z[step] = [min(ids[a], ids[b]), max(ids[a], ids[b]), np.sqrt(2 * cost), points[a] + points[b]]
+        ids[a] = n + step
+        points[a] = points[a] + points[b]
+    return Z
+
+#%% scalable cluster analysis
+
+def scalable_cluster_analysis(df_reduced, n_clusters=4, n_micro=n_micro_clusters, method=micro_method, threshold=birch_threshold, seed=seed):
+    """
+    Ward clustering of the factor values via micro-clusters.
+
+    Parameters:
+    - df_reduced: DataFrame with the factor values of each sample.
+    - n_clusters (int): Number of clusters. Default is 4.
+    - n_micro (int): Number of micro-clusters ('kmeans'), or the maximum number ('birch'). Default is n_micro_clusters.
+    - method (str): 'kmeans' or 'birch'. Default is micro_method.
+    - threshold (float): Radius of the BIRCH subclusters. Default is birch_threshold.
+    - seed (int): Seed of the mini-batch k-means. Default is seed.
+
+    Returns:
+    - df_CA: Copy of df_reduced with the column 'cluster' (cluster numbers starting at 1, numbered as the exact
+      Ward of DataAnalysis.py with DataAnalysis.cut_linkage).
+    - Z: Linkage matrix of the micro-clusters (for a truncated dendrogram).
+    """
+    scores = df_reduced.to_numpy(dtype=float)
+    if method == 'kmeans' and len(scores) <= n_micro:
+        # every sample is its own micro-cluster: exact Ward
+        labels, centroids, weights = np.arange(len(scores)), scores, np.ones(len(scores))
+    else:
+        labels, centroids, weights = micro_clusters(scores, n_micro, method, threshold, seed)
+
+    Z = weighted_ward(centroids, weights)
+    centroid_clusters = DataAnalysis.cut_linkage(Z, n_clusters)
+
+    df_CA = df_reduced.copy()
+    df_CA['cluster'] = centroid_clusters[labels]
+    return df_CA, Z
+
+
+def compare_with_exact(df_reduced, n_clusters=4, n_micro=n_micro_clusters, method=micro_method, threshold=birch_threshold, seed=seed):
+    """
+    Compares the scalable clustering with exact Ward on all samples, for datasets small enough to run both.
+
+    Parameters:
+    - df_reduced: DataFrame with the factor values of each sample.
+    - n_clusters (int): Number of clusters. Default is 4.
+    - n_micro, method, threshold, seed: Settings of the micro-clusters (see scalable_cluster_analysis).
+
+    Returns:
+    - comparison: Series with the number of samples and micro-clusters, the adjusted Rand index between both
+      clusterings, the fraction of samples in the same cluster (after matching the cluster numbers) and both run times [s].
+    """
+    start = time.perf_counter()
+    exact = DataAnalysis.cut_linkage(shc.linkage(df_reduced, method='ward', metric='euclidean'), n_clusters)
+    time_exact = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df_CA, Z = scalable_cluster_analysis(df_reduced, n_clusters, n_micro, method, threshold, seed)
+    time_scalable = time.perf_counter() - start
+    scalable = df_CA['cluster'].to_numpy()
+
+    # fraction of samples in the same cluster, with the cluster numbers matched on the largest overlap
+    table = pd.crosstab(scalable, exact).to_numpy()
+    rows, columns = linear_sum_assignment(-table)
+    agreement = table[rows, columns].sum() / len(scalable)
+
+    return pd.Series({
+        'samples': len(df_reduced),
+        'micro-clusters': len(Z) + 1,
+        'adjusted Rand index': adjusted_rand_score(exact, scalable),
+        'agreement': agreement,
+        'time exact [s]': time_exact,
+        'time scalable [s]': time_scalable,
+        })
+
+#%% compare with exact Ward
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import DataCache
+
+    # factor values of the article dataset (DataAnalysis.py)
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv'))
+    loadings, factor_variance, df_reduced = DataAnalysis.factor_analysis(DataAnalysis.transform_dataset(df))
+
+    # larger test dataset: the factor values of the article resampled with noise
+    rng = np.random.default_rng(seed)
+    n_test = 20000
+    df_large = pd.DataFrame(df_reduced.to_numpy()[rng.integers(0, len(df_reduced), n_test)] + rng.normal(0, 0.3, (n_test, df_reduced.shape[1])),
+                            columns=df_reduced.columns)
+
+    comparison = pd.DataFrame({
+        'article, 20 micro-clusters': compare_with_exact(df_reduced, DataAnalysis.n_clusters, n_micro=20),
+        'test 20000 samples, kmeans': compare_with_exact(df_large, DataAnalysis.n_clusters),
+        'test 20000 samples, birch': compare_with_exact(df_large, DataAnalysis.n_clusters, method='birch'),
+        })
+    print(comparison.T)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "Schema"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - schema of the sample data: per column the data type, unit, analyte group and the levels of the class columns
+    - compact data types of the datasets (used by DataCache.read_dataset and write_dataset, so by the three scripts):
+      categoricals for the class columns ('Type', 'Landuse', 'group', 'Type of water', 'close to industry' and
+      'cluster'), small integers for the location columns and optionally float32 for the concentrations
+    - report of the memory of a dataset before and after the compact data types
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+
+#%% schema
+
+# float32 for the concentrations (analyte groups); float64 keeps the results of the article exactly
+use_float32 = False
+
+# columns: (column, data type, unit, group)
+# data types: 'category' (levels below), 'text', 'int16', 'int32' and 'float' (float32 for the analyte groups when
+# use_float32 is True). 'Sample ID' and 'Remarks' stay text: their values are unique, so categories save nothing.
+columns = [
+    ('Sample ID', 'text', None, 'metadata'),
+    ('x', 'float', '°E', 'location'),
+    ('y', 'float', '°N', 'location'),
+    ('CreationDate', 'text', 'month-day-year', 'metadata'),
+    ('Location', 'int16', None, 'location'),
+    ('depth [feet]', 'int16', 'feet', 'location'),
+    ('depth [m]', 'float', 'm', 'location'),
+    ('Elevation surface [mMSL] Hydrosheds', 'int16', 'mMSL', 'location'),
+    ('depth [mMSL]', 'float', 'mMSL', 'location'),
+    ('Type of water', 'category', None, 'metadata'),
+    ('Type', 'category', None, 'metadata'),
+    ('Landuse', 'category', None, 'metadata'),
+    ('group', 'category', None, 'metadata'),
+    ('distance startpoint Yamuna [m]', 'int32', 'm', 'location'),
+    ('distance to canal [m]', 'float', 'm', 'location'),
+    ('close to industry', 'category', None, 'metadata'),
+    ('EC value [microS/cm]', 'float', 'µS/cm', 'field'),
+    ('field pH', 'float', None, 'field'),
+    ('Temperature', 'float', '°C', 'field'),
+    ('field NO3 [mg/L]', 'float', 'mg/L', 'field'),
+    ('field NO2 [mg/L]', 'float', 'mg/L', 'field'),
+    ('Remarks', 'text', None, 'metadata'),
+    ('pH', 'float', None, 'physicochemical'),
+    ('EC [µS/cm]', 'float', 'µS/cm', 'physicochemical'),
+    ('TDS [mg/L]', 'float', 'mg/L', 'physicochemical'),
+    ('Hard [mg/L]', 'float', 'mg/L as CaCO3', 'physicochemical'),
+    ('Alk [mg/L]', 'float', 'mg/L as CaCO3', 'physicochemical'),
+    ('COD [mg/L]', 'float', 'mg/L', 'physicochemical'),
+    ('BOD [mg/L]', 'float', 'mg/L', 'physicochemical'),
+    ('Cl [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('SO4 [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('F [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('Na [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('K [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('Ca [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('Mg [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('Silica [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('Li [mg/L]', 'float', 'mg/L', 'major ions'),
+    ('NO3 [mg/L]', 'float', 'mg/L', 'nutrients'),
+    ('NO2 [mg/L]', 'float', 'mg/L', 'nutrients'),
+    ('NH4 [mg/L]', 'float', 'mg/L', 'nutrients'),
+    ('PO4 [mg/L]', 'float', 'mg/L', 'nutrients'),
+    ('B  [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Al [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('V [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Cr [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Mn [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Fe [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Co [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Ni [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Cu [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Zn [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('As [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Se [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Sr [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Cd [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Ba [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('Pb [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('U [µg/L]', 'float', 'µg/L', 'trace elements'),
+    ('dO18', 'float', '‰ VSMOW', 'isotopes'),
+    ('dD', 'float', '‰ VSMOW', 'isotopes'),
+    ('cluster', 'category', None, 'analysis'),
+    ('sum anions [mEq/L]', 'float', 'meq/L', 'analysis'),
+    ('sum cations [mEq/L]', 'float', 'meq/L', 'analysis'),
+    ('an/cat_diff%', 'float', '%', 'analysis'),
+    ]
+
+# levels of the class columns; values that are not listed are added as level (e.g. cluster '5')
+categories = {
+    'Type of water': ['GW', 'SW'],
+    'Type': ['deep tubewell', 'shallow tubewell', 'village pond', 'irrigation canal'],
+    'Landuse': ['agriculture', 'village', 'Village', 'pond', 'Eastern Yamuna canal', 'Upper Ganga canal'],
+    'group': ['agri deep', 'agri shallow', 'village deep', 'village shallow', 'next to canal', 'pond', 'canal'],
+    'close to industry': ['close to industry'],
+    'cluster': ['1', '2', '3', '4', 'village pond', 'irrigation canal'],
+    }
+
+# analyte groups: the concentrations (float32 with use_float32)
+analyte_groups = ['field', 'physicochemical', 'major ions', 'nutrients', 'trace elements', 'isotopes']
+
+# schema per column: {'dtype', 'unit', 'group', 'categories'}
+schema = {column: {'dtype': dtype, 'unit': unit, 'group': group, 'categories': categories.get(column)}
+          for column, dtype, unit, group in columns}
+
+
+def schema_table():
+    """
+    Returns the schema as DataFrame (one row per column).
+    """
+    return pd.DataFrame.from_dict(schema, orient='index').rename_axis('column')
+
+
+def group_columns(df, groups):
+    """
+    Columns of a dataset that belong to the given groups of the schema (in the order of the dataset).
+
+    Parameters:
+    - df: DataFrame.
+    - groups (list): Groups, e.g. ['major ions', 'trace elements'].
+
+    Returns:
+    - columns (list): Column names.
+    """
+    return [column for column in df.columns if column in schema and schema[column]['group'] in groups]
+
+#%% compact data types
+
+def apply_schema(df, float32=None):
+    """
+    Applies the data types of the schema to a dataset; columns that are not in the schema are not changed.
+
+    Parameters:
+    - df: DataFrame (e.g. as read from CSV).
+    - float32 (bool, optional): float32 for the concentrations. Default is None (use_float32).
+
+    Returns:
+    - df: Copy of the DataFrame with the compact data types.
+    """
+    float32 = use_float32 if float32 is None else float32
+    df = df.copy()
+    for column in df.columns:
+        if column not in schema:
+            continue
+        dtype, group = schema[column]['dtype'], schema[column]['group']
+        values = df[column]
+        if dtype == 'category':
+            levels = list(schema[column]['categories'])
+            text = values.where(values.isna(), values.astype(str))
+            new_levels = sorted(set(text.dropna().unique()) - set(levels))
+            df[column] = pd.Categorical(text, categories=levels + new_levels)
+        elif dtype in ('int16', 'int32'):
+            # integer columns with missing values stay float
+            if pd.api.types.is_numeric_dtype(values) and values.notna().all() and (values % 1 == 0).all():
+                df[column] = values.astype(dtype)
+        elif dtype == 'float':
+            if pd.api.types.is_numeric_dtype(values):
+                df[column] = values.astype('float32' if float32 and group in analyte_groups else 'float64')
+    return df
+
+
+def memory_report(df_before, df_after):
+    """
+    Memory of a dataset per column before and after the compact data types.
+
+    Parameters:
+    - df_before: DataFrame before apply_schema.
+    - df_after: DataFrame after apply_schema.
+
+    Returns:
+    - report: DataFrame per column (and the index and the total) with the data types and the memory in bytes.
+    """
+    before, after = df_before.memory_usage(deep=True), df_after.memory_usage(deep=True)
+    report = pd.DataFrame({
+        'dtype before': pd.Series({column: str(dtype) for column, dtype in df_before.dtypes.items()}),
+        'dtype after': pd.Series({column: str(dtype) for column, dtype in df_after.dtypes.items()}),
+        'bytes before': before,
+        'bytes after': after,
+        })
+    report.loc['total'] = [None, None, before.sum(), after.sum()]
+    report['saved %'] = 100 * (1 - report['bytes after'] / report['bytes before'])
+    return report
+
+
+def print_memory_report(report):
+    """
+    Prints the total memory saved of a memory report.
+    """
+    total = report.loc['total']
+    print(f"memory {total['bytes before'] / 1e6:.2f} MB -> {total['bytes after'] / 1e6:.2f} MB ({total['saved %']:.0f}% saved)")
+
+#%% memory of the datasets of the article
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    # analysed dataset as read from CSV, and with the compact data types
+    df = pd.read_csv(os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv'), index_col='Sample ID')
+    for float32 in [False, True]:
+        report = memory_report(df, apply_schema(df, float32))
+        print(f'float32 concentrations: {float32}')
+        print_memory_report(report)
+
+    # one million samples (the samples of the article repeated)
+    df_large = df.iloc[np.arange(1000000) % len(df)]
+    report = memory_report(df_large, apply_schema(df_large, float32=True))
+    print(report.sort_values('bytes before', ascending=False).head(10))
+    print_memory_report(report)
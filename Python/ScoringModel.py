@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "ScoringModel"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - save the fitted transformation of DataAnalysis.py as versioned model: the log transformed columns, the mean and
+      standard deviation of the training samples, the factor loadings, the varimax rotation and the factor score
+      weights, and the centroids of the clusters (.npz file with the arrays, .json file with the description)
+    - score new samples with the model, without fitting again: factor values and the cluster that a Ward merge of the
+      sample would join (lowest increase of the within-cluster variance, from the centroids and the sizes of the
+      clusters), for a batch of samples at once with matrix products (hindon score)
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+import json
+import time
+import platform
+
+#%% settings
+
+# version of the model files; models of another version are not loaded
+model_version = 1
+
+# arrays of the model in the .npz file
+model_arrays = ['log', 'mean', 'std', 'fa mean', 'fa std', 'loadings', 'unrotated loadings', 'rotation', 'weights', 'centroids', 'sizes']
+
+#%% build the model
+
+def build_model(df, df_transformed, loadings, df_CA, columns, rotation='varimax', method='principal'):
+    """
+    Builds the model from the results of DataAnalysis.py.
+    The factor values of FactorAnalyzer are ((Z - mean) / std) @ inverse(correlation) @ loadings, with Z the
+    standardised log values and the population mean and standard deviation of Z; the model stores these terms and
+    the weights of the whole chain from the (log) concentrations to the factor values.
+
+    Parameters:
+    - df: DataFrame with all samples (input of DataAnalysis.transform_dataset).
+    - df_transformed: DataFrame with the log transformed and standardised columns of the groundwater samples.
+    - loadings: DataFrame with the factor loadings (rotated).
+    - df_CA: DataFrame with the factor values and the column 'cluster' of the groundwater samples.
+    - columns (list): Columns to analyse.
+    - rotation (str): Rotation of the factor analysis. Default is 'varimax'.
+    - method (str): Fitting method of the factor analysis. Default is 'principal'.
+
+    Returns:
+    - model (dict): The model, with the arrays (see model_arrays) and the description.
+    """
+    # columns that are log transformed (pH is not, see DataAnalysis.log_transform)
+    log = np.array([f'{column} log' in df_transformed.columns for column in columns])
+    X = df.loc[df_transformed.index, columns].to_numpy(dtype=float)
+    X = np.where(log, np.log(np.where(log, X, 1)), X)
+    mean, std = X.mean(axis=0), X.std(axis=0, ddof=1)
+
+    # factor analysis: population mean and standard deviation of the standardised values, correlation matrix
+    Z = df_transformed.to_numpy(dtype=float)
+    fa_mean, fa_std = Z.mean(axis=0), Z.std(axis=0)
+    corr = np.corrcoef(Z, rowvar=False)
+    L = loadings.to_numpy(dtype=float)
+
+    # rotation: the unrotated principal loadings (eigenvectors) times the rotation give the rotated loadings
+    values, vectors = np.linalg.eigh(corr)
+    unrotated = vectors[:, ::-1][:, :L.shape[1]] * np.sqrt(np.clip(values[::-1][:L.shape[1]], 0, None))
+    R = np.linalg.lstsq(unrotated, L, rcond=None)[0]
+
+    # weights of the factor values (regression method)
+    weights = np.linalg.solve(corr, L)
+
+    # clusters: centroids of the factor values
+    factors = list(loadings.columns)
+    clusters = df_CA['cluster'].astype(int).astype(str)
+    labels = sorted(clusters.unique(), key=int)
+    scores = df_CA[factors].to_numpy(dtype=float)
+    centroids = np.array([scores[(clusters == label).to_numpy()].mean(axis=0) for label in labels])
+    sizes = np.array([(clusters == label).sum() for label in labels])
+
+    model = {
+        'model version': model_version,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'columns': list(columns),
+        'factors': factors,
+        'clusters': labels,
+        'rotation method': rotation,
+        'method': method,
+        'training samples': len(df_transformed),
+        'log': log, 'mean': mean, 'std': std, 'fa mean': fa_mean, 'fa std': fa_std,
+        'loadings': L, 'unrotated loadings': unrotated, 'rotation': R, 'weights': weights,
+        'centroids': centroids, 'sizes': sizes,
+        }
+
+    # share of the training samples that get their own cluster from the Ward merge cost
+    model['training agreement'] = float((score_samples(model, df.loc[df_CA.index])['cluster'] == clusters).mean())
+    return model
+
+#%% save and load the model
+
+def save_model(model, path):
+    """
+    Saves a model as .json file (description) and .npz file with the same name (arrays).
+
+    Parameters:
+    - model (dict): Model from build_model.
+    - path (str): Path of the .json file.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    description = {key: value for key, value in model.items() if key not in model_arrays}
+    description['arrays'] = os.path.basename(os.path.splitext(path)[0] + '.npz')
+    np.savez(os.path.splitext(path)[0] + '.npz', **{key: model[key] for key in model_arrays})
+    with open(path, 'w') as file:
+        json.dump(description, file, indent=1)
+
+
+def load_model(path):
+    """
+    Loads a model saved with save_model.
+
+    Parameters:
+    - path (str): Path of the .json file.
+
+    Returns:
+    - model (dict): The model.
+    """
+    with open(path) as file:
+        model = json.load(file)
+    if model.get('model version') != model_version:
+        raise ValueError(f"Model {path} has version {model.get('model version')}, this script reads version {model_version}; build the model again with DataAnalysis.py")
+    with np.load(os.path.join(os.path.dirname(path), model['arrays'])) as arrays:
+        model.update({key: arrays[key] for key in model_arrays})
+    return model
+
+
+def model_path(repo_dir):
+    """
+    Returns the path of the model of the article: Data/WorkingData/model_v1.json.
+    """
+    return os.path.join(repo_dir, 'Data', 'WorkingData', f'model_v{model_version}.json')
+
+#%% score new samples
+
+def transform_samples(model, X):
+    """
+    Factor values of samples: log transformation, standardisation and factor score weights as one affine map.
+
+    Parameters:
+    - model (dict): The model.
+    - X: Array (samples x columns of the model) with the concentrations.
+
+    Returns:
+    - scores: Array (samples x factors), NaN for samples with missing or non-positive (log) values.
+    """
+    X = np.asarray(X, dtype=float)
+    log = model['log']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        X = np.where(log, np.log(np.where(log & (X > 0), X, np.nan)), X)
+
+    # (X - mean) / std gives Z, (Z - fa mean) / fa std @ weights gives the factor values
+    scale = model['std'] * model['fa std']
+    center = model['mean'] + model['std'] * model['fa mean']
+    return (X - center) @ (model['weights'] / scale[:, None])
+
+
+def score_samples(model, df):
+    """
+    Factor values and cluster of new samples. The cluster is the one that a Ward merge of the sample would join: the
+    lowest increase of the within-cluster sum of squares n_k / (n_k + 1) * d^2, with n_k the training samples of the
+    cluster and d the distance to its centroid in the factor space (the same criterion as the Cluster Analysis).
+
+    Parameters:
+    - model (dict): The model.
+    - df: DataFrame with the columns of the model (model['columns']).
+
+    Returns:
+    - df_scores: DataFrame with the factor values, the column 'cluster' (None for samples that cannot be scored)
+      and the column 'centroid distance' (Euclidean distance to the centroid of the cluster).
+    """
+    missing = [column for column in model['columns'] if column not in df.columns]
+    if missing:
+        raise KeyError(f'Columns of the model missing in the samples: {missing}')
+    scores = transform_samples(model, df[model['columns']].to_numpy(dtype=float))
+
+    # squared distances to all centroids at once, Ward merge cost with the sizes of the clusters
+    centroids = model['centroids']
+    distances = (scores**2).sum(axis=1)[:, None] - 2 * scores @ centroids.T + (centroids**2).sum(axis=1)[None, :]
+    sizes = np.asarray(model['sizes'], dtype=float)
+    cost = sizes / (sizes + 1) * distances
+    valid = np.isfinite(scores).all(axis=1)
+    nearest = np.where(valid, np.nan_to_num(cost).argmin(axis=1), 0)
+
+    df_scores = pd.DataFrame(scores, index=df.index, columns=model['factors'])
+    df_scores['cluster'] = np.where(valid, np.asarray(model['clusters'], dtype=object)[nearest], None)
+    df_scores['centroid distance'] = np.where(valid, np.sqrt(np.clip(distances[np.arange(len(df)), nearest], 0, None)), np.nan)
+    return df_scores
+
+#%% score the samples of the article with the model
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import DataCache
+
+    # model written by DataAnalysis.py, samples of the prepared dataset
+    model = load_model(model_path(repo_dir))
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv'))
+    df = df.loc[df['Type'].isin(['deep tubewell', 'shallow tubewell'])]
+
+    start = time.perf_counter()
+    df_scores = score_samples(model, df)
+    print(f'{len(df)} samples scored in {1000 * (time.perf_counter() - start):.1f} ms')
+    print(df_scores)
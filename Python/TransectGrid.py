@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "TransectGrid"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - interpolation of the groundwater samples on a grid along the transect (distance x depth [mMSL]), for the
+      contours beneath the samples of the cross-sections (DataVisualisation.py, figures S6)
+    - inverse distance weighting (IDW) or ordinary kriging with the nearest samples of each grid cell (KD-tree);
+      the weights of all grid cells are calculated at once and applied to all variables at once
+    - the grid cells above the surface of the elevation profile are masked
+
+"""
+#%% import modules
+import pandas as pd
+import numpy as np
+import os
+from scipy.spatial import cKDTree
+import Geospatial
+
+#%% settings of the grid
+
+# extent of the grid (distance [m] and depth [mMSL]), as the cross-sections of DataVisualisation.py
+grid_extent = (23000, 72000, 140, 270)
+
+# size of the grid cells: distance [m] and depth [m]
+grid_spacing = (250, 2)
+
+# 1 m depth counts as anisotropy m distance (the samples are kilometres apart, the depths differ tens of metres)
+anisotropy = 100
+
+# interpolation: 'idw' or 'kriging', number of nearest samples and the power of the IDW weights
+method = 'idw'
+n_neighbours = 8
+power = 2
+
+# variogram of the kriging: number of lag classes of the empirical variogram and candidate ranges of the model
+n_lags = 12
+n_ranges = 50
+
+# sample types that are interpolated (the surface water samples are at the surface)
+groundwater_types = ['deep tubewell', 'shallow tubewell']
+
+#%% grid
+
+def grid_axes(extent=grid_extent, spacing=grid_spacing):
+    """
+    Distances and depths of the centres of the grid cells.
+
+    Parameters:
+    - extent (tuple): (distance min, distance max, depth min, depth max). Default is grid_extent.
+    - spacing (tuple): (distance, depth) size of the cells. Default is grid_spacing.
+
+    Returns:
+    - distance: Array with the distances [m] of the columns.
+    - depth: Array with the depths [mMSL] of the rows.
+    """
+    distance = np.arange(extent[0] + spacing[0] / 2, extent[1], spacing[0])
+    depth = np.arange(extent[2] + spacing[1] / 2, extent[3], spacing[1])
+    return distance, depth
+
+
+def surface_mask(distance, depth, profile):
+    """
+    Grid cells below the surface of the elevation profile.
+
+    Parameters:
+    - distance, depth: Arrays with the axes of the grid (see grid_axes).
+    - profile: Array (2 x vertices) with the distance and the elevation (Geospatial.load_profile).
+
+    Returns:
+    - mask: Boolean array (depths x distances), True below the surface.
+    """
+    surface = Geospatial.surface_elevation(distance, profile)
+    return depth[:, None] <= surface[None, :]
+
+#%% weights of the grid cells
+
+def neighbours(points, targets, k=n_neighbours):
+    """
+    Nearest samples of every target point (KD-tree).
+
+    Parameters:
+    - points: Array (samples x 2) with the scaled coordinates of the samples.
+    - targets: Array (cells x 2) with the scaled coordinates of the grid cells.
+    - k (int): Number of nearest samples. Default is n_neighbours.
+
+    Returns:
+    - distances: Array (cells x k).
+    - index: Array (cells x k) with the row numbers of the samples.
+    """
+    k = min(k, len(points))
+    distances, index = cKDTree(points).query(targets, k=k)
+    return distances.reshape(len(targets), k), index.reshape(len(targets), k)
+
+
+def idw_weights(distances, power=power):
+    """
+    Inverse distance weights of all grid cells at once; a cell at a sample gets the value of the sample.
+
+    Parameters:
+    - distances: Array (cells x k) with the distances to the nearest samples.
+    - power (float): Power of the distances. Default is 2.
+
+    Returns:
+    - weights: Array (cells x k), each row sums to one.
+    """
+    exact = distances == 0
+    with np.errstate(divide='ignore'):
+        weights = np.where(exact.any(axis=1, keepdims=True), exact.astype(float), distances ** -float(power))
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+def exponential_covariance(h, nugget, sill, scale):
+    """
+    Covariance of the exponential variogram model: sill - variogram(h), with the nugget only at h > 0.
+    """
+    return np.where(h > 0, (sill - nugget) * np.exp(-h / scale), sill)
+
+
+def fit_variogram(points, Z, n_lags=n_lags, n_ranges=n_ranges, max_pairs=1000000, seed=2024):
+    """
+    Exponential variogram of the standardised variables (one model for all variables): empirical semivariance
+    over all pairs of samples and variables in lag classes, and the nugget and sill of every candidate range by
+    least squares at once; the range with the smallest error is chosen.
+
+    Parameters:
+    - points: Array (samples x 2) with the scaled coordinates.
+    - Z: Array (samples x variables) with the standardised values.
+    - n_lags (int): Number of lag classes. Default is n_lags.
+    - n_ranges (int): Number of candidate ranges. Default is n_ranges.
+    - max_pairs (int): Maximum number of pairs of samples (a random selection above it). Default is one million.
+    - seed (int): Seed of the random selection of pairs. Default is 2024.
+
+    Returns:
+    - variogram (dict): 'nugget', 'sill' and 'range' of the model, and the empirical variogram ('lags',
+      'semivariance', 'pairs').
+    """
+    n = len(points)
+    i, j = np.triu_indices(n, k=1)
+    if len(i) > max_pairs:
+        keep = np.random.default_rng(seed).choice(len(i), max_pairs, replace=False)
+        i, j = i[keep], j[keep]
+    h = np.hypot(*(points[i] - points[j]).T)
+    with np.errstate(invalid='ignore'):
+        semivariance = 0.5 * np.nanmean((Z[i] - Z[j]) ** 2, axis=1)
+    valid = np.isfinite(semivariance)
+    h, semivariance = h[valid], semivariance[valid]
+
+    # empirical variogram up to half the largest distance
+    edges = np.linspace(0, h.max() / 2, n_lags + 1)
+    lag = np.digitize(h, edges) - 1
+    inside = lag < n_lags
+    pairs = np.bincount(lag[inside], minlength=n_lags)
+    lag_h = np.bincount(lag[inside], h[inside], minlength=n_lags)
+    lag_gamma = np.bincount(lag[inside], semivariance[inside], minlength=n_lags)
+    used = pairs > 0
+    lags, gamma, weights = lag_h[used] / pairs[used], lag_gamma[used] / pairs[used], pairs[used].astype(float)
+
+    # gamma = nugget + partial sill * (1 - exp(-h / range)): linear in nugget and partial sill for each range
+    ranges = np.geomspace(edges[1] / 2, edges[-1] * 2, n_ranges)
+    f = 1 - np.exp(-lags[None, :] / ranges[:, None])
+    sw = weights.sum()
+    mean_f, mean_g = (f * weights).sum(axis=1) / sw, (gamma * weights).sum() / sw
+    cov_fg = ((f - mean_f[:, None]) * (gamma - mean_g) * weights).sum(axis=1)
+    var_f = ((f - mean_f[:, None]) ** 2 * weights).sum(axis=1)
+    partial_sill = np.clip(cov_fg / np.where(var_f > 0, var_f, np.nan), 0, None)
+    nugget = np.clip(mean_g - partial_sill * mean_f, 0, None)
+    error = (((nugget[:, None] + partial_sill[:, None] * f) - gamma) ** 2 * weights).sum(axis=1)
+    best = int(np.nanargmin(error))
+    return {'nugget': float(nugget[best]), 'sill': float(nugget[best] + partial_sill[best]), 'range': float(ranges[best]),
+            'lags': lags, 'semivariance': gamma, 'pairs': pairs[used]}
+
+
+def kriging_weights(points, targets, index, distances, variogram):
+    """
+    Ordinary kriging weights of all grid cells at once: one (k + 1) x (k + 1) system per cell with its nearest
+    samples, solved as a batch.
+
+    Parameters:
+    - points: Array (samples x 2) with the scaled coordinates.
+    - targets: Array (cells x 2) with the scaled coordinates of the grid cells.
+    - index, distances: Arrays (cells x k) with the nearest samples (see neighbours).
+    - variogram (dict): Model with 'nugget', 'sill' and 'range' (see fit_variogram).
+
+    Returns:
+    - weights: Array (cells x k), each row sums to one.
+    - variance: Array (cells) with the kriging variance (in units of the standardised variables).
+    """
+    m, k = index.shape
+    covariance = lambda h: exponential_covariance(h, variogram['nugget'], variogram['sill'], variogram['range'])
+    P = points[index]
+    A = np.ones((m, k + 1, k + 1))
+    A[:, :k, :k] = covariance(np.linalg.norm(P[:, :, None, :] - P[:, None, :, :], axis=-1))
+    A[:, k, k] = 0
+    b = np.ones((m, k + 1))
+    b[:, :k] = covariance(distances)
+
+    # duplicate samples (same distance and depth) make the system singular: a small nugget on the diagonal
+    A[:, np.arange(k), np.arange(k)] += 1e-9 * variogram['sill']
+    solution = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    weights = solution[:, :k]
+    variance = variogram['sill'] - (weights * b[:, :k]).sum(axis=1) - solution[:, k]
+    return weights, np.clip(variance, 0, None)
+
+#%% interpolation along the transect
+
+def transect_grids(df, variables, method=method, profile=None, extent=grid_extent, spacing=grid_spacing,
+                   anisotropy=anisotropy, k=n_neighbours, power=power, types=groundwater_types):
+    """
+    Interpolates variables of the groundwater samples on a grid along the transect (distance x depth), for all
+    variables at once: the nearest samples and the weights of the grid cells are calculated once.
+
+    Parameters:
+    - df: DataFrame with the samples, the variables and 'distance startpoint Yamuna [m]' and 'depth [mMSL]'.
+    - variables (list): Variables to interpolate.
+    - method (str): 'idw' or 'kriging'. Default is method.
+    - profile: Array (2 x vertices) with the elevation profile (Geospatial.load_profile), or a DataFrame with the
+      columns 'Distance_startpoint_Yamuna' and 'depth_MSL'; the cells above the surface are masked. Default is None
+      (no mask).
+    - extent (tuple): Extent of the grid. Default is grid_extent.
+    - spacing (tuple): Size of the cells (distance, depth). Default is grid_spacing.
+    - anisotropy (float): Metres of distance per metre of depth. Default is anisotropy.
+    - k (int): Number of nearest samples. Default is n_neighbours.
+    - power (float): Power of the IDW weights. Default is 2.
+    - types (list): Sample types to interpolate. Default is groundwater_types.
+
+    Returns:
+    - grid (dict): 'distance' and 'depth' (axes), 'values' (dict per variable: array depths x distances, NaN above
+      the surface), 'method', 'variogram' and 'variance' (kriging only).
+    """
+    variables = list(variables)
+    df = df.loc[df['Type'].isin(types)] if types is not None and 'Type' in df.columns else df
+    df = df.loc[df['distance startpoint Yamuna [m]'].notna() & df['depth [mMSL]'].notna()]
+    points = np.column_stack([df['distance startpoint Yamuna [m]'].to_numpy(dtype=float), anisotropy * df['depth [mMSL]'].to_numpy(dtype=float)])
+
+    # standardised values of all variables (samples x variables)
+    X = df[variables].to_numpy(dtype=float)
+    mean, std = np.nanmean(X, axis=0), np.nanstd(X, axis=0)
+    std = np.where(std > 0, std, 1)
+    Z = (X - mean) / std
+
+    distance, depth = grid_axes(extent, spacing)
+    D, H = np.meshgrid(distance, depth)
+    targets = np.column_stack([D.ravel(), anisotropy * H.ravel()])
+    distances, index = neighbours(points, targets, k)
+
+    grid = {'distance': distance, 'depth': depth, 'method': method}
+    if method == 'idw':
+        weights = idw_weights(distances, power)
+    elif method == 'kriging':
+        grid['variogram'] = fit_variogram(points, Z)
+        weights, variance = kriging_weights(points, targets, index, distances, grid['variogram'])
+        grid['variance'] = variance.reshape(D.shape)
+    else:
+        raise ValueError(f"Unknown method {method!r}, use 'idw' or 'kriging'")
+
+    # all variables at once; samples without a value of a variable are left out of its weights
+    Zn = Z[index]
+    valid = ~np.isnan(Zn)
+    w = weights[:, :, None] * valid
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = np.einsum('mk,mkv->mv', weights, np.where(valid, Zn, 0)) / w.sum(axis=1)
+    values = mean + std * values
+
+    mask = surface_mask(distance, depth, profile_array(profile)) if profile is not None else np.ones(D.shape, dtype=bool)
+    grid['values'] = {variable: np.where(mask, values[:, i].reshape(D.shape), np.nan) for i, variable in enumerate(variables)}
+    return grid
+
+
+def profile_array(profile):
+    """
+    Elevation profile as array (2 x vertices), from an array or the DataFrame of DataVisualisation.load_crosssection_data.
+    """
+    if isinstance(profile, pd.DataFrame):
+        profile = profile.sort_values('Distance_startpoint_Yamuna', kind='stable')
+        return profile[['Distance_startpoint_Yamuna', 'depth_MSL']].to_numpy(dtype=float).T
+    return np.asarray(profile)
+
+
+def grid_frame(grid, variable):
+    """
+    Interpolated values of one variable as DataFrame (depths as rows, distances as columns), e.g. to export.
+    """
+    return pd.DataFrame(grid['values'][variable], index=pd.Index(grid['depth'], name='depth [mMSL]'),
+                        columns=pd.Index(grid['distance'], name='distance startpoint Yamuna [m]'))
+
+#%% grids of the variables of the figures S6
+
+if __name__ == '__main__':
+    # set directory path: the repository is the parent directory of this Python directory
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    import time
+    import DataCache
+
+    # read dataset (output DataAnalysis.py) and the elevation profile
+    df = DataCache.read_dataset(os.path.join(repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv'))
+    profile = Geospatial.load_profile(Geospatial.profile_path(repo_dir))
+    variables = [column for column in df.columns if column in ['dO18', 'dD', 'EC value [microS/cm]', 'Cl [mg/L]', 'NO3 [mg/L]', 'U [µg/L]']]
+
+    for grid_method in ['idw', 'kriging']:
+        start = time.perf_counter()
+        grid = transect_grids(df, variables, grid_method, profile)
+        print(f"{grid_method}: {len(variables)} variables, {grid['values'][variables[0]].size} cells in {time.perf_counter() - start:.2f} s")
+    print(grid['variogram'])
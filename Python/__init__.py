@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "hindon"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - the package hindon of the scripts in this directory (pip install . in the repository), so only the package
+      hindon is installed in site-packages, with the command line interface as hindon.cli:main
+    - the scripts import each other by their file names, as when they are run from this directory; this directory is
+      added to the module search path when the package is imported, e.g. `from hindon import Pipeline`
+
+"""
+#%% import modules
+import os
+import sys
+
+#%% scripts of the package
+
+# directory of the scripts
+package_dir = os.path.dirname(os.path.abspath(__file__))
+if package_dir not in sys.path:
+    sys.path.insert(0, package_dir)
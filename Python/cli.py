@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""
+Title: "cli"
+Author: "Frank van Broekhoven"
+ORCiD: https://orcid.org/0009-0008-1593-9842
+Date: '2024-06-24'
+General info:
+
+    This script is part of the article
+    - vanBroekhoven et al.(2024) Linking recharge water sources to groundwater composition in the Hindon subbasin of the Ganges River, India.
+
+    This script is used for:
+    - command line interface of the scripts, for batch jobs:
+        hindon prepare       merge the datasets and change the BDL values (DataPreparation.py)
+        hindon analyse       factor analysis, cluster analysis and electro-neutrality check (DataAnalysis.py)
+        hindon render        figures and tables of the article, headless (DataVisualisation.py)
+        hindon pipeline      the three scripts as memoized pipeline (Pipeline.py)
+        hindon ion-balance   ion balance and hydrochemical indices of a (large) CSV file (IonChemistry.py)
+        hindon spatial       distances, surface elevation and depth [mMSL] of new samples (Geospatial.py)
+        hindon score         factor values and clusters of new samples with the saved model (ScoringModel.py)
+        hindon factors       number of factors: parallel analysis, scree test and Kaiser criterion (FactorRetention.py)
+        hindon append        append a lab batch to the sample store of all campaigns (SampleStore.py)
+        hindon query         samples of the store by campaign, type, date range or location (SampleStore.py)
+        hindon sweep         grid of settings of the factor and cluster analysis, silhouette and agreement (ParameterSweep.py)
+        hindon mixing        fractions of the recharge sources in the groundwater samples, end-member mixing (Mixing.py)
+      after `pip install .` (package hindon, entry point hindon.cli:main), or as `python cli.py <command>` in the
+      Python directory of the repository
+    - the repository and data paths are arguments; the scripts are only imported by the command that needs them,
+      so commands without figures do not import matplotlib, seaborn or geopandas
+
+"""
+#%% import modules
+import argparse
+import json
+import os
+import sys
+
+#%% commands
+
+def default_repo_dir():
+    """
+    Returns the default repository: the environment variable HINDON_REPO_DIR, or the repository of this script when
+    it is part of a checkout (the parent directory of this Python directory, with Data/StartData).
+
+    Returns:
+    - repo_dir (str): Location of the repository, None when the scripts are installed outside a checkout (e.g. with
+      pip install into site-packages) and HINDON_REPO_DIR is not set.
+    """
+    if os.environ.get('HINDON_REPO_DIR'):
+        return os.environ['HINDON_REPO_DIR']
+    checkout = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return checkout if os.path.isdir(os.path.join(checkout, 'Data', 'StartData')) else None
+
+
+def prepare(args):
+    """
+    Command 'prepare': DataPreparation.py.
+    """
+    import DataPreparation
+    paths = [args.meta, args.hydrochem, args.isotope]
+    if any(paths) and not all(paths):
+        raise SystemExit('prepare: give all three datasets (--meta, --hydrochem and --isotope) or none')
+    outpath = DataPreparation.run_preparation(args.repo_dir, paths if all(paths) else None, args.output)
+    print(f'prepared dataset: {outpath}')
+
+
+def analyse(args):
+    """
+    Command 'analyse': DataAnalysis.py.
+    """
+    import DataAnalysis
+    DataAnalysis.run_analysis(args.repo_dir, args.input, args.output, n_clusters=args.n_clusters,
+                              figures=not args.no_figures, show=False, model_path=args.model)
+
+
+def render(args):
+    """
+    Command 'render': DataVisualisation.py, headless.
+    """
+    import DataCache
+    import DataVisualisation
+    inpath = args.input or os.path.join(args.repo_dir, 'Data', 'WorkingData', 'analysed_dataset_v1.csv')
+    df = DataCache.read_dataset(inpath)
+    outpaths = DataVisualisation.render_figures(df, args.repo_dir, show=False, n_jobs=args.n_jobs, interpolation=args.interpolation)
+    print(f'{len(outpaths)} figures and tables in {os.path.join(args.repo_dir, "Output")}')
+
+
+def pipeline(args):
+    """
+    Command 'pipeline': Pipeline.py.
+    """
+    import Pipeline
+    parameters = {}
+    for setting in args.set:
+        name, _, value = setting.partition('=')
+        try:
+            parameters[name] = json.loads(value)
+        except json.JSONDecodeError:
+            parameters[name] = value
+    Pipeline.run_pipeline(args.repo_dir, parameters, targets=args.target or None, force=args.force)
+
+
+def ion_balance(args):
+    """
+    Command 'ion-balance': IonChemistry.py, in chunks.
+    """
+    import IonChemistry
+    summary = IonChemistry.process_csv(args.input, args.output, chunksize=args.chunksize, tolerance=args.tolerance,
+                                       delimiter=args.delimiter, index_col=args.index_col, encoding=args.encoding)
+    print(summary.to_string())
+
+
+def spatial(args):
+    """
+    Command 'spatial': Geospatial.py.
+    """
+    import pandas as pd
+    import Geospatial
+    df = pd.read_csv(args.input, delimiter=args.delimiter, index_col=args.index_col, encoding=args.encoding)
+    start_point, line = Geospatial.load_transect(args.repo_dir)
+    canal_index = Geospatial.build_index(Geospatial.load_segments(args.canals)) if args.canals else None
+    profile = Geospatial.load_profile(args.profile or Geospatial.profile_path(args.repo_dir))
+    features = Geospatial.spatial_features(df, start_point, line, canal_index, profile, x=args.x, y=args.y, crs=args.crs)
+    df.drop(columns=features.columns, errors='ignore').join(features).to_csv(args.output, sep=args.delimiter, encoding=args.encoding)
+    print(features.describe().to_string())
+
+
+def score(args):
+    """
+    Command 'score': ScoringModel.py.
+    """
+    import time
+    import pandas as pd
+    import ScoringModel
+    model = ScoringModel.load_model(args.model or ScoringModel.model_path(args.repo_dir))
+    df = pd.read_csv(args.input, delimiter=args.delimiter, index_col=args.index_col, encoding=args.encoding)
+    start = time.perf_counter()
+    df_scores = ScoringModel.score_samples(model, df)
+    seconds = time.perf_counter() - start
+    df.drop(columns=df_scores.columns, errors='ignore').join(df_scores).to_csv(args.output, sep=args.delimiter, encoding=args.encoding)
+    print(f"{len(df)} samples scored in {1000 * seconds:.1f} ms (model of {model['created']})")
+    print(df_scores['cluster'].value_counts(dropna=False).to_string())
+
+
+def factors(args):
+    """
+    Command 'factors': FactorRetention.py.
+    """
+    import DataAnalysis
+    import DataCache
+    import FactorRetention
+    inpath = args.input or os.path.join(args.repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv')
+    df_transformed = DataAnalysis.transform_dataset(DataCache.read_dataset(inpath), DataAnalysis.columns_to_analyse)
+    eigenvalues, n_factors = FactorRetention.factor_retention(df_transformed, n_replicates=args.replicates, simulation=args.simulation,
+                                                              percentile=args.percentile, n_jobs=args.n_jobs)
+    if args.output:
+        eigenvalues.to_csv(args.output)
+    print(n_factors.to_string())
+
+
+def append(args):
+    """
+    Command 'append': SampleStore.py.
+    """
+    import SampleStore
+    store_dir = args.store or SampleStore.store_path(args.repo_dir)
+    files = SampleStore.append_batch(store_dir, args.campaign, [args.meta, args.hydrochem, args.isotope], batch=args.batch)
+    for description in files:
+        print(f"{description['path']}: {description['rows']} samples")
+
+
+def query(args):
+    """
+    Command 'query': SampleStore.py.
+    """
+    import SampleStore
+    store_dir = args.store or SampleStore.store_path(args.repo_dir)
+    query = dict(campaigns=args.campaign, types=args.type, start=args.start, end=args.end, locations=args.location, bbox=args.bbox)
+    df = SampleStore.prepare_from_store(store_dir, **query) if args.prepare else SampleStore.read_store(store_dir, **query)
+    df.to_csv(args.output)
+    print(f'{len(df)} samples written to {args.output}')
+
+
+def sweep(args):
+    """
+    Command 'sweep': ParameterSweep.py.
+    """
+    import DataCache
+    import ParameterSweep
+    inpath = args.input or os.path.join(args.repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv')
+    outpath = args.output or os.path.join(args.repo_dir, 'Output', 'Sweep', 'parameter_sweep.csv')
+    grid = dict(ParameterSweep.sweep_grid)
+    if args.n_factors:
+        grid['n_factors'] = args.n_factors
+    if args.n_clusters:
+        grid['n_clusters'] = args.n_clusters
+    if args.linkage:
+        grid['linkage'] = args.linkage
+    df_sweep = ParameterSweep.parameter_sweep(DataCache.read_dataset(inpath), grid, n_jobs=args.n_jobs)
+    os.makedirs(os.path.dirname(os.path.abspath(outpath)), exist_ok=True)
+    df_sweep.to_csv(outpath, index=False)
+    print(f'{len(df_sweep)} configurations written to {outpath}')
+
+
+def mixing(args):
+    """
+    Command 'mixing': Mixing.py.
+    """
+    import DataCache
+    import Mixing
+    inpath = args.input or os.path.join(args.repo_dir, 'Data', 'WorkingData', 'prepared_dataset_v1.csv')
+    outpath = args.output or os.path.join(args.repo_dir, 'Output', 'Mixing', 'mixing_fractions.csv')
+    extra = json.loads(args.extra) if args.extra else Mixing.extra_end_members
+    df_mixing, df_mean = Mixing.mixing_model(DataCache.read_dataset(inpath), tracers=args.tracer or Mixing.tracers, extra=extra,
+                                             n_draws=args.draws, n_jobs=args.n_jobs)
+    os.makedirs(os.path.dirname(os.path.abspath(outpath)), exist_ok=True)
+    df_mixing.to_csv(outpath)
+    print(df_mean.to_string())
+    print(f'fractions of {len(df_mixing)} samples written to {outpath}')
+
+#%% argument parser
+
+def parser():
+    """
+    Returns the argument parser of the command line interface.
+    """
+    main_parser = argparse.ArgumentParser(prog='hindon', description='Scripts of van Broekhoven et al. (2024), Hindon subbasin.')
+    main_parser.add_argument('--repo-dir', default=default_repo_dir(),
+                             help='location of the repository (Data and Output directories), default: HINDON_REPO_DIR or the checkout of '
+                                  'these scripts; required when the scripts are installed outside a checkout')
+    main_parser.add_argument('--instrument', action='store_true', help='record the stage timings as JSON (Instrumentation.py)')
+    main_parser.add_argument('--trace-memory', action='store_true', help='also record the peak memory of the stages with tracemalloc (slows down the stages)')
+    main_parser.add_argument('--profile-stage', help='profile this stage with cProfile and tracemalloc, e.g. "factor analysis"')
+    commands = main_parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('prepare', help='merge the datasets and change the BDL values')
+    command.add_argument('--meta', help='metadata of the samples (default: Data/StartData)')
+    command.add_argument('--hydrochem', help='hydrochemistry dataset (default: Data/StartData)')
+    command.add_argument('--isotope', help='isotope dataset (default: Data/StartData)')
+    command.add_argument('--output', help='prepared dataset (default: Data/WorkingData/prepared_dataset_v1.csv)')
+    command.set_defaults(function=prepare)
+
+    command = commands.add_parser('analyse', help='factor analysis, cluster analysis and electro-neutrality check')
+    command.add_argument('--input', help='prepared dataset (default: Data/WorkingData/prepared_dataset_v1.csv)')
+    command.add_argument('--output', help='analysed dataset (default: Data/WorkingData/analysed_dataset_v1.csv)')
+    command.add_argument('--n-clusters', type=int, default=4, help='number of clusters (default: 4)')
+    command.add_argument('--no-figures', action='store_true', help='skip the figures S3 and S4')
+    command.add_argument('--model', help='model to score new samples (default: Data/WorkingData/model_v1.json)')
+    command.set_defaults(function=analyse)
+
+    command = commands.add_parser('render', help='figures and tables of the article, headless')
+    command.add_argument('--input', help='analysed dataset (default: Data/WorkingData/analysed_dataset_v1.csv)')
+    command.add_argument('--n-jobs', type=int, help='processes for the figures S6 (default: number of CPUs)')
+    command.add_argument('--interpolation', choices=['idw', 'kriging'], help='contours of the interpolated values beneath the samples of the figures S6 (TransectGrid.py)')
+    command.set_defaults(function=render)
+
+    command = commands.add_parser('pipeline', help='the three scripts as memoized pipeline')
+    command.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                         help='parameter that differs from the article, value as JSON, e.g. --set n_clusters=5 or --set crosssection_interpolation=idw')
+    command.add_argument('--target', action='append', help='stage to run (with the stages it needs), default: all')
+    command.add_argument('--force', action='append', default=[], help='stage to run even when it is memoized')
+    command.set_defaults(function=pipeline)
+
+    command = commands.add_parser('ion-balance', help='ion balance and hydrochemical indices of a CSV file, in chunks')
+    command.add_argument('input', help='CSV file with the ion concentrations [mg/L]')
+    command.add_argument('output', help='CSV file with the indices added')
+    command.add_argument('--chunksize', type=int, default=1000000, help='rows per chunk (default: 1000000)')
+    command.add_argument('--tolerance', type=float, default=5, help='tolerance of the ion balance error in %% (default: 5)')
+    command.add_argument('--delimiter', default=',', help='delimiter of the input file (default: ,)')
+    command.add_argument('--index-col', default=None, help='index column of the input file, e.g. "Sample ID"')
+    command.add_argument('--encoding', default=None, help='encoding of the input file, e.g. ISO-8859-1')
+    command.set_defaults(function=ion_balance)
+
+    command = commands.add_parser('spatial', help='distances, surface elevation and depth [mMSL] of new samples')
+    command.add_argument('input', help='CSV file with the coordinates of the samples')
+    command.add_argument('output', help='CSV file with the distances added')
+    command.add_argument('--canals', help='line file of the canal network (GeoJSON, shapefile, ...)')
+    command.add_argument('--profile', help='elevation profile, CSV or .npy (memory-mapped, see Geospatial.convert_profile); default: the profile of the article')
+    command.add_argument('--x', default='x', help='column with the x coordinate (default: x, longitude)')
+    command.add_argument('--y', default='y', help='column with the y coordinate (default: y, latitude)')
+    command.add_argument('--crs', default='EPSG:4326', help='coordinate system of the coordinates (default: EPSG:4326)')
+    command.add_argument('--delimiter', default=';', help='delimiter of the input file (default: ;)')
+    command.add_argument('--index-col', default='Sample ID', help='index column of the input file (default: Sample ID)')
+    command.add_argument('--encoding', default=None, help='encoding of the input file, e.g. ISO-8859-1')
+    command.set_defaults(function=spatial)
+
+    command = commands.add_parser('score', help='factor values and clusters of new samples with the saved model')
+    command.add_argument('input', help='CSV file with the concentrations of the samples (columns of the analysis)')
+    command.add_argument('output', help='CSV file with the factor values and clusters added')
+    command.add_argument('--model', help='model written by the analysis (default: Data/WorkingData/model_v1.json)')
+    command.add_argument('--delimiter', default=',', help='delimiter of the input file (default: ,)')
+    command.add_argument('--index-col', default='Sample ID', help='index column of the input file (default: Sample ID)')
+    command.add_argument('--encoding', default=None, help='encoding of the input file, e.g. ISO-8859-1')
+    command.set_defaults(function=score)
+
+    command = commands.add_parser('factors', help='number of factors: parallel analysis, scree test and Kaiser criterion')
+    command.add_argument('--input', help='prepared dataset (default: Data/WorkingData/prepared_dataset_v1.csv)')
+    command.add_argument('--output', help='CSV file with the eigenvalues per component')
+    command.add_argument('--replicates', type=int, default=1000, help='number of random datasets (default: 1000)')
+    command.add_argument('--simulation', choices=['normal', 'permutation'], default='normal', help='random datasets (default: normal)')
+    command.add_argument('--percentile', type=float, default=95, help='percentile of the random eigenvalues (default: 95)')
+    command.add_argument('--n-jobs', type=int, help='processes for the random datasets (default: number of CPUs)')
+    command.set_defaults(function=factors)
+
+    command = commands.add_parser('append', help='append a lab batch to the sample store of all campaigns')
+    command.add_argument('campaign', help='name of the campaign, e.g. 2023-03')
+    command.add_argument('--meta', required=True, help='metadata of the samples of the batch')
+    command.add_argument('--hydrochem', required=True, help='hydrochemistry of the batch')
+    command.add_argument('--isotope', required=True, help='isotopes of the batch')
+    command.add_argument('--batch', help='name of the batch (default: content hash of the three files)')
+    command.add_argument('--store', help='directory of the store (default: Data/SampleStore)')
+    command.set_defaults(function=append)
+
+    command = commands.add_parser('query', help='samples of the store by campaign, type, date range or location')
+    command.add_argument('output', help='CSV file with the samples')
+    command.add_argument('--campaign', action='append', help='campaign (repeat for more), default: all')
+    command.add_argument('--type', action='append', help='sample type, e.g. "deep tubewell" (repeat for more), default: all')
+    command.add_argument('--start', help='first CreationDate, e.g. 2023-03-14')
+    command.add_argument('--end', help='last CreationDate, e.g. "2023-03-15 23:59"')
+    command.add_argument('--location', action='append', help='value of the column Location (repeat for more), default: all')
+    command.add_argument('--bbox', type=float, nargs=4, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'), help='range of the coordinates x and y')
+    command.add_argument('--prepare', action='store_true', help='apply the BDL values and corrections of DataPreparation.py')
+    command.add_argument('--store', help='directory of the store (default: Data/SampleStore)')
+    command.set_defaults(function=query)
+
+    command = commands.add_parser('sweep', help='grid of settings of the factor and cluster analysis, silhouette and agreement')
+    command.add_argument('--input', help='prepared dataset (default: Data/WorkingData/prepared_dataset_v1.csv)')
+    command.add_argument('--output', help='CSV file with the table (default: Output/Sweep/parameter_sweep.csv)')
+    command.add_argument('--n-factors', type=int, nargs='+', help='numbers of factors (default: 2 to 6)')
+    command.add_argument('--n-clusters', type=int, nargs='+', help='numbers of clusters (default: 2 to 8)')
+    command.add_argument('--linkage', nargs='+', help='linkage methods (default: ward average complete)')
+    command.add_argument('--n-jobs', type=int, help='processes for the configurations (default: number of CPUs)')
+    command.set_defaults(function=sweep)
+
+    command = commands.add_parser('mixing', help='fractions of the recharge sources in the groundwater samples, end-member mixing')
+    command.add_argument('--input', help='prepared dataset (default: Data/WorkingData/prepared_dataset_v1.csv)')
+    command.add_argument('--output', help='CSV file with the fractions (default: Output/Mixing/mixing_fractions.csv)')
+    command.add_argument('--tracer', action='append', help='conservative tracer, repeatable (default: dO18, dD and Cl [mg/L])')
+    command.add_argument('--extra', help='end-members that are not sampled as JSON, e.g. \'{"rainfall": {"dO18": [mean, sd], ...}}\'')
+    command.add_argument('--draws', type=int, default=1000, help='number of Monte Carlo draws, 0 for none (default: 1000)')
+    command.add_argument('--n-jobs', type=int, default=1, help='processes for the Monte Carlo chunks (default: 1)')
+    command.set_defaults(function=mixing)
+    return main_parser
+
+
+def main(argv=None):
+    """
+    Entry point of the command line interface.
+
+    Parameters:
+    - argv (list, optional): Arguments. Default is None (sys.argv).
+    """
+    main_parser = parser()
+    args = main_parser.parse_args(argv)
+    if args.repo_dir is None:
+        main_parser.error('the scripts are not in a checkout of the repository: give the repository with --repo-dir or HINDON_REPO_DIR')
+    args.repo_dir = os.path.abspath(args.repo_dir)
+
+    # batch jobs render without a display
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+
+    # the scripts import each other as modules from this directory
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    if script_dir not in sys.path:
+        sys.path.insert(0, script_dir)
+
+    import Instrumentation
+    Instrumentation.output_repo_dir = args.repo_dir
+    if args.instrument or args.profile_stage or args.trace_memory:
+        Instrumentation.enable(profile=args.profile_stage, memory=True if args.trace_memory else None)
+    args.function(args)
+    Instrumentation.write_records(args.command, repo_dir=args.repo_dir)
+
+
+if __name__ == '__main__':
+    main()
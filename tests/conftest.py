@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+"""
+Test settings: the scripts import each other as modules from the Python directory, figures are rendered headless.
+"""
+import os
+import sys
+import matplotlib
+
+matplotlib.use('Agg')
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script_dir = os.path.join(repo_dir, 'Python')
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
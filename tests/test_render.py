@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Render test: the pipeline with more clusters than the palette of the article (n_clusters=5) renders the figures.
+"""
+import os
+import shutil
+
+from conftest import repo_dir
+
+
+def test_render_five_clusters(tmp_path):
+    import Pipeline
+    import DataVisualisation
+
+    # repository with the start data and the output folders only, so all stages are run
+    shutil.copytree(os.path.join(repo_dir, 'Data', 'StartData'), tmp_path / 'Data' / 'StartData')
+    (tmp_path / 'Data' / 'WorkingData').mkdir()
+    (tmp_path / 'Output' / 'Supplementary Material').mkdir(parents=True)
+
+    # one figure S6 keeps the test short
+    parameters = {'n_clusters': 5, 'variables_to_plot': ['Cl [mg/L]']}
+    report, results = Pipeline.run_pipeline(str(tmp_path), parameters, targets=['render'])
+    assert report.loc['render', 'status'] == 'run'
+
+    df = results['analysed']['analysed_dataset']
+    clusters = df.loc[df['Type'].isin(DataVisualisation.groundwater_types), 'cluster'].astype(str).unique()
+    assert sorted(clusters) == ['1', '2', '3', '4', '5']
+    for name in ['Figure_2.pdf', 'Figure_3.pdf', 'Figure_5.pdf']:
+        assert (tmp_path / 'Output' / name).exists()
+
+    # the extra cluster gets a colour, the clusters of the article keep theirs
+    palette = DataVisualisation.cluster_colours(df['cluster'])
+    assert '5' in palette
+    assert all(palette[level] == colour for level, colour in DataVisualisation.cluster_palette.items())